@@ -0,0 +1,64 @@
+# Measure the accuracy and latency of the entity resolution of filter names on misspelled and reworded dimension values
+#   python -m benchmarks.bench_entity_resolution --vendors 2000
+
+import time
+import random
+import argparse
+
+from bi_agent.synthetic import CATEGORY_NAMES, DEPARTMENT_NAMES, MARKET_NAMES
+from bi_agent.entity_resolution import EntityIndex
+
+
+# Names like those of real vendors, added to the synthetic 'Vendor 00042' ones
+VENDOR_NAMES = ['Mallory Safety & Supply', 'Medline Industries, Inc.', 'Johnson Controls', 'Cardinal Health', 'Owens & Minor',
+                'Stryker Corporation', 'Becton Dickinson', 'Cintas Corporation', 'Aramark Healthcare', 'Siemens Healthineers']
+
+
+# Ways the LLM rewrites a name: (name of the variant, function of a name and a random generator)
+def drop_letter(name, rng):
+    position = rng.randrange(len(name))
+    return name[:position] + name[position + 1:] if name[position].isalpha() else name.lower()
+
+VARIANTS = {
+    'lower case'    : lambda name, rng: name.lower(),
+    'ampersand'     : lambda name, rng: name.replace('&', 'and') if '&' in name else name.replace(' and ', ' & '),
+    'reordered'     : lambda name, rng: ' '.join(reversed(name.split())),
+    'missing letter': drop_letter,
+    'no suffix'     : lambda name, rng: name.replace(', Inc.', '').replace(' Corporation', ''),
+}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the entity resolution of filter names')
+    parser.add_argument('--vendors', type=int, default=2000, help='synthetic vendor names in the index')
+    parser.add_argument('--seed',    type=int, default=0)
+    args = parser.parse_args()
+    rng  = random.Random(args.seed)
+
+    columns = {'vendor': VENDOR_NAMES + [f'Vendor {i:05d}' for i in range(args.vendors)], 'category': CATEGORY_NAMES,
+               'department': DEPARTMENT_NAMES, 'market': MARKET_NAMES}
+    for column, values in columns.items():
+        started = time.perf_counter()
+        index   = EntityIndex(values)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        names = [values[i] for i in range(len(values)) if column != 'vendor' or i < len(VENDOR_NAMES) + 20]
+        print(f'{column} ({len(values):,} values, index built in {build_ms:.1f} ms)')
+        for variant, rewrite in VARIANTS.items():
+            queries = [(rewrite(name, rng), name) for name in names]
+            started = time.perf_counter()
+            results = [index._resolve(query) for query, _ in queries]
+            lookup_us = (time.perf_counter() - started) / len(queries) * 1e6
+            right = sum(value == name for (value, _), (_, name) in zip(results, queries))
+            wrong = sum(value is not None and value != name for (value, _), (_, name) in zip(results, queries))
+            print(f'  {variant:15s} {right:4d} right, {wrong:3d} wrong, {len(queries) - right - wrong:3d} unmatched  {lookup_us:7.1f} us per name')
+
+        started = time.perf_counter()
+        for _ in range(100_000):
+            index.resolve(names[0].lower())
+        print(f'  {"cached":15s} {(time.perf_counter() - started) / 100_000 * 1e6:7.2f} us per name')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# Page-level benchmark: drives streamlit_app.py and every page with Streamlit's AppTest against the local mock LLM server
+# (benchmarks.mock_llm_server), offline and without API keys. For each page it measures the first render of a new
+# session, a rerun without input, the rerun answering a question (LLM latency of the mock included), and the memory
+# retained by one session.
+#   python -m benchmarks.bench_pages --sessions 3 --questions 3 --first-token-ms 300 --token-ms 20
+
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+from benchmarks.mock_llm_server import MockLLMServer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUESTIONS = [
+    "Show me this year's spend by vendor for flooring repairs",
+    'What are the top 10 vendors of HVAC Maintenance?',
+    'Median transaction amount by category for the last 12 months',
+    'Where does Vendor 00042 have market share?',
+]
+
+
+def ask_chat(app, question):
+    app.chat_input[0].set_value(question)
+    return app.run()
+
+def ask_form(app, question):
+    app.text_area[0].set_value(question)
+    app.button[0].click()
+    return app.run()
+
+# (page, how a question is asked, or None when the page takes no question)
+PAGES = [
+    ('streamlit_app.py',                                        None),
+    ('pages/1_ChatGPT_3.5_Simple_Example.py',                   ask_chat),
+    ('pages/2_ChatGPT_4_Questions_with_Function_Calling.py',    ask_chat),
+    ('pages/3_ChatGPT_4_Questions_with_Open_Source_Model.py',   ask_chat),
+    ('pages/4_LangChain_Example.py',                            ask_form),
+]
+
+
+def app_secrets(args, transactions_path):
+    secrets = {
+        'openai'   : {'key': 'sk-mock', 'stream': not args.no_stream},
+        'replicate': {'key': 'r8-mock'},
+        'data'     : {'transactions_path': transactions_path},
+    }
+    if not args.with_caches:  # every question goes to the (mock) model
+        secrets['cache'] = {'ttl_seconds': 0}
+        secrets['semantic_cache'] = {'threshold': 1.01}
+    return secrets
+
+
+def timed_run(run):
+    start = time.perf_counter()
+    app = run()
+    return app, (time.perf_counter() - start) * 1000
+
+
+# One session of a page: first render, reruns without input, and one rerun per question. Returns the app and timings.
+def run_session(page, ask, secrets, questions, reruns, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(ROOT, page), default_timeout=timeout)
+    for section, values in secrets.items():
+        app.secrets[section] = values
+
+    app, first_ms = timed_run(app.run)
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    idle_ms     = [timed_run(app.run)[1] for _ in range(reruns)]
+    question_ms = [timed_run(lambda: ask(app, question))[1] for question in questions] if ask else []
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    return app, first_ms, idle_ms, question_ms
+
+
+def percentile(values, q):
+    return f'{np.percentile(values, q):8.1f}' if values else '     n/a'
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the pages of the app with AppTest and a mock LLM server')
+    parser.add_argument('--sessions',       type=int,   default=3)
+    parser.add_argument('--questions',      type=int,   default=3)
+    parser.add_argument('--reruns',         type=int,   default=5)
+    parser.add_argument('--rows',           type=int,   default=200_000, help='rows of the synthetic transactions table')
+    parser.add_argument('--first-token-ms', type=float, default=300)
+    parser.add_argument('--token-ms',       type=float, default=20)
+    parser.add_argument('--timeout',        type=float, default=120)
+    parser.add_argument('--no-stream',      action='store_true', help='ask the OpenAI models for complete responses')
+    parser.add_argument('--with-caches',    action='store_true', help='keep the response and semantic caches (repeated questions are answered from them)')
+    parser.add_argument('--pages',          nargs='+',  default=[page for page, _ in PAGES])
+    args = parser.parse_args()
+
+    # Point the API clients at the mock server (before the pages import them)
+    mock = MockLLMServer(first_token_ms=args.first_token_ms, token_ms=args.token_ms).start()
+    os.environ['OPENAI_API_BASE']    = f'{mock.url}/v1'
+    os.environ['REPLICATE_BASE_URL'] = mock.url
+    import openai
+    openai.api_base = f'{mock.url}/v1'
+
+    from bi_agent.synthetic import generate_transactions
+    transactions_path = os.path.join(tempfile.mkdtemp(), 'transactions.parquet')
+    generate_transactions(args.rows).to_parquet(transactions_path)
+    secrets   = app_secrets(args, transactions_path)
+    questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(args.questions)]
+    print(f'mock LLM server at {mock.url} (first token {args.first_token_ms:.0f} ms, {args.token_ms:.0f} ms per token), {args.rows:,} transactions')
+
+    print(f'{"page":55s} {"cold start":>10s} {"first p50":>9s} {"rerun p50":>9s} {"rerun p95":>9s} {"question p50":>12s} {"question p95":>12s} {"MB/session":>10s}')
+    for page, ask in PAGES:
+        if page not in args.pages:
+            continue
+        try:
+            # Timings: the first session also builds the shared resources (engine, caches, prompts) of the process
+            first, idle, asked = [], [], []
+            for session in range(args.sessions):
+                _, first_ms, idle_ms, question_ms = run_session(page, ask, secrets, questions, args.reruns, args.timeout)
+                first.append(first_ms)
+                idle  += idle_ms
+                asked += question_ms
+
+            # Memory retained by one more session (shared resources already built)
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            app = run_session(page, ask, secrets, questions, 0, args.timeout)[0]
+            retained_mb = (tracemalloc.get_traced_memory()[0] - before) / 2**20
+            tracemalloc.stop()
+            del app
+        except Exception as error:
+            tracemalloc.stop()
+            print(f'{page:55s} skipped: {error}')
+            continue
+
+        print(f'{page:55s} {first[0]:10.1f} {percentile(first[1:], 50):>9s} {percentile(idle, 50):>9s} {percentile(idle, 95):>9s} '
+              f'{percentile(asked, 50):>12s} {percentile(asked, 95):>12s} {retained_mb:10.2f}')
+    mock.stop()
+
+
+if __name__ == '__main__':
+    main()
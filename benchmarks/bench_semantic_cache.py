@@ -0,0 +1,91 @@
+# Tune the similarity threshold of the semantic cache on labelled question pairs, and measure hit rate and lookup latency
+#   python -m benchmarks.bench_semantic_cache --stored 1000
+
+import time
+import argparse
+import numpy as np
+
+from bi_agent.semantic_cache import HashingEmbedder, SemanticCache, question_entities, tune_threshold
+
+
+# (question, question, answered by the same report?)
+LABELLED_PAIRS = [
+    ('spend by vendor for flooring this year', "this year's flooring spend per vendor", True),
+    ('show total spend by hospital last year', 'total spend per hospital for last year', True),
+    ('top 5 vendors in HVAC maintenance', 'what are the top 5 vendors of HVAC Maintenance?', True),
+    ('How much did we spend on HVAC Maintenance last quarter?', 'HVAC maintenance spend last quarter', True),
+    ('Spend per GL account and vendor for New Flooring Installation year to date', 'year to date spend of new flooring installation by vendor and gl account', True),
+    ('median transaction amount by category for the last 12 months', 'last 12 months median amount per category', True),
+    ('Where does Vendor 00042 have market share?', 'markets served by vendor 00042 and their share', True),
+    ('spend by vendor for flooring this year', 'spend by vendor for flooring last year', False),
+    ('spend by vendor for flooring this year', 'spend by hospital for flooring this year', False),
+    ('top 5 vendors in HVAC maintenance', 'top 10 vendors in HVAC maintenance', False),
+    ('spend in 2022 by month', 'spend in 2023 by month', False),
+    ('median spend by category', 'average spend by category', False),
+    ('Hospital 0010 benchmarking for HVAC', 'Hospital 0011 benchmarking for HVAC', False),
+    ('number of vendors per category last year', 'number of p80 vendors per category last year', False),
+    ('average amount by category for Lab Services last 3 years', 'average amount by category for Food Services last 3 years', False),
+    ('number of vendors by quarter for Food Services last 12 months', 'number of vendors by month for Food Services last 12 months', False),
+    ('total spend by vendor for Flooring Repairs last 12 months', 'total spend by month for Flooring Repairs last 12 months', False),
+    ('total spend of Hospital 0010 with Vendor 00042 last year', 'total spend of Hospital 00042 with Vendor 0010 last year', False),
+    ('spend for Vendor A in Hospital B', 'spend for Vendor B in Hospital A', False),
+]
+
+SUBJECTS   = ['spend', 'number of vendors', 'median amount', 'transaction volume', 'average amount']
+GROUPINGS  = ['vendor', 'hospital', 'category', 'department', 'gl account', 'month', 'quarter']
+CATEGORIES = ['Flooring Repairs', 'HVAC Maintenance', 'Pharmacy', 'Lab Services', 'Imaging Equipment', 'Food Services']
+PERIODS    = ['this year', 'last year', 'last quarter', 'last 12 months', 'year to date', 'last 3 years']
+
+
+def all_questions():
+    return [f'{s} by {g} for {c} {p}' for s in SUBJECTS for g in GROUPINGS for c in CATEGORIES for p in PERIODS]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the semantic cache')
+    parser.add_argument('--stored',        type=int,   default=1_000)
+    parser.add_argument('--lookups',       type=int,   default=1_000)
+    parser.add_argument('--min-precision', type=float, default=0.98)
+    parser.add_argument('--seed',          type=int,   default=0)
+    args = parser.parse_args()
+
+    embed = HashingEmbedder()
+    threshold, precision, recall = tune_threshold(embed, LABELLED_PAIRS, args.min_precision)
+    print(f'tuned threshold        : {threshold:.3f} (precision {precision:.2f}, recall {recall:.2f} on {len(LABELLED_PAIRS)} labelled pairs)')
+    scores = [float(embed([a])[0] @ embed([b])[0]) for a, b, _ in LABELLED_PAIRS]
+    for (a, b, same), score in sorted(zip(LABELLED_PAIRS, scores), key=lambda item: -item[1]):
+        entities = '' if question_entities(a) == question_entities(b) else '  (other entities: never a hit)'
+        print(f'  {score:5.3f} {"same" if same else "diff"}  {a!r} / {b!r}{entities}')
+
+    # Questions whose entities are swapped embed to the same vector: the cache must not answer one with the other
+    cache = SemanticCache(embed, threshold=threshold)
+    swapped = [(a, b) for a, b, same in LABELLED_PAIRS if not same and question_entities(a) != question_entities(b)]
+    for number, (a, _) in enumerate(swapped):
+        cache.store(a, {'name': 'generate_and_send_generic_spend_report', 'arguments': {'question': number}})
+    print(f'entity-swapped pairs   : {sum(cache.lookup(b)[0] is not None for _, b in swapped)} wrong hits on {len(swapped)} pairs')
+
+    # Questions from a small grammar: some are stored, lookups are reworded stored questions (words shuffled) or questions never stored
+    rng   = np.random.default_rng(args.seed)
+    cache = SemanticCache(embed, threshold=threshold)
+    questions = list(rng.permutation(all_questions()))
+    stored, unseen = questions[:args.stored], questions[args.stored:]
+    start = time.perf_counter()
+    for number, question in enumerate(stored):
+        cache.store(question, {'name': 'generate_and_send_generic_spend_report', 'arguments': {'question': number}})
+    print(f'store {args.stored:,} questions : {time.perf_counter() - start:8.3f} s')
+
+    repeats, false_hits = 0, 0
+    for _ in range(args.lookups):
+        if rng.random() < 0.5 or not unseen:
+            question = ' '.join(rng.permutation(rng.choice(stored).split()))
+            repeats += 1
+            cache.lookup(question)
+        else:
+            false_hits += cache.lookup(rng.choice(unseen))[0] is not None
+    stats = cache.stats()
+    print(f'lookups                : {stats["lookups"]:,} ({repeats:,} reworded repeats), hit rate {100 * stats["hit_rate"]:.1f}%, {false_hits} wrong hits on new questions, {stats["avg_lookup_ms"]:.2f} ms per lookup')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+# Benchmark the spend report engine on a synthetic transactions table
+#   python -m benchmarks.bench_spend_engine --rows 20000000
+
+import time
+import argparse
+import datetime
+import tracemalloc
+import numpy as np
+
+from bi_agent.synthetic import generate_transactions
+from bi_agent.spend_engine import TEXT_COLUMNS, SpendEngine
+from bi_agent.market_share import MarketShareEngine
+
+
+QUERIES = {
+    'grand totals': dict(),
+    'ytd by vendor': dict(
+        dimensions=['vendor_name'],
+        metrics=['total_volume', 'total_amount', 'avg_amount'],
+        time_period_filter_list=['YEAR TO DATE'],
+    ),
+    'flooring by gl account and vendor': dict(
+        dimensions=['gl_account_name', 'vendor_name'],
+        metrics=['total_amount'],
+        category_filter_list=['Flooring Repairs', 'New Flooring Installation'],
+        time_period_filter_list=['YEAR TO DATE'],
+    ),
+    'fiscal quarters with percentiles': dict(
+        dimensions=['transaction_quarter'],
+        metrics=['total_volume', 'min_amount', 'max_amount', 'p50_amount', 'p90_amount'],
+        time_period_filter_list=['LAST 6 QUARTERS'],
+        fiscal_calendar=True,
+    ),
+    'vendor concentration by category': dict(
+        dimensions=['category_name'],
+        metrics=['num_vendors', 'num_p80_vendors'],
+        time_period_filter_list=['LAST YEAR', 'STLY'],
+    ),
+    'one vendor, all time, median': dict(
+        dimensions=['transaction_year'],
+        metrics=['total_volume', 'p50_amount'],
+        vendor_filter_list=['Vendor 00500'],
+    ),
+    'hospital and category, median': dict(
+        dimensions=['department_name'],
+        metrics=['total_amount', 'p50_amount'],
+        hospital_filter_list=['Hospital 0010'],
+        category_filter_list=['HVAC Maintenance'],
+        time_period_filter_list=['LAST 3 YEARS'],
+    ),
+    'hospital by month': dict(
+        dimensions=['hospital_name', 'transaction_month'],
+        metrics=['total_volume', 'total_amount'],
+        hospital_filter_list=['Hospital 0001', 'Hospital 0002'],
+        time_period_filter_list=['LAST 12 MONTHS'],
+    ),
+}
+
+# Non-additive queries, answered exactly from the transactions and approximately from the rollup sketches
+APPROXIMATE_QUERIES = {
+    'percentiles by category': dict(
+        dimensions=['category_name'],
+        metrics=['p50_amount', 'p90_amount', 'p99_amount'],
+    ),
+    'vendors by hospital and quarter': dict(
+        dimensions=['hospital_name', 'transaction_quarter'],
+        metrics=['num_vendors', 'p50_amount'],
+        time_period_filter_list=['LAST 8 QUARTERS'],
+    ),
+    'vendors by gl account, ytd': dict(
+        dimensions=['gl_account_name'],
+        metrics=['num_vendors', 'p95_amount'],
+        time_period_filter_list=['YEAR TO DATE'],
+    ),
+}
+
+MARKET_SHARE_QUERIES = {
+    'market share top 5, last year': dict(report='market_share_report', arguments=dict(
+        share_metric='spend_share', top_n=5, time_period_filter_list=['LAST YEAR'],
+    )),
+    'market share of one vendor, last year': dict(report='market_share_report', arguments=dict(
+        share_metric='spend_share', vendor_filter_list=['Vendor 00003'], time_period_filter_list=['LAST YEAR'],
+    )),
+    'market share map of one vendor, last year': dict(report='vendor_market_share_map', arguments=dict(
+        share_metric='volume_share', vendor_filter_list=['Vendor 00042'], time_period_filter_list=['LAST YEAR'],
+    )),
+}
+
+
+def time_call(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+# Peak memory allocated by one call (numpy and pandas buffers included), in bytes
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the spend report engine')
+    parser.add_argument('--rows',   type=int, default=10_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed',   type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    transactions = generate_transactions(args.rows, seed=args.seed)
+    print(f'generate {args.rows:,} rows: {time.perf_counter() - start:8.3f} s')
+
+    start = time.perf_counter()
+    engine = SpendEngine(transactions, sketches=True)
+    print(f'load engine and rollups: {time.perf_counter() - start:8.3f} s (sketches included)')
+
+    sample = transactions.head(100_000).astype({c: object for c in TEXT_COLUMNS})
+    print(f'memory per row         : {sample.memory_usage(deep=True).sum() / len(sample):8.1f} B as strings, {engine.memory_per_row():.1f} B encoded and indexed')
+
+    today = datetime.date.today()
+    for name, query in QUERIES.items():
+        seconds, report = time_call(lambda: engine.generic_spend_report(today=today, **query), args.repeat)
+        stats = engine.last_query_stats
+        print(f'{name:40s} {seconds * 1000:9.1f} ms  {len(report):>7,} output rows  {stats["rows_scanned"]:>12,} rows scanned from {stats["source"]}')
+
+    # Exact vs sketch answers: latency, peak query memory and largest relative error per metric (sketches are built with
+    # the rollups)
+    for name, query in APPROXIMATE_QUERIES.items():
+        exact_seconds, exact = time_call(lambda: engine.generic_spend_report(today=today, **query), args.repeat)
+        exact_peak = peak_memory(lambda: engine.generic_spend_report(today=today, **query))
+        start = time.perf_counter()
+        engine.generic_spend_report(today=today, approximate=True, **query)
+        first_seconds = time.perf_counter() - start
+        sketch_seconds, sketch = time_call(lambda: engine.generic_spend_report(today=today, approximate=True, **query), args.repeat)
+        sketch_peak = peak_memory(lambda: engine.generic_spend_report(today=today, approximate=True, **query))
+        errors = ', '.join(f'{m} {100 * np.nanmax(np.abs(sketch[m] - exact[m]) / np.abs(exact[m])):.2f}%' for m in query['metrics'])
+        print(f'{name:40s} {exact_seconds * 1000:9.1f} ms exact, {sketch_seconds * 1000:.1f} ms sketch ({first_seconds * 1000:.1f} ms first)  '
+              f'peak {exact_peak / 2 ** 20:.1f} MiB exact, {sketch_peak / 2 ** 20:.1f} MiB sketch  max error: {errors}')
+    rollup_bytes = sum(int(r.table.memory_usage(deep=True).sum()) for r in engine.rollups.rollups)
+    sketch_bytes = sum(r.sketches.nbytes for r in engine.rollups.rollups if r.sketches is not None)
+    print(f'rollup memory          : {rollup_bytes / 2 ** 20:8.1f} MiB exact aggregates, {sketch_bytes / 2 ** 20:.1f} MiB sketches')
+
+    # Market share: the first request builds the market table, the next ones (other vendors, same markets) reuse it
+    market_share = MarketShareEngine(engine)
+    for name, query in MARKET_SHARE_QUERIES.items():
+        start  = time.perf_counter()
+        report = getattr(market_share, query['report'])(today=today, **query['arguments'])
+        stats  = engine.last_query_stats
+        print(f'{name:40s} {(time.perf_counter() - start) * 1000:9.1f} ms  {len(report):>7,} output rows  {stats["rows_scanned"]:>12,} rows scanned from {stats["source"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# Cost of finding the report functions of page 2: the former scan of inspect.stack() (every frame's globals, on every
+# rerun) against the tool registry (schemas generated once at import, dispatch by name)
+#   python -m benchmarks.bench_tool_registry --depths 10 30 60
+
+import time
+import types
+import inspect
+import argparse
+import importlib
+
+import bi_agent.report_tools
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+# The scan page 2 ran on every rerun before the registry
+def scan_stack(names):
+    return {name: func
+            for frame_info in inspect.stack()
+            for name, func in frame_info.frame.f_globals.items()
+            if isinstance(func, types.FunctionType) and name in names}
+
+
+def at_depth(depth, function):
+    return at_depth(depth - 1, function) if depth > 0 else function()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the tool registry')
+    parser.add_argument('--depths', type=int, nargs='+', default=[10, 30, 60])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    report_tools = importlib.reload(bi_agent.report_tools).report_tools
+    print(f'import and register {len(report_tools.functions)} tools : {(time.perf_counter() - start) * 1000:8.2f} ms (once per process)')
+
+    names = [schema['name'] for schema in report_tools.schemas.values()]
+    globals().update(report_tools.functions)  # the functions were globals of the page script
+    for depth in args.depths:
+        found = at_depth(depth, lambda: scan_stack(names))
+        print(f'inspect.stack() scan, depth {depth:3d} : {at_depth(depth, lambda: timed(lambda: scan_stack(names), args.repeat)):8.3f} ms per rerun ({len(found)} functions found)')
+
+    def rerun():
+        report_tools.version
+        report_tools.tools()
+        for name in names:
+            report_tools[name]
+    print(f'registry, per rerun          : {timed(rerun, args.repeat * 100):8.4f} ms (version, tool list and {len(names)} lookups)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+# Batch evaluation of the BI agent on benchmark questions, on the GPT-4 function calling backend (page 2) and the Llama-2
+# JSON report backend (page 3). Questions run concurrently with asyncio (bounded by --concurrency). Each answer is scored
+# against the expected report and arguments, and the throughput, latency distribution and token cost are reported.
+# Answers are stored in a SQLite file keyed by backend, prompt version and question: a rerun only asks the new questions
+# (or all of them after a prompt change), and an interrupted run resumes where it stopped.
+#   python -m benchmarks.eval_agents --questions benchmarks/eval_questions.jsonl --backends gpt-4 llama-2 --concurrency 8
+#   python -m benchmarks.eval_agents --mock   (offline, against benchmarks.mock_llm_server)
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import argparse
+import numpy as np
+
+from bi_agent.json_report_agent import TOOL_NAMES
+
+
+QUESTIONS_PATH = os.path.join(os.path.dirname(__file__), 'eval_questions.jsonl')
+RESULTS_PATH   = 'eval_results.db'
+
+# US$ per 1,000 prompt and completion tokens
+PRICES = {
+    'gpt-4'           : (0.03, 0.06),
+    'llama-2-70b-chat': (0.00065, 0.00275),
+}
+
+# Report structures of page 3 (the names used in the expected answers), by report function of page 2
+REPORT_NAMES = {tool: report for report, tool in TOOL_NAMES.items()}
+NO_REPORT = 'generate_error_message'
+_UNSCORED_ARGUMENTS = {'function', 'report', 'title', 'user_request', 'reason'}
+
+
+# Arguments with the names of the page 3 structures (page 2 filters end with _list), without the unscored ones and
+# the empty or false ones (same report as when they are left out)
+def canonical_arguments(arguments):
+    return {name.removesuffix('_list'): value for name, value in arguments.items()
+            if name not in _UNSCORED_ARGUMENTS and value is not False and value not in (None, [], '')}
+
+
+#%%######################################################################################################################
+# BACKENDS
+#########################################################################################################################
+
+class FunctionCallingBackend:
+
+    name = 'gpt-4'
+
+    def __init__(self):
+        from bi_agent.prompts import AgentPrompt
+        from bi_agent.report_tools import report_tools
+        from bi_agent.function_calling_agent import AGENT_NAME, MODEL, agent_version, build_agent_prompt
+        self.model  = MODEL
+        self.tools  = report_tools
+        self.prompt = AgentPrompt(AGENT_NAME, MODEL, agent_version(), **build_agent_prompt())
+        self.version = self.prompt.version
+
+    def argument_names(self, report):
+        function = next((name for name, structure in REPORT_NAMES.items() if structure == report), None)
+        return set(canonical_arguments({name: True for name in self.tools.schemas[function]['parameters']['properties']})) if function else set()
+
+    # Same request as page 2: system message, the question, the tools
+    async def answer(self, question, client):
+        from bi_agent.history import count_text_tokens
+        response = await client.achat_completion(None,  # API key of the environment
+                                                 model       = self.model,
+                                                 messages    = [{"role": "system", "content": self.prompt.system_message}, {"role": "user", "content": question}],
+                                                 tools       = self.prompt.tools,
+                                                 tool_choice = 'auto',
+                                                 temperature = 0.5,
+                                                 )
+        message = response.choices[0].message.to_dict_recursive()
+        report, arguments = NO_REPORT, {}
+        for call in message.get('tool_calls') or []:  # the first call is scored
+            report = REPORT_NAMES.get(call['function']['name'], call['function']['name'])
+            try:
+                arguments = self.tools.parse_arguments(call['function']['name'], call['function']['arguments'])[0]
+            except ValueError:
+                arguments = {}
+            break
+        prompt_tokens = response['usage']['prompt_tokens'] or self.prompt.system_tokens + self.prompt.tools_tokens + count_text_tokens(question, self.model)
+        return {'report': report, 'arguments': canonical_arguments(arguments), 'output': message,
+                'prompt_tokens': prompt_tokens, 'completion_tokens': response['usage']['completion_tokens']}
+
+
+class JsonReportBackend:
+
+    name = 'llama-2'
+
+    def __init__(self):
+        from bi_agent.prompts import AgentPrompt
+        from bi_agent import json_report_agent
+        self.agent  = json_report_agent
+        self.model  = json_report_agent.MODEL
+        self.prompt = AgentPrompt(json_report_agent.AGENT_NAME, self.model, json_report_agent.agent_version(), **json_report_agent.build_agent_prompt())
+        self.version = self.prompt.version
+
+    def argument_names(self, report):
+        return set(canonical_arguments({name: True for name in self.agent.functions_definitions.get(report, {})}))
+
+    # Same request as page 3: the output is streamed until the JSON report is complete, then the prediction is canceled
+    async def answer(self, question, client):
+        from bi_agent.history import count_text_tokens
+        from bi_agent.streaming import JsonObjectScanner
+
+        prompt = self.prompt.prompt(question)
+        prediction = await client.acreate_prediction(None,  # API token of the environment
+                                                     version = self.agent.LLAMA2_VERSION,
+                                                     input   = {"prompt": prompt, "system_prompt": self.prompt.system_message, **self.agent.LLAMA2_PARAMETERS},
+                                                     stream  = True,
+                                                     )
+        scanner, tokens, output = JsonObjectScanner(), 0, []
+        async for event in prediction.async_stream():
+            if token := str(event):
+                tokens += 1
+                end = scanner.feed(token)
+                output.append(token[:end])
+                if end is not None:
+                    break
+        if scanner.complete:
+            await client.acall(prediction.async_cancel)
+
+        output = ''.join(output)
+        report = self.agent.parse_report(output)
+        return {'report': report['function'] if report else NO_REPORT, 'arguments': canonical_arguments(report or {}), 'output': output,
+                'prompt_tokens': self.prompt.system_tokens + count_text_tokens(prompt, self.model), 'completion_tokens': tokens}
+
+
+BACKENDS = {backend.name: backend for backend in (FunctionCallingBackend, JsonReportBackend)}
+
+
+#%%######################################################################################################################
+# SCORING
+#########################################################################################################################
+
+def _normalize(value):
+    if isinstance(value, list):
+        return sorted(str(item).strip().lower() for item in value)
+    if isinstance(value, str):
+        return value.strip().lower()
+    return value
+
+
+# Report chosen (right or wrong) and share of the expected arguments found, where extra arguments count as misses. Only
+# the arguments the backend can express are expected (e.g. the JSON structures of page 3 have no share_metric).
+def score_answer(expected, answer, argument_names):
+    if answer['report'] != expected['report']:
+        return {'report_ok': False, 'arguments_score': 0.0, 'exact': False}
+    wanted  = {name: value for name, value in expected.get('arguments', {}).items() if name in argument_names}
+    matches = sum(_normalize(answer['arguments'].get(name)) == _normalize(value) for name, value in wanted.items())
+    extra   = len(set(answer['arguments']) - set(wanted))
+    total   = len(wanted) + extra
+    return {'report_ok': True, 'arguments_score': matches / total if total else 1.0, 'exact': matches == total}
+
+
+#%%######################################################################################################################
+# RESULTS
+#########################################################################################################################
+
+class ResultStore:
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS answers (backend TEXT, version TEXT, question_key TEXT, question TEXT,
+                                   answer TEXT, latency_ms REAL, evaluated_at REAL, PRIMARY KEY (backend, version, question_key))''')
+        self.connection.commit()
+
+    @staticmethod
+    def key(question):
+        return hashlib.sha256(question.strip().encode()).hexdigest()
+
+    def answers(self, backend, version):
+        rows = self.connection.execute('SELECT question_key, answer, latency_ms FROM answers WHERE backend = ? AND version = ?', (backend, version))
+        return {key: (json.loads(answer), latency_ms) for key, answer, latency_ms in rows}
+
+    def put(self, backend, version, question, answer, latency_ms):
+        self.connection.execute('INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (backend, version, self.key(question), question, json.dumps(answer), latency_ms, time.time()))
+        self.connection.commit()
+
+
+#%%######################################################################################################################
+# EVALUATION
+#########################################################################################################################
+
+# Ask the questions not answered yet, at most `concurrency` at a time, through the shared client (transient errors are
+# retried); answers are stored as they arrive
+async def evaluate(backend, questions, store, concurrency, client):
+
+    answered  = store.answers(backend.name, backend.version)
+    pending   = [q for q in questions if store.key(q['question']) not in answered]
+    semaphore = asyncio.Semaphore(concurrency)
+    errors    = []
+
+    async def ask(question):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                answer = await backend.answer(question['question'], client)
+            except Exception as error:
+                errors.append((question['id'], repr(error)))
+                return
+            store.put(backend.name, backend.version, question['question'], answer, (time.perf_counter() - started) * 1000)
+
+    started, retries = time.perf_counter(), client.stats['retries']
+    await asyncio.gather(*(ask(question) for question in pending))
+    return {'asked': len(pending), 'cached': len(questions) - len(pending), 'errors': errors, 'retries': client.stats['retries'] - retries,
+            'elapsed_s': time.perf_counter() - started}
+
+
+def summarize(backend, questions, store, run):
+
+    answered = store.answers(backend.name, backend.version)
+    rows = []
+    for question in questions:
+        if (entry := answered.get(store.key(question['question']))) is not None:
+            answer, latency_ms = entry
+            rows.append({'id': question['id'], 'answer': answer, 'latency_ms': latency_ms,
+                         **score_answer(question['expected'], answer, backend.argument_names(question['expected']['report']))})
+
+    prompt_price, completion_price = PRICES.get(backend.model, (0.0, 0.0))
+    latency = np.array([row['latency_ms'] for row in rows]) if rows else np.zeros(1)
+    prompt_tokens     = np.mean([row['answer']['prompt_tokens'] for row in rows]) if rows else 0
+    completion_tokens = np.mean([row['answer']['completion_tokens'] for row in rows]) if rows else 0
+    print(f"\n{backend.name} ({backend.model}, prompt version {backend.version})")
+    print(f"  questions        : {len(rows)} answered of {len(questions)} ({run['asked']} asked now, {run['cached']} from the results file, {len(run['errors'])} errors, {run['retries']} retries)")
+    if run['asked']:
+        print(f"  throughput       : {(run['asked'] - len(run['errors'])) / run['elapsed_s']:.2f} questions/s ({run['elapsed_s']:.1f} s)")
+    print(f"  report accuracy  : {np.mean([row['report_ok'] for row in rows]) if rows else 0:.1%}")
+    print(f"  argument score   : {np.mean([row['arguments_score'] for row in rows]) if rows else 0:.1%} (exact matches {np.mean([row['exact'] for row in rows]) if rows else 0:.1%})")
+    print(f"  latency          : p50 {np.percentile(latency, 50):,.0f} ms, p95 {np.percentile(latency, 95):,.0f} ms, p99 {np.percentile(latency, 99):,.0f} ms")
+    print(f"  tokens/question  : {prompt_tokens:,.0f} prompt, {completion_tokens:,.0f} completion, US$ {(prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000:.4f}")
+    for question_id, error in run['errors'][:5]:
+        print(f"  error            : {question_id}: {error}")
+    return rows
+
+
+def load_questions(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Evaluate the BI agent backends on benchmark questions')
+    parser.add_argument('--questions',   default=QUESTIONS_PATH, help='JSON lines: id, question, expected {report, arguments}')
+    parser.add_argument('--results',     default=RESULTS_PATH,   help='SQLite file of the answers (resumable)')
+    parser.add_argument('--backends',    nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mock',        action='store_true', help='answer from the local mock LLM server (offline)')
+    parser.add_argument('--error-rate',  type=float, default=0.0, help='with --mock, share of the requests failing with a transient error')
+    parser.add_argument('--details',     action='store_true', help='list the questions that were not answered exactly')
+    args = parser.parse_args()
+
+    if args.mock:
+        from benchmarks.mock_llm_server import MockLLMServer
+        mock = MockLLMServer(error_rate=args.error_rate).start()
+        os.environ.update({'REPLICATE_BASE_URL': mock.url, 'REPLICATE_API_TOKEN': 'r8-mock'})
+        import openai
+        openai.api_base, openai.api_key = f'{mock.url}/v1', 'sk-mock'
+
+    from bi_agent.llm_client import LLMClient
+    questions = load_questions(args.questions)
+    store  = ResultStore(args.results)
+    client = LLMClient(pool_size=args.concurrency)
+    for name in args.backends:
+        backend = BACKENDS[name]()
+        run  = asyncio.run(evaluate(backend, questions, store, args.concurrency, client))
+        rows = summarize(backend, questions, store, run)
+        if args.details:
+            for row in rows:
+                if not row['exact']:
+                    print(f"  {row['id']:32s}: {row['answer']['report']} {json.dumps(row['answer']['arguments'])}")
+
+
+if __name__ == '__main__':
+    main()
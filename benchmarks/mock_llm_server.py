@@ -0,0 +1,187 @@
+# Local mock of the LLM APIs used by the pages, replaying recorded responses with a configurable latency, so the pages can
+# be benchmarked offline and without API keys:
+#   - OpenAI chat completions (plain answers, or tool calls when the request has tools), streamed or not
+#   - OpenAI completions (LangChain page)
+#   - Replicate predictions with a server-sent event stream of the output tokens
+# A share of the requests (error_rate) can be answered with 429 or 503 errors, to exercise the retries of the clients.
+#   python -m benchmarks.mock_llm_server --port 8765 --first-token-ms 300 --token-ms 20
+
+import os
+import re
+import json
+import time
+import random
+import argparse
+import threading
+import itertools
+import http.server
+
+
+RECORDINGS_PATH = os.path.join(os.path.dirname(__file__), 'recordings', 'llm_responses.json')
+_PIECE_PATTERN  = re.compile(r'\s*\S+|\s+$')
+
+
+# Pieces of text streamed one at a time (a word with its leading whitespace, about one token)
+def pieces(text):
+    return _PIECE_PATTERN.findall(text)
+
+
+class MockLLMServer:
+
+    def __init__(self, recordings_path=RECORDINGS_PATH, first_token_ms=300, token_ms=20, host='127.0.0.1', port=0, error_rate=0.0):
+        with open(recordings_path) as file:
+            self.recordings = json.load(file)
+        self.first_token_ms = first_token_ms
+        self.token_ms       = token_ms
+        self.error_rate     = error_rate
+        self.requests = itertools.count(1)
+        self.server   = http.server.ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='mock-llm', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # Responses built from the recordings: a dict, or a list of chunks for a streamed response
+    def chat_completion(self, request):
+        recording = self.recordings['chat_completion_tool_calls' if request.get('tools') else 'chat_completion']
+        number = next(self.requests)
+        header = {'id': f'chatcmpl-mock{number}', 'created': int(time.time()), 'model': recording['model']}
+        tool_calls = [{'id': call['id'], 'type': 'function', 'function': {'name': call['name'], 'arguments': json.dumps(call['arguments'])}}
+                      for call in recording.get('tool_calls', [])]
+        content = recording.get('content')
+        finish_reason = 'tool_calls' if tool_calls else 'stop'
+        completion_tokens = len(pieces(content or '')) + sum(len(pieces(call['function']['arguments'])) for call in tool_calls)
+
+        if not request.get('stream'):
+            message = {'role': 'assistant', 'content': content}
+            if tool_calls:
+                message['tool_calls'] = tool_calls
+            return completion_tokens, {**header, 'object': 'chat.completion',
+                    'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}],
+                    'usage'  : {'prompt_tokens': 0, 'completion_tokens': completion_tokens, 'total_tokens': completion_tokens}}
+
+        def chunk(delta, finish_reason=None):
+            return {**header, 'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+        chunks = [chunk({'role': 'assistant', 'content': '' if content is not None else None})]
+        chunks += [chunk({'content': piece}) for piece in pieces(content or '')]
+        for index, call in enumerate(tool_calls):
+            chunks.append(chunk({'tool_calls': [{'index': index, 'id': call['id'], 'type': 'function', 'function': {'name': call['function']['name'], 'arguments': ''}}]}))
+            chunks += [chunk({'tool_calls': [{'index': index, 'function': {'arguments': piece}}]}) for piece in pieces(call['function']['arguments'])]
+        chunks.append(chunk({}, finish_reason))
+        return completion_tokens, chunks
+
+    def completion(self, request):
+        recording = self.recordings['completion']
+        tokens = len(pieces(recording['text']))
+        return tokens, {'id': f'cmpl-mock{next(self.requests)}', 'object': 'text_completion', 'created': int(time.time()), 'model': recording['model'],
+                        'choices': [{'text': recording['text'], 'index': 0, 'logprobs': None, 'finish_reason': 'stop'}],
+                        'usage'  : {'prompt_tokens': 0, 'completion_tokens': tokens, 'total_tokens': tokens}}
+
+    def prediction(self, prediction_id, status='starting', request=None):
+        recording = self.recordings['replicate_output']
+        return {'id': prediction_id, 'model': recording['model'], 'version': (request or {}).get('version', 'mock'), 'status': status,
+                'input': (request or {}).get('input'), 'output': None, 'logs': '', 'error': None, 'metrics': {},
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'started_at': None, 'completed_at': None,
+                'urls': {name: f'{self.url}/v1/predictions/{prediction_id}{suffix}' for name, suffix in (('get', ''), ('cancel', '/cancel'), ('stream', '/stream'))}}
+
+
+def _handler(mock):
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            pass
+
+        def read_json(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def send_json(self, body, status=200, processing_ms=0):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('openai-processing-ms', str(int(processing_ms)))
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client gave up (e.g. timeout of the model router)
+
+        def send_events(self, events):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            try:
+                for number, event in enumerate(events):
+                    time.sleep((mock.first_token_ms if number == 0 else mock.token_ms) / 1000)
+                    self.wfile.write(event.encode())
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client stopped reading (e.g. the JSON report was complete)
+
+        def do_POST(self):
+            path, request = self.path.split('?')[0], self.read_json()
+            if random.random() < mock.error_rate:
+                status = random.choice((429, 503))
+                self.send_json({'error': {'message': 'Mock transient error', 'type': 'server_error' if status == 503 else 'rate_limit_error'}}, status=status)
+            elif path.endswith('/chat/completions') or path.endswith('/completions'):
+                tokens, response = (mock.chat_completion if path.endswith('/chat/completions') else mock.completion)(request)
+                if isinstance(response, list):
+                    self.send_events([f'data: {json.dumps(chunk)}\n\n' for chunk in response] + ['data: [DONE]\n\n'])
+                else:
+                    latency_ms = mock.first_token_ms + mock.token_ms * tokens
+                    time.sleep(latency_ms / 1000)
+                    self.send_json(response, processing_ms=latency_ms)
+            elif path == '/v1/predictions':
+                self.send_json(mock.prediction(f'mock{next(mock.requests)}', request=request), status=201)
+            elif path.startswith('/v1/predictions/') and path.endswith('/cancel'):
+                self.send_json(mock.prediction(path.split('/')[3], status='canceled'))
+            else:
+                self.send_error(404)
+
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path.startswith('/v1/predictions/') and path.endswith('/stream'):
+                output = mock.recordings['replicate_output']['output']
+                events = [f'event: output\nid: {n}\n' + ''.join(f'data: {line}\n' for line in piece.split('\n')) + '\n' for n, piece in enumerate(pieces(output))]
+                self.send_events(events + ['event: done\ndata: {}\n\n'])
+            elif path.startswith('/v1/predictions/'):
+                self.send_json(mock.prediction(path.split('/')[3], status='processing'))
+            else:
+                self.send_error(404)
+
+    return Handler
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Mock LLM server replaying recorded responses')
+    parser.add_argument('--port',           type=int,   default=8765)
+    parser.add_argument('--first-token-ms', type=float, default=300)
+    parser.add_argument('--token-ms',       type=float, default=20)
+    parser.add_argument('--error-rate',     type=float, default=0.0, help='share of the requests answered with a 429 or 503 error')
+    parser.add_argument('--recordings',     default=RECORDINGS_PATH)
+    args = parser.parse_args()
+
+    mock = MockLLMServer(args.recordings, args.first_token_ms, args.token_ms, port=args.port, error_rate=args.error_rate)
+    print(f'Mock LLM server at {mock.url}: OPENAI_API_BASE={mock.url}/v1 REPLICATE_BASE_URL={mock.url}')
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
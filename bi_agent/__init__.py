@@ -0,0 +1 @@
+# Shared building blocks for the BI agent pages: data access, report engines and LLM plumbing
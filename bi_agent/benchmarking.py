@@ -0,0 +1,265 @@
+# Hospital benchmarking: compare one hospital against its peer group (most similar hospitals) category by category
+
+import copy
+import time
+import warnings
+import numpy as np
+import pandas as pd
+
+from bi_agent.data import appended_transactions
+from bi_agent.spend_engine import datetime_months, prepare_transactions
+
+
+PEER_GROUP_SIZE = 10
+
+# Hospitals are profiled (for similarity) on their category spend mix over the most recent months
+PROFILE_MONTHS = 12
+
+# Weight of the hospital size (log of total spend) next to the category mix when measuring similarity
+SIZE_WEIGHT = 0.5
+
+BENCHMARK_METRICS = ['total_volume', 'total_amount', 'avg_amount', 'min_amount', 'max_amount', 'spend_mix']
+
+
+#%%######################################################################################################################
+# PEER GROUP INDEX
+#########################################################################################################################
+
+# Monthly hospital x category aggregates (volume, spend, min, max) held as dense arrays, plus the peers of every hospital
+# (computed on first use). The index is built with the spend engine; when rows are appended to the data, they are folded
+# into the index of the previous data (see add_transactions and update_peer_group_index).
+class PeerGroupIndex:
+
+    def __init__(self, spend_engine, peer_group_size=PEER_GROUP_SIZE, profile_months=PROFILE_MONTHS):
+
+        self.engine = spend_engine
+        self.loads  = spend_engine.loads  # loads of the transaction store in the index
+        self.peer_group_size = peer_group_size
+        self.profile_months  = profile_months
+        self.n_hospitals  = len(spend_engine.columns['hospital_name'].categories)
+        self.n_categories = len(spend_engine.columns['category_name'].categories)
+        self._peers  = None
+
+        months = spend_engine.months
+        self.first_month = int(months.min()) if len(months) else 0
+        shape = (int(months.max()) + 1 - self.first_month if len(months) else 0, self.n_hospitals, self.n_categories)
+        self.volume, self.amount = np.zeros(shape), np.zeros(shape)
+        self.minimum, self.maximum = np.full(shape, np.inf), np.full(shape, -np.inf)
+        self._fold(months, spend_engine.columns['hospital_name'].codes, spend_engine.columns['category_name'].codes, spend_engine.amount)
+
+    # Add transactions (month index, hospital and category codes, amount) to the cells of their months; only the months
+    # of the rows are aggregated. Returns the range of the months touched (relative to first_month).
+    def _fold(self, months, hospitals, categories, amounts):
+
+        keep = (hospitals >= 0) & (categories >= 0)
+        months, hospitals, categories, amounts = months[keep], hospitals[keep], categories[keep], amounts[keep]
+        if not len(months):
+            return 0, 0
+        first, end = int(months.min()) - self.first_month, int(months.max()) + 1 - self.first_month
+        shape = (end - first, self.n_hospitals, self.n_categories)
+
+        # Flat cell index, then one bincount per additive metric and a group-by for min/max on the cells with transactions
+        cells = ((months - self.first_month - first) * self.n_hospitals + hospitals.astype(np.int64)) * self.n_categories + categories
+        size  = int(np.prod(shape))
+        self.volume[first:end] += np.bincount(cells, minlength=size).reshape(shape)
+        self.amount[first:end] += np.bincount(cells, weights=amounts, minlength=size).reshape(shape)
+        extremes = pd.Series(amounts).groupby(cells).agg(['min', 'max'])
+        touched  = extremes.index.to_numpy()
+        minimum, maximum = self.minimum[first:end], self.maximum[first:end]  # views
+        minimum.flat[touched] = np.minimum(minimum.flat[touched], extremes['min'].to_numpy())
+        maximum.flat[touched] = np.maximum(maximum.flat[touched], extremes['max'].to_numpy())
+        return first, end
+
+    # Fold transactions appended to the data into the index, once the spend engine has been built again with them (and
+    # the previous rows). The arrays are copied to the hospitals, categories and months of the new engine, only the cells
+    # of the months of the new rows are aggregated, and the peers are computed again only when those months are in the
+    # profile window (or hospitals or categories were added). Returns the index.
+    def add_transactions(self, spend_engine, transactions):
+
+        columns = spend_engine.columns
+        frame   = prepare_transactions(transactions)
+        months  = datetime_months(frame['transaction_datetime'].to_numpy())
+        codes   = {column: columns[column].categories.get_indexer(frame[column].astype(object)) for column in ('hospital_name', 'category_name')}
+
+        # Old codes -> codes of the new engine (its dictionaries have every previous value, plus the new ones)
+        hospital_map = columns['hospital_name'].categories.get_indexer(self.engine.columns['hospital_name'].categories)
+        category_map = columns['category_name'].categories.get_indexer(self.engine.columns['category_name'].categories)
+        axes_changed = len(columns['hospital_name'].categories) != self.n_hospitals or len(columns['category_name'].categories) != self.n_categories or \
+                       (hospital_map != np.arange(self.n_hospitals)).any() or (category_map != np.arange(self.n_categories)).any()
+
+        # Month axis of the new engine: months before its first one are no longer loaded (history_months)
+        first_month = int(spend_engine.months.min()) if len(spend_engine) else self.first_month
+        end_month   = max(int(spend_engine.months.max()) + 1 if len(spend_engine) else 0, self.first_month + len(self.volume))
+        shape  = (max(end_month - first_month, 0), len(columns['hospital_name'].categories), len(columns['category_name'].categories))
+        kept   = slice(max(first_month - self.first_month, 0), len(self.volume))
+        target = slice(kept.start + self.first_month - first_month, len(self.volume) + self.first_month - first_month)
+        valid  = np.ix_(hospital_map >= 0, category_map >= 0)
+        cells  = np.ix_(np.arange(target.start, target.stop), hospital_map[hospital_map >= 0], category_map[category_map >= 0])
+        for name, fill in (('volume', 0.0), ('amount', 0.0), ('minimum', np.inf), ('maximum', -np.inf)):
+            array = np.full(shape, fill)
+            array[cells] = getattr(self, name)[kept][(slice(None),) + valid]
+            setattr(self, name, array)
+
+        self.engine, self.loads = spend_engine, spend_engine.loads
+        self.first_month, self.n_hospitals, self.n_categories = first_month, shape[1], shape[2]
+        first, end = self._fold(months, codes['hospital_name'], codes['category_name'], frame['spend_amount'].to_numpy())
+        if axes_changed or kept.start > 0 or (end > first and end > len(self.volume) - self.profile_months):
+            self._peers = None
+        return self
+
+    #%%##################################################################################################################
+    # SIMILARITY
+    #####################################################################################################################
+
+    # Category spend mix and size of every hospital over the profile window
+    def profiles(self):
+        recent = self.amount[-self.profile_months:].sum(axis=0)
+        totals = recent.sum(axis=1)
+        mix    = recent / np.maximum(totals, 1e-9)[:, None]
+        size   = np.log10(np.maximum(totals, 1.0))
+        size   = (size - size.mean()) / (size.std() or 1.0)
+        return np.hstack([mix / (mix.std(axis=0) + 1e-9), SIZE_WEIGHT * size[:, None]]), totals > 0
+
+    # Nearest hospitals (Euclidean distance between profiles) for every hospital
+    @property
+    def peers(self):
+        if self._peers is None:
+            features, active = self.profiles()
+            distances = ((features[:, None, :] - features[None, :, :]) ** 2).sum(axis=2)
+            distances[:, ~active] = np.inf
+            np.fill_diagonal(distances, np.inf)
+            k = max(min(self.peer_group_size, int(active.sum()) - 1), 0)
+            nearest = np.argpartition(distances, k, axis=1)[:, :k] if k else np.zeros((self.n_hospitals, 0), dtype=np.int64)
+            order   = np.take_along_axis(distances, nearest, axis=1).argsort(axis=1)
+            self._peers = np.take_along_axis(nearest, order, axis=1)
+        return self._peers
+
+    #%%##################################################################################################################
+    # AGGREGATION
+    #####################################################################################################################
+
+    # Volume, spend, min and max per (hospital, category) for the selected hospitals, categories and periods
+    def aggregates(self, hospitals, categories, filters, intervals):
+
+        shape   = (len(hospitals), len(categories))
+        volume, amount = np.zeros(shape), np.zeros(shape)
+        minimum, maximum = np.full(shape, np.inf), np.full(shape, -np.inf)
+        raw_intervals, rows_scanned = intervals, 0
+
+        # Whole months from the monthly arrays, when no other filter than hospital and category is requested
+        if not filters:
+            month_ranges, raw_intervals = self.engine.split_intervals(intervals)
+            for first_month, end_month in month_ranges:
+                window = slice(max(first_month - self.first_month, 0), max(end_month - self.first_month, 0))
+                cells  = np.ix_(np.arange(window.start, min(window.stop, len(self.volume))), hospitals, categories)
+                volume  += self.volume[cells].sum(axis=0)
+                amount  += self.amount[cells].sum(axis=0)
+                minimum  = np.minimum(minimum, self.minimum[cells].min(axis=0, initial=np.inf))
+                maximum  = np.maximum(maximum, self.maximum[cells].max(axis=0, initial=-np.inf))
+                rows_scanned += volume.size * (window.stop - window.start)
+
+        # Everything else (partial months, extra filters) from the transactions of the selected hospitals only
+        if raw_intervals is None or raw_intervals:
+            columns = self.engine.columns
+            row_filters = {**filters, 'hospital_name': np.asarray(hospitals), 'category_name': np.asarray(categories)}
+            rows = self.engine.rows_for(row_filters, raw_intervals)
+            rows_scanned += self.engine.rows_examined(row_filters, raw_intervals)
+            if len(rows):
+                position = {'hospital_name': np.full(self.n_hospitals, -1), 'category_name': np.full(self.n_categories, -1)}
+                position['hospital_name'][hospitals]  = np.arange(len(hospitals))
+                position['category_name'][categories] = np.arange(len(categories))
+                cells = position['hospital_name'][columns['hospital_name'].codes[rows]] * len(categories) + position['category_name'][columns['category_name'].codes[rows]]
+                amounts = self.engine.amount[rows]
+                volume  += np.bincount(cells, minlength=volume.size).reshape(shape)
+                amount  += np.bincount(cells, weights=amounts, minlength=amount.size).reshape(shape)
+                extremes = pd.Series(amounts).groupby(cells).agg(['min', 'max'])
+                touched  = extremes.index.to_numpy()
+                minimum.flat[touched] = np.minimum(minimum.flat[touched], extremes['min'].to_numpy())
+                maximum.flat[touched] = np.maximum(maximum.flat[touched], extremes['max'].to_numpy())
+
+        return volume, amount, minimum, maximum, rows_scanned
+
+    #%%##################################################################################################################
+    # REPORT
+    #####################################################################################################################
+
+    # One row per category and metric: the hospital's value against the statistics of its peer group
+    def benchmarking_report(self, hospital_filter_list=None, category_filter_list=None, time_period_filter_list=None, fiscal_calendar=None, today=None, **filter_lists):
+
+        started   = time.perf_counter()
+        columns   = self.engine.columns
+        hospitals = columns['hospital_name'].encode(hospital_filter_list or [])
+        if len(hospitals) != 1:
+            raise ValueError("The benchmarking report compares exactly one hospital against its peers; please specify one known hospital in hospital_filter_list")
+
+        target     = int(hospitals[0])
+        group      = np.r_[target, self.peers[target]].astype(np.int64)
+        categories = columns['category_name'].encode(category_filter_list) if category_filter_list else np.arange(self.n_categories)
+        filters    = self.engine.filter_codes(filter_lists)
+        intervals  = self.engine.resolve_intervals(time_period_filter_list, fiscal_calendar, today)
+
+        volume, amount, minimum, maximum, rows_scanned = self.aggregates(group, categories, filters, intervals)
+        totals = self.hospital_totals(group, filters, intervals, amount)
+
+        # Only the categories where the hospital has spend are reported
+        present = volume[0] > 0
+        categories, volume, amount, minimum, maximum = categories[present], volume[:, present], amount[:, present], minimum[:, present], maximum[:, present]
+
+        # Metric matrices: one row per hospital of the group (target first), one column per category
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = {
+                'total_volume': volume,
+                'total_amount': amount,
+                'avg_amount'  : amount / volume,
+                'min_amount'  : np.where(volume > 0, minimum, np.nan),
+                'max_amount'  : np.where(volume > 0, maximum, np.nan),
+                'spend_mix'   : 100.0 * amount / totals[:, None],
+            }
+
+        frames = []
+        for metric, matrix in values.items():
+            hospital, peers = matrix[0], matrix[1:]
+            with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)  # peers without spend in a category
+                median = np.nanmedian(peers, axis=0) if len(peers) else np.full(len(categories), np.nan)
+                frames.append(pd.DataFrame({
+                    'category_name'         : columns['category_name'].decode(categories),
+                    'metric'                : metric,
+                    'hospital_value'        : hospital,
+                    'peer_median'           : median,
+                    'peer_average'          : np.nanmean(peers, axis=0) if len(peers) else np.nan,
+                    'peer_min'              : np.nanmin(peers, axis=0) if len(peers) else np.nan,
+                    'peer_max'              : np.nanmax(peers, axis=0) if len(peers) else np.nan,
+                    'hospital_percentile'   : 100.0 * (peers < hospital).sum(axis=0) / max(len(peers), 1),
+                    'difference_vs_median_%': np.where(median != 0, 100.0 * (hospital - median) / np.abs(median), np.nan),
+                    }))
+
+        report = pd.concat(frames, ignore_index=True)
+        report['metric'] = pd.Categorical(report['metric'], categories=BENCHMARK_METRICS, ordered=True)
+        report = report.sort_values(['category_name', 'metric'], ignore_index=True)
+
+        self.engine.log_query({
+            'report'      : 'benchmarking_spend_report',
+            'source'      : f'peer group of {columns["hospital_name"].decode([target])[0]} ({len(group) - 1} peers)',
+            'rows_scanned': rows_scanned,
+            'rows_output' : len(report),
+            'elapsed_ms'  : (time.perf_counter() - started) * 1000,
+            })
+        return report
+
+    # Total spend of each hospital of the group in the period, across all categories (denominator of spend_mix), with the
+    # same filters as the category amounts
+    def hospital_totals(self, group, filters, intervals, category_amounts):
+        if len(category_amounts[0]) == self.n_categories:
+            return category_amounts.sum(axis=1)
+        _, amount, _, _, _ = self.aggregates(group, np.arange(self.n_categories), filters, intervals)
+        return amount.sum(axis=1)
+
+
+# Peer group index of the spend engine of the current data: the rows appended to a transaction store since the previous
+# index are folded into a copy of it; any other change of the data builds the index again
+def update_peer_group_index(previous, spend_engine, transactions_path=None, history_months=None):
+    appended = appended_transactions(transactions_path, previous.loads, spend_engine.loads, history_months) if previous is not None else None
+    if appended is None:
+        return PeerGroupIndex(spend_engine)
+    return copy.copy(previous).add_transactions(spend_engine, appended)
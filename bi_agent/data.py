@@ -0,0 +1,66 @@
+# Load the hospital transactions table used by the reports
+
+import os
+import hashlib
+import datetime
+import pandas as pd
+
+from bi_agent.synthetic import generate_transactions
+from bi_agent.transaction_store import MANIFEST, TransactionStore
+
+
+DEFAULT_TRANSACTIONS_PATH = os.path.join('data', 'transactions.parquet')
+DEMO_ROWS = 1_000_000
+DEMO_SEED = 0
+
+
+# Date intervals of the last history_months months (None for all time)
+def history_intervals(history_months=None):
+    if not history_months:
+        return None
+    first = (pd.Timestamp.today().to_period('M') - (history_months - 1)).start_time.date()
+    return [(first, datetime.date.max)]
+
+
+# Read the transactions from a transaction store directory (only the partitions of the last history_months months, if
+# given) or a local Parquet/CSV file; fall back to a synthetic demo table when there is neither. The transactions of a
+# store carry the ids of the loads they were read from in frame.attrs['loads'] (see appended_transactions).
+def load_transactions(path=None, history_months=None):
+
+    path = path or DEFAULT_TRANSACTIONS_PATH
+    if TransactionStore.exists(path):
+        store = TransactionStore(path)
+        frame = store.to_frame(history_intervals(history_months))
+        frame.attrs['loads'] = store.load_ids()
+        return frame
+    if not os.path.exists(path):
+        return generate_transactions(DEMO_ROWS, seed=DEMO_SEED)
+
+    if path.endswith('.csv'):
+        return pd.read_csv(path, parse_dates=['transaction_datetime'])
+    return pd.read_parquet(path)
+
+
+# Transactions of the loads of a transaction store that are in loads but not in previous_loads (load ids, as in
+# frame.attrs['loads']), or None when the data was not only appended to: not a store, or loads that are gone
+def appended_transactions(path, previous_loads, loads, history_months=None):
+
+    path = path or DEFAULT_TRANSACTIONS_PATH
+    if previous_loads is None or loads is None or not set(previous_loads) <= set(loads) or not TransactionStore.exists(path):
+        return None
+    return TransactionStore(path).to_frame(history_intervals(history_months), loads=set(loads) - set(previous_loads))
+
+
+# Watermark of the transactions data: changes whenever the file (or any file of a dataset directory, or the manifest of
+# a transaction store) is written, so the engines and the report results built on previous data can be told apart
+def data_watermark(path=None):
+
+    path = path or DEFAULT_TRANSACTIONS_PATH
+    if not os.path.exists(path):
+        return f'synthetic-{DEMO_ROWS}-{DEMO_SEED}-{datetime.date.today().isoformat()}'  # the demo table ends today
+
+    if TransactionStore.exists(path):
+        path = os.path.join(path, MANIFEST)
+    files = [path] if os.path.isfile(path) else sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    stamps = [(name, os.stat(name).st_size, os.stat(name).st_mtime_ns) for name in files]
+    return hashlib.sha256(repr(stamps).encode()).hexdigest()[:16]
@@ -0,0 +1,125 @@
+# Dictionary-encoded text columns with a posting-list index (row positions per distinct value)
+
+import numpy as np
+import pandas as pd
+
+from bi_agent.entity_resolution import EntityIndex
+
+
+# Above this fraction of the scanned range, probing every row with a lookup table is cheaper than gathering posting lists
+POSTING_LIST_SELECTIVITY = 0.2
+
+
+class DictionaryColumn:
+
+    def __init__(self, values):
+
+        # Dictionary encoding: distinct values once, one small integer code per row (-1 for missing values)
+        categorical     = values.array if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype) else pd.Categorical(values)
+        self.categories = categorical.categories
+        self.codes      = categorical.codes
+        self.positions  = None
+        self.offsets    = None
+        self.entities   = None  # entity resolution index of the values, built on first use
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        index_bytes = 0 if self.positions is None else self.positions.nbytes + self.offsets.nbytes
+        return self.codes.nbytes + index_bytes + int(self.categories.memory_usage(deep=True))
+
+    # Codes of the given values; values that do not exist in the column are dropped
+    def encode(self, values):
+        codes = self.categories.get_indexer(list(values))
+        return np.unique(codes[codes >= 0])
+
+    # (value of the column, confidence) of each given name; the value is None for names that match nothing
+    def resolve(self, names):
+        if self.entities is None:
+            self.entities = EntityIndex(self.categories)
+        return [self.entities.resolve(name) for name in names]
+
+    # Values of the column the given names resolve to; names that resolve to nothing are kept as given (with their spaces
+    # collapsed), so they still match no row
+    def canonical(self, names):
+        return [value if value is not None else ' '.join(str(name).split()) for name, (value, _) in zip(names, self.resolve(names))]
+
+    # Values of the codes; None for code -1 (missing value), which must not read the last value
+    def decode(self, codes):
+        codes  = np.asarray(codes, dtype=np.int64)
+        values = np.full(len(codes), None, dtype=object)
+        values[codes >= 0] = self.categories.to_numpy(dtype=object)[codes[codes >= 0]]
+        return values
+
+    # Boolean lookup table indexed by code, used to test many rows against a set of codes at once.
+    # The extra last entry is what code -1 (missing value) reads, and it is never allowed.
+    def allowed(self, codes):
+        table = np.zeros(len(self.categories) + 1, dtype=bool)
+        table[codes] = True
+        return table
+
+    #%%##################################################################################################################
+    # POSTING LISTS
+    #####################################################################################################################
+
+    # Row positions grouped by code; positions stay sorted within each code, so they can be range-restricted by binary search
+    def build_index(self):
+        position_type  = np.int32 if len(self.codes) < np.iinfo(np.int32).max else np.int64
+        self.positions = np.argsort(self.codes, kind='stable').astype(position_type)
+        self.offsets   = np.concatenate([[0], np.cumsum(np.bincount(self.codes[self.codes >= 0], minlength=len(self.categories)))])
+        if (self.codes < 0).any():  # missing values sort first and are not part of any posting list
+            self.offsets += int((self.codes < 0).sum())
+        return self
+
+    def posting_list(self, code, start=0, end=None):
+        postings = self.positions[self.offsets[code]:self.offsets[code + 1]]
+        end = len(self.codes) if end is None else end
+        return postings[np.searchsorted(postings, start, 'left'):np.searchsorted(postings, end, 'left')]
+
+    # Number of rows in [start, end) having any of the codes, in O(log n) per code
+    def count(self, codes, start=0, end=None):
+        return sum(len(self.posting_list(code, start, end)) for code in codes)
+
+    # Sorted positions of the rows in [start, end) having any of the codes
+    def rows(self, codes, start=0, end=None):
+        lists = [self.posting_list(code, start, end) for code in codes]
+        if len(lists) == 1:
+            return lists[0].astype(np.int64)
+        return np.sort(np.concatenate(lists)).astype(np.int64) if lists else np.array([], dtype=np.int64)
+
+
+# Choose how to evaluate the filters (column -> codes) over the rows in [start, end): gather the posting lists of the most
+# selective column and probe the others, or probe every row. Returns the driving column (None for a full probe) and the
+# number of rows that will be examined.
+def plan_scan(columns, filters, start, end):
+
+    if not filters:
+        return None, end - start
+
+    counts = {column: columns[column].count(codes, start, end) for column, codes in filters.items()}
+    driver = min(counts, key=counts.get)
+    if counts[driver] <= POSTING_LIST_SELECTIVITY * (end - start):
+        return driver, counts[driver]
+    return None, end - start
+
+
+# Positions of the rows in [start, end) that match every filter
+def select_rows(columns, filters, start, end):
+
+    if not filters:
+        return np.arange(start, end, dtype=np.int64)
+
+    driver, _ = plan_scan(columns, filters, start, end)
+    if driver is not None:
+        rows = columns[driver].rows(filters[driver], start, end)
+        for column in filters:
+            if column != driver:
+                rows = rows[columns[column].allowed(filters[column])[columns[column].codes[rows]]]
+        return rows
+
+    mask = np.ones(end - start, dtype=bool)
+    for column, codes in filters.items():
+        mask &= columns[column].allowed(codes)[columns[column].codes[start:end]]
+    return start + np.flatnonzero(mask)
@@ -0,0 +1,120 @@
+# Resolution of the free-text names the LLM passes in the *_filter_list arguments (e.g. 'mallory safety & supply',
+# 'flooring repair') to the values of a dimension column, with a confidence score:
+#   1. the normalized name (case, punctuation, '&' and spaces ignored) is a value of the column: confidence 1,
+#   2. the same words in another order, or without company suffixes ('Inc', 'LLC', ...): confidence 0.95,
+#   3. words found together in one value only (e.g. 'hvac' for 'HVAC Maintenance'): confidence 0.8,
+#   4. otherwise the value sharing the most trigrams with the name (Dice coefficient), found through an inverted index of
+#      the trigrams of every value; names below MATCH_THRESHOLD, or that match several values equally, resolve to nothing.
+# Numbers of a name must match in steps 3 and 4 ('hospital 3' is 'Hospital 0003', never 'Hospital 0030'); a name without
+# numbers may match a value with numbers ('Flooring Repairs' for 'GL 6010 Flooring Repairs'), with a lower confidence.
+# Resolutions are cached, so the names repeated by every request of a conversation resolve with one dictionary lookup.
+
+import re
+import collections
+import numpy as np
+
+
+MATCH_THRESHOLD       = 0.6   # lowest trigram similarity of a match
+TOKEN_MATCH_SCORE     = 0.95
+SUBSET_MATCH_SCORE    = 0.8
+NUMBERLESS_PENALTY    = 0.9   # confidence factor of a name without numbers matched to a value with numbers
+RESOLUTION_CACHE_SIZE = 4096
+
+_NON_ALPHANUMERIC = re.compile(r'[^0-9a-z]+')
+_NUMBER = re.compile(r'\d+')
+_IGNORED_TOKENS = {'the', 'inc', 'llc', 'ltd', 'co', 'corp', 'corporation', 'company', 'incorporated', 'plc', 'lp'}
+
+
+def normalize_name(name):
+    return ' '.join(_NON_ALPHANUMERIC.sub(' ', str(name).casefold().replace('&', ' and ')).split())
+
+# Words of a name regardless of their order, without articles and company suffixes
+def token_key(name):
+    return ' '.join(sorted(token for token in name.split() if token not in _IGNORED_TOKENS))
+
+def numbers(name):
+    return tuple(int(number) for number in _NUMBER.findall(name))
+
+def trigrams(name):
+    padded = f'  {name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class EntityIndex:
+
+    def __init__(self, values, threshold=MATCH_THRESHOLD):
+        self.values    = list(values)
+        self.threshold = threshold
+        self.names     = [normalize_name(value) for value in self.values]
+        self.exact     = {}
+        self.tokens    = {}
+        for position, name in reversed(list(enumerate(self.names))):  # the first value wins a tie
+            self.exact[name] = position
+            self.tokens[token_key(name)] = position
+
+        # Inverted indexes: word -> positions of the values that contain it, and trigram -> positions
+        self.words, postings = {}, {}
+        self.numbers = {}  # numbers of a name -> positions of the values with the same numbers
+        self.has_numbers = np.array([bool(numbers(name)) for name in self.names], dtype=bool)
+        self.stems = [' '.join(word for word in name.split() if not word.isdigit()) for name in self.names]
+        self.stem_counts = collections.Counter(self.stems)  # values that differ only by their numbers share a stem
+        for position, name in enumerate(self.names):
+            self.numbers.setdefault(numbers(name), set()).add(position)
+            for word in token_key(name).split():
+                self.words.setdefault(word, set()).add(position)
+            for gram in trigrams(name):
+                postings.setdefault(gram, []).append(position)
+        self.postings = {gram: np.array(positions, dtype=np.int32) for gram, positions in postings.items()}
+        self.sizes    = np.array([len(trigrams(name)) for name in self.names], dtype=np.float64)
+        self.cache    = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    # (value of the column, confidence) of a name; the value is None when nothing matches with enough confidence
+    def resolve(self, name):
+        if (resolved := self.cache.get(name)) is not None:
+            return resolved
+        if len(self.cache) >= RESOLUTION_CACHE_SIZE:
+            self.cache.clear()
+        resolved = self.cache[name] = self._resolve(name)
+        return resolved
+
+    def _resolve(self, name):
+        normalized = normalize_name(name)
+        if normalized in self.exact:
+            return self.values[self.exact[normalized]], 1.0
+        if (position := self.tokens.get(token_key(normalized))) is not None:
+            return self.values[position], TOKEN_MATCH_SCORE
+
+        # Values with the same numbers as the name; every value when the name has no numbers
+        candidates = None
+        if numbers(normalized):
+            candidates = self.numbers.get(numbers(normalized), set())
+            if not candidates:
+                return None, 0.0
+        words = [word for word in token_key(normalized).split() if not word.isdigit()]
+        if words and all(word in self.words for word in words):
+            positions = set.intersection(*(self.words[word] for word in words), *([candidates] if candidates is not None else []))
+            if len(positions) == 1:
+                position = positions.pop()
+                return self.values[position], round(SUBSET_MATCH_SCORE * (NUMBERLESS_PENALTY if candidates is None and self.has_numbers[position] else 1), 3)
+
+        grams = trigrams(normalized)
+        lists = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not lists or not len(self.values):
+            return None, 0.0
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.values))
+        scores = 2 * shared / (len(grams) + self.sizes)
+        if candidates is None:
+            scores = np.where(self.has_numbers, NUMBERLESS_PENALTY * scores, scores)
+        elif len(candidates) < len(self.values):
+            allowed = np.zeros(len(self.values), dtype=bool)
+            allowed[np.fromiter(candidates, dtype=np.int64)] = True
+            scores  = np.where(allowed, scores, 0)
+        best   = int(np.argmax(scores))
+        score  = round(float(scores[best]), 3)
+        ambiguous = (scores == scores[best]).sum() > 1 or (candidates is None and self.stem_counts[self.stems[best]] > 1)
+        if score < self.threshold or ambiguous:
+            return None, score
+        return self.values[best], score
@@ -0,0 +1,131 @@
+# Token-budgeted conversation history: the messages sent to the model are trimmed to fit the prompt budget of the model,
+# while st.session_state.messages keeps the full conversation for display.
+#
+# System messages are always kept. The rest is split into turns (a user message and every assistant and tool message that
+# follows it), so an assistant message with tool_calls is never separated from its tool messages. The oldest turns are
+# dropped first and replaced by a short summary of the questions they contained.
+
+import json
+import functools
+import tiktoken
+
+
+# Context window of each model, and tokens kept free for the completion
+MODEL_CONTEXT_TOKENS = {
+    'gpt-3.5-turbo': 4096,
+    'gpt-4'        : 8192,
+}
+DEFAULT_CONTEXT_TOKENS = 4096
+COMPLETION_TOKENS = 1024
+
+# Summary of the dropped turns: at most this many tokens, and this many characters per question
+SUMMARY_TOKENS = 300
+SUMMARY_QUESTION_CHARACTERS = 200
+
+# Fixed overhead of the chat format: per message, per name field, and for priming the reply
+_TOKENS_PER_MESSAGE = 3
+_TOKENS_PER_NAME    = 1
+_TOKENS_PER_REPLY   = 3
+
+
+# Rough count (about 4 characters per token) when the tiktoken files cannot be downloaded, e.g. offline
+class ApproximateEncoding:
+    def encode(self, text):
+        return range((len(text) + 3) // 4)
+
+
+@functools.lru_cache(maxsize=None)
+def model_encoding(model):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+    except OSError:
+        return ApproximateEncoding()
+
+
+@functools.lru_cache(maxsize=4096)
+def count_text_tokens(text, model):
+    return len(model_encoding(model).encode(text))
+
+
+def prompt_budget(model):
+    return MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS) - COMPLETION_TOKENS
+
+
+# Tokens of one chat message, including tool calls (function name and arguments)
+def count_message_tokens(message, model):
+    tokens = _TOKENS_PER_MESSAGE
+    for field in ('role', 'content', 'name', 'tool_call_id'):
+        if isinstance(message.get(field), str):
+            tokens += count_text_tokens(message[field], model)
+    if message.get('name'):
+        tokens += _TOKENS_PER_NAME
+    for call in message.get('tool_calls') or []:
+        tokens += count_text_tokens(call['function']['name'], model) + count_text_tokens(call['function']['arguments'], model)
+    return tokens
+
+
+def count_messages_tokens(messages, model):
+    return sum(count_message_tokens(m, model) for m in messages) + _TOKENS_PER_REPLY
+
+
+# Tokens taken by the tool definitions sent with the messages (approximated by their JSON text)
+def count_tools_tokens(tools, model):
+    return count_text_tokens(json.dumps(tools), model) if tools else 0
+
+
+def split_turns(messages):
+    turns = []
+    for message in messages:
+        if message['role'] == 'user' or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def summarize_turns(turns, model):
+    questions = [turn[0]['content'][:SUMMARY_QUESTION_CHARACTERS] for turn in turns if turn[0]['role'] == 'user' and isinstance(turn[0].get('content'), str)]
+    summary, lines = 'Earlier in this conversation, the user asked:', []
+    for question in reversed(questions):  # the most recent questions are the most relevant
+        line = f'\n- {question}'
+        if count_text_tokens(summary + ''.join(lines) + line, model) > SUMMARY_TOKENS:
+            break
+        lines.insert(0, line)
+    return {'role': 'system', 'content': summary + ''.join(lines)} if lines else None
+
+
+# Messages to send for the model: system messages, a summary of the dropped turns, and the most recent turns that fit
+# in the budget (the last turn is always kept). Returns the messages with their prompt token count and the turns dropped.
+def fit_history(messages, model, budget=None, reserved_tokens=0, summarize=True):
+
+    budget  = (prompt_budget(model) if budget is None else budget) - reserved_tokens
+    system  = [m for m in messages if m['role'] == 'system']
+    turns   = split_turns([m for m in messages if m['role'] != 'system'])
+    counts  = [sum(count_message_tokens(m, model) for m in turn) for turn in turns]
+    used    = sum(count_message_tokens(m, model) for m in system) + _TOKENS_PER_REPLY
+
+    # Most recent turns first, while they fit (leaving room for the summary when some turns have to be dropped)
+    def turns_that_fit(available):
+        kept, total = 0, used
+        while kept < len(turns) and (kept == 0 or total + counts[-kept - 1] <= available):
+            total += counts[-kept - 1]
+            kept  += 1
+        return kept, total
+
+    kept, total = turns_that_fit(budget)
+    if summarize and kept < len(turns):
+        kept, total = turns_that_fit(budget - SUMMARY_TOKENS - _TOKENS_PER_MESSAGE)
+
+    dropped = turns[:len(turns) - kept]
+    summary = summarize_turns(dropped, model) if summarize and dropped else None
+    if summary is not None and total + count_message_tokens(summary, model) > budget:
+        summary = None
+
+    selected = system + ([summary] if summary else []) + [m for turn in turns[len(turns) - kept:] for m in turn]
+    return {
+        'messages'     : selected,
+        'prompt_tokens': count_messages_tokens(selected, model) + reserved_tokens,
+        'dropped_turns': len(dropped),
+    }
@@ -0,0 +1,157 @@
+# Local queue of background jobs (the reports of the agent tools): jobs run in a process pool, so a long report does not
+# hold the session thread or the GIL of the app, and their state and results are kept in a SQLite file shared by every
+# session and process. Identical jobs already queued or running are not started twice: the new request joins the job
+# in flight. Each session may have a limited number of jobs in flight.
+
+import io
+import sys
+import json
+import types
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+import multiprocessing
+import concurrent.futures
+import pandas as pd
+
+
+MAX_JOB_WORKERS = 2           # worker processes
+MAX_JOBS_PER_SESSION = 4      # jobs queued or running for one session
+IN_FLIGHT = ('queued', 'running')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, key TEXT, function TEXT, arguments TEXT, status TEXT, error TEXT,
+                                 result BLOB, stats TEXT, created_at REAL, started_at REAL, finished_at REAL);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status);
+CREATE TABLE IF NOT EXISTS requests (job_id TEXT, session TEXT, title TEXT, requested_at REAL);
+CREATE INDEX IF NOT EXISTS requests_session ON requests (session, requested_at);
+"""
+
+
+# Streamlit runs each page as the __main__ module, and a spawned process imports __main__ again from its file before it
+# runs anything: the workers would run the page. They are started with a blank __main__ module instead.
+class _WorkerProcess(multiprocessing.context.SpawnProcess):
+
+    _lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            page, sys.modules['__main__'] = sys.modules['__main__'], types.ModuleType('__main__')
+            try:
+                super().start()
+            finally:
+                sys.modules['__main__'] = page
+
+class _WorkerContext(multiprocessing.context.SpawnContext):
+    Process = _WorkerProcess
+
+
+def job_key(function, arguments):
+    return hashlib.sha256(json.dumps([function, arguments], sort_keys=True, default=str).encode()).hexdigest()
+
+
+# Body of a job in a worker process: mark it running, then run worker(function, arguments), which returns a DataFrame
+# and a dict of statistics. The DataFrame comes back as Parquet bytes.
+def _execute(path, job_id, worker, function, arguments):
+    with sqlite3.connect(path, timeout=30) as connection:
+        connection.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job_id))
+    report, stats = worker(function, arguments)
+    buffer = io.BytesIO()
+    report.to_parquet(buffer, index=False)
+    return buffer.getvalue(), stats
+
+
+class JobQueue:
+
+    # worker(function, arguments) and initializer(*initargs) must be functions of an importable module (the worker
+    # processes are spawned, and import them again)
+    def __init__(self, path, worker, initializer=None, initargs=(), max_workers=MAX_JOB_WORKERS, max_jobs_per_session=MAX_JOBS_PER_SESSION):
+        self.path   = path
+        self.worker = worker
+        self.max_jobs_per_session = max_jobs_per_session
+        self.lock   = threading.Lock()
+        self.pool   = concurrent.futures.ProcessPoolExecutor(max_workers  = max_workers,
+                                                             mp_context   = _WorkerContext(),
+                                                             initializer  = initializer,
+                                                             initargs     = initargs,
+                                                             )
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.executescript(_SCHEMA)
+
+        # Jobs interrupted by a restart of the app are started again
+        for job_id, function, arguments in self.connection.execute("SELECT id, function, arguments FROM jobs WHERE status IN ('queued', 'running')").fetchall():
+            self.connection.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE id = ?", (job_id,))
+            self._start(job_id, function, json.loads(arguments))
+        self.connection.commit()
+
+    def _start(self, job_id, function, arguments):
+        future = self.pool.submit(_execute, self.path, job_id, self.worker, function, arguments)
+        future.add_done_callback(lambda future: self._finish(job_id, future))
+
+    def _finish(self, job_id, future):
+        try:
+            result, stats = future.result()
+            values = ('done', None, result, json.dumps(stats, default=str))
+        except Exception as error:
+            values = ('error', str(error), None, None)
+        with self.lock:
+            self.connection.execute('UPDATE jobs SET status = ?, error = ?, result = ?, stats = ?, finished_at = ? WHERE id = ?', values + (time.time(), job_id))
+            self.connection.commit()
+
+    # Queue a job for a session, or join the identical job in flight (same key: by default, a hash of the function and
+    # arguments). Returns the job id and whether it was already in flight. Raises ValueError when the session has too
+    # many jobs in flight.
+    def submit(self, function, arguments, session=None, title=None, key=None):
+        key, now = key or job_key(function, arguments), time.time()
+        with self.lock:
+            in_flight = self.connection.execute(f"""SELECT COUNT(DISTINCT job_id) FROM requests JOIN jobs ON jobs.id = requests.job_id
+                                                    WHERE session = ? AND status IN {IN_FLIGHT}""", (session,)).fetchone()[0]
+            if in_flight >= self.max_jobs_per_session:
+                raise ValueError(f"There are already {in_flight} reports being generated for this user; please wait until they are ready")
+            row = self.connection.execute(f"SELECT id FROM jobs WHERE key = ? AND status IN {IN_FLIGHT} LIMIT 1", (key,)).fetchone()
+            job_id, duplicate = (row[0], True) if row else (uuid.uuid4().hex[:12], False)
+            if not duplicate:
+                self.connection.execute("INSERT INTO jobs (id, key, function, arguments, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                                        (job_id, key, function, json.dumps(arguments, default=str), now))
+            self.connection.execute('INSERT INTO requests VALUES (?, ?, ?, ?)', (job_id, session, title, now))
+            self.connection.commit()
+        if not duplicate:
+            self._start(job_id, function, arguments)
+        return job_id, duplicate
+
+    # Jobs requested by a session, most recent last: id, title, function, status, error, queue position (queued jobs),
+    # and the times it was requested, started and finished
+    def jobs(self, session, limit=20):
+        with self.lock:
+            rows = self.connection.execute("""SELECT jobs.id, requests.title, jobs.function, jobs.status, jobs.error, requests.requested_at,
+                                                     jobs.created_at, jobs.started_at, jobs.finished_at
+                                              FROM requests JOIN jobs ON jobs.id = requests.job_id
+                                              WHERE session = ? ORDER BY requests.requested_at DESC LIMIT ?""", (session, limit)).fetchall()
+            queued = [job_id for job_id, in self.connection.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at")]
+        fields = ('id', 'title', 'function', 'status', 'error', 'requested_at', 'created_at', 'started_at', 'finished_at')
+        jobs = [dict(zip(fields, row)) for row in reversed(rows)]
+        for job in jobs:
+            job['position'] = queued.index(job['id']) + 1 if job['id'] in queued else None
+        return jobs
+
+    # Report and statistics of a finished job
+    def result(self, job_id):
+        with self.lock:
+            result, stats = self.connection.execute("SELECT result, stats FROM jobs WHERE id = ? AND status = 'done'", (job_id,)).fetchone()
+        return pd.read_parquet(io.BytesIO(result)), json.loads(stats)
+
+    # Report and statistics of the last finished job of a key, or None
+    def completed(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT result, stats FROM jobs WHERE key = ? AND status = 'done' ORDER BY finished_at DESC LIMIT 1", (key,)).fetchone()
+        return None if row is None else (pd.read_parquet(io.BytesIO(row[0])), json.loads(row[1]))
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'error')}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
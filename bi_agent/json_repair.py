@@ -0,0 +1,200 @@
+# Tolerant parsing of the JSON produced by the models: the JSON object is pulled out of the surrounding prose and repaired
+# locally (Python literals, single quotes, trailing commas, unquoted keys, truncated output), then checked and coerced
+# against a validator compiled once from the JSON schema of the function or report. Most malformed answers are fixed
+# here instead of asking the model again.
+
+import json
+
+
+_PYTHON_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+#%%######################################################################################################################
+# REPAIR
+#########################################################################################################################
+
+# Text of the first JSON object in the text, rewritten as strict JSON. Raises ValueError when there is no object.
+def repair_json(text):
+
+    start = text.find('{')
+    if start < 0:
+        raise ValueError("No JSON object in the answer")
+
+    output, stack, quote, position = [], [], None, start
+    while position < len(text):
+        character = text[position]
+
+        if quote:
+            if character == '\\' and position + 1 < len(text):
+                following = text[position + 1]
+                output.append("'" if following == "'" else '\\' + following)
+                position += 1
+            elif character == quote:
+                output.append('"')
+                quote = None
+            elif character == '"':
+                output.append('\\"')
+            elif character == '\n':
+                output.append('\\n')
+            else:
+                output.append(character)
+
+        elif character in '"\'':
+            output.append('"')
+            quote = character
+
+        elif character in '{[':
+            output.append(character)
+            stack.append(_CLOSERS[character])
+
+        elif character in '}]':
+            _strip_trailing_comma(output)
+            output.append(stack.pop() if stack else character)
+            if not stack:
+                break
+
+        elif character.isalpha() or character == '_':
+            end = position
+            while end < len(text) and (text[end].isalnum() or text[end] == '_'):
+                end += 1
+            word = text[position:end]
+            if text[end:].lstrip().startswith(':'):
+                output.append(json.dumps(word))  # unquoted key
+            else:
+                output.append(_PYTHON_LITERALS.get(word, word))
+            position = end - 1
+
+        else:
+            output.append(character)
+        position += 1
+
+    # Truncated answer: close the open string and containers
+    if quote:
+        output.append('"')
+    if stack:
+        _strip_trailing_comma(output)
+        if ''.join(output[-3:]).rstrip().endswith(':'):
+            output.append('null')
+        output.extend(reversed(stack))
+    return ''.join(output)
+
+
+def _strip_trailing_comma(output):
+    while output and output[-1].isspace():
+        output.pop()
+    if output and output[-1] == ',':
+        output.pop()
+
+
+# JSON value of an answer, and whether it had to be repaired. Raises ValueError when it cannot be repaired.
+def loads_tolerant(text):
+    try:
+        return json.loads(text), False
+    except ValueError:
+        pass
+    return json.loads(repair_json(text)), True
+
+
+#%%######################################################################################################################
+# VALIDATION
+#########################################################################################################################
+
+def _coerce_string(value, path):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    if isinstance(value, list) and len(value) == 1 and isinstance(value[0], str):
+        return value[0]
+    raise ValueError(f"{path} must be a string")
+
+
+def _coerce_integer(value, path):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().lstrip('-').isdigit():
+        return int(value)
+    raise ValueError(f"{path} must be an integer")
+
+
+def _coerce_number(value, path):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{path} must be a number") from None
+
+
+_BOOLEAN_STRINGS = {'true': True, 'yes': True, '1': True, 'false': False, 'no': False, '0': False}
+
+def _coerce_boolean(value, path):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in _BOOLEAN_STRINGS:
+        return _BOOLEAN_STRINGS[value.strip().lower()]
+    raise ValueError(f"{path} must be true or false")
+
+
+_COERCERS = {
+    'string' : _coerce_string,
+    'integer': _coerce_integer,
+    'number' : _coerce_number,
+    'boolean': _coerce_boolean,
+}
+
+
+# Validator of a JSON schema (the subset used by function definitions: object, array, string, integer, number, boolean
+# and enum of strings), compiled once into nested functions. The validator returns the value coerced to the schema:
+# a string where a list of strings is expected becomes a list, "True" becomes true, "10" becomes 10, null optional
+# properties and unknown properties are dropped. Raises ValueError listing every problem.
+def compile_validator(schema):
+    validate = _compile(schema)
+    return lambda value: validate(value, 'arguments')
+
+
+def _compile(schema):
+
+    kind = schema.get('type')
+    if kind == 'object':
+        properties = {name: _compile(property_schema) for name, property_schema in schema.get('properties', {}).items()}
+        required   = tuple(schema.get('required', ()))
+        def validate_object(value, path):
+            if not isinstance(value, dict):
+                raise ValueError(f"{path} must be an object")
+            result, problems = {}, []
+            for name, item in value.items():
+                if name in properties and item is not None:
+                    try:
+                        result[name] = properties[name](item, name)
+                    except ValueError as error:
+                        problems.append(str(error))
+            problems += [f"{name} is required" for name in required if name not in value or value[name] is None]
+            if problems:
+                raise ValueError('; '.join(problems))
+            return result
+        return validate_object
+
+    if kind == 'array':
+        validate_item = _compile(schema.get('items', {}))
+        def validate_array(value, path):
+            items = value if isinstance(value, (list, tuple)) else [value]
+            return [validate_item(item, f'{path}[{index}]') for index, item in enumerate(items)]
+        return validate_array
+
+    if 'enum' in schema:
+        options = {str(option).lower(): option for option in schema['enum']}
+        def validate_enum(value, path):
+            if isinstance(value, str) and value.strip().lower() in options:
+                return options[value.strip().lower()]
+            raise ValueError(f"{path} must be one of {list(options.values())}")
+        return validate_enum
+
+    if kind in _COERCERS:
+        return _COERCERS[kind]
+    return lambda value, path: value
@@ -0,0 +1,115 @@
+# Cache of LLM responses keyed on the model, the normalized messages and the sampling parameters.
+# Recent entries are held in memory (LRU with time-to-live); with a path, entries are also written to a SQLite file that
+# survives restarts and is read when the memory tier misses.
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import collections
+
+
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL  = 24 * 3600  # seconds
+
+# Message fields that determine the answer; anything else (ids, timings) is left out of the key
+_MESSAGE_FIELDS = ['role', 'content', 'name', 'tool_call_id', 'tool_calls']
+
+
+def normalize_messages(messages):
+    normalized = []
+    for message in messages:
+        message = {field: message[field] for field in _MESSAGE_FIELDS if message.get(field) is not None}
+        if isinstance(message.get('content'), str):
+            message['content'] = message['content'].strip()
+        normalized.append(message)
+    return normalized
+
+
+# Key of a request: a hash of the model, the messages (a list of chat messages or a single prompt) and the parameters
+def response_key(model, messages, **parameters):
+    if isinstance(messages, str):
+        messages = [{'role': 'user', 'content': messages}]
+    request = {'model': model, 'messages': normalize_messages(messages), 'parameters': parameters}
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl_seconds=RESPONSE_CACHE_TTL, path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = collections.OrderedDict()  # key -> (expires, response)
+        self.lock    = threading.Lock()           # the cache is shared by every session (thread) of the app
+        self.counts  = collections.Counter()
+        self.connection = None
+        if path:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires REAL, response TEXT)')
+            self.connection.commit()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Cached response (a JSON-serializable value), or None
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.counts['hits'] += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+                self.counts['expired'] += 1
+
+            if self.connection is not None:
+                row = self.connection.execute('SELECT expires, response FROM responses WHERE key = ?', (key,)).fetchone()
+                if row is not None and row[0] > now:
+                    response = json.loads(row[1])
+                    self._remember(key, row[0], response)
+                    self.counts['hits'] += 1
+                    self.counts['disk_hits'] += 1
+                    return response
+
+            self.counts['misses'] += 1
+            return None
+
+    def put(self, key, response):
+        expires = time.time() + self.ttl_seconds
+        with self.lock:
+            self._remember(key, expires, response)
+            if self.connection is not None:
+                self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)', (key, expires, json.dumps(response)))
+                self.connection.execute('DELETE FROM responses WHERE expires <= ?', (time.time(),))
+                self.connection.commit()
+
+    def _remember(self, key, expires, response):
+        self.entries[key] = (expires, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counts['evictions'] += 1
+
+    # Cached response, or the result of calling the function (which is then cached)
+    def get_or_call(self, key, function):
+        response = self.get(key)
+        if response is None:
+            response = function()
+            self.put(key, response)
+        return response
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counts['hits'] + self.counts['misses']
+            return {
+                'entries'  : len(self.entries),
+                'hits'     : self.counts['hits'],
+                'disk_hits': self.counts['disk_hits'],
+                'misses'   : self.counts['misses'],
+                'evictions': self.counts['evictions'],
+                'expired'  : self.counts['expired'],
+                'hit_rate' : self.counts['hits'] / lookups if lookups else None,
+            }
@@ -0,0 +1,201 @@
+# Shared client of the LLM APIs, built once per process and used by every page and session:
+#   - HTTP connection pooling with keep-alive (one requests session for OpenAI, one Replicate client per API token),
+#   - retries of rate limits (429), server errors (5xx), timeouts and connection errors, with jittered exponential backoff,
+#   - optional hedging: when a complete (non-streamed) response takes longer than hedge_after_seconds, a second identical
+#     request is sent and the first response wins,
+#   - credentials passed with each request, instead of setting openai.api_key or REPLICATE_API_TOKEN for the process.
+
+import time
+import random
+import functools
+import asyncio
+import threading
+import concurrent.futures
+import requests
+import openai
+from openai import api_requestor
+import replicate
+
+
+MAX_RETRIES      = 3     # attempts after the first one
+BACKOFF_SECONDS  = 0.5   # base of the exponential backoff
+MAX_BACKOFF      = 8.0   # longest wait between attempts (seconds)
+POOL_SIZE        = 32    # keep-alive connections per host
+REQUEST_TIMEOUT  = 120   # seconds
+RETRY_STATUSES   = {408, 409, 429, 500, 502, 503, 504}
+
+_RETRY_OPENAI_ERRORS = (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.Timeout,
+                        openai.error.APIConnectionError, openai.error.TryAgain)
+
+
+# Whether a failed call may succeed when it is sent again, and the wait asked by the server (Retry-After), if any
+def retryable(error):
+    retry_after = None
+    headers = getattr(error, 'headers', None) or getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        retry_after = float(headers.get('retry-after') or headers.get('Retry-After'))
+    except (TypeError, ValueError, AttributeError):
+        pass
+    if isinstance(error, _RETRY_OPENAI_ERRORS):
+        return True, retry_after
+    if isinstance(error, openai.error.APIError):
+        return (error.http_status or 500) in RETRY_STATUSES, retry_after
+    if isinstance(error, replicate.exceptions.ReplicateError):
+        return (error.status or 0) in RETRY_STATUSES, retry_after
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)), retry_after
+
+
+class LLMClient:
+
+    def __init__(self, api_base=None, replicate_base_url=None, max_retries=MAX_RETRIES, backoff_seconds=BACKOFF_SECONDS,
+                 max_backoff=MAX_BACKOFF, hedge_after_seconds=None, pool_size=POOL_SIZE, request_timeout=REQUEST_TIMEOUT):
+        self.api_base = api_base
+        self.replicate_base_url = replicate_base_url
+        self.max_retries     = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff     = max_backoff
+        self.hedge_after_seconds = hedge_after_seconds
+        self.request_timeout = request_timeout
+        self.stats = {'calls': 0, 'retries': 0, 'hedges': 0, 'hedges_won': 0, 'failures': 0}
+        self.lock  = threading.Lock()
+
+        # One pool of keep-alive connections for every OpenAI request made through the client (openai 0.28 opens a
+        # session per thread otherwise, and Streamlit runs each script run in a new thread); see pooled
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.replicate_clients = {}
+        self.hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='llm-hedge') if hedge_after_seconds else None
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff_seconds * 2 ** attempt))  # full jitter
+
+    # Call function(*args, **kwargs), retrying the transient errors until the deadline (time.perf_counter() value), if any;
+    # with hedge=True (and hedge_after_seconds set), a slow call is sent a second time and the first result is returned.
+    # Only calls that are safe to repeat should be hedged.
+    def call(self, function, *args, hedge=False, deadline=None, **kwargs):
+        self._count('calls')
+        for attempt in range(self.max_retries + 1):
+            try:
+                if hedge and self.hedge_pool is not None:
+                    return self._hedged(function, args, kwargs)
+                return function(*args, **kwargs)
+            except Exception as error:
+                wait = self._retry_wait(error, attempt, deadline)
+                if wait is None:
+                    raise
+                time.sleep(wait)
+
+    # Wait before the next attempt, or None when the error is not transient, the attempts are spent or the wait would
+    # end after the deadline
+    def _retry_wait(self, error, attempt, deadline):
+        retry, retry_after = retryable(error)
+        wait = self.backoff(attempt, retry_after)
+        if not retry or attempt == self.max_retries or (deadline is not None and time.perf_counter() + wait >= deadline):
+            self._count('failures')
+            return None
+        self._count('retries')
+        return wait
+
+    def _hedged(self, function, args, kwargs):
+        first = self.hedge_pool.submit(function, *args, **kwargs)
+        done, _ = concurrent.futures.wait([first], timeout=self.hedge_after_seconds)
+        if done:
+            return first.result()
+        self._count('hedges')
+        second = self.hedge_pool.submit(function, *args, **kwargs)
+        done, _ = concurrent.futures.wait([first, second], return_when=concurrent.futures.FIRST_COMPLETED)
+        winner = next(future for future in (first, second) if future in done)
+        if winner is second:
+            self._count('hedges_won')
+        if winner.exception() is not None and not (other := second if winner is first else first).done():
+            return other.result()  # the other request may still succeed
+        return winner.result()
+
+    # Same as call, for coroutine functions (the evaluation harness)
+    async def acall(self, function, *args, hedge=False, deadline=None, **kwargs):
+        self._count('calls')
+        for attempt in range(self.max_retries + 1):
+            try:
+                if not (hedge and self.hedge_after_seconds):
+                    return await function(*args, **kwargs)
+                first = asyncio.ensure_future(function(*args, **kwargs))
+                done, _ = await asyncio.wait([first], timeout=self.hedge_after_seconds)
+                if done:
+                    return first.result()
+                self._count('hedges')
+                second = asyncio.ensure_future(function(*args, **kwargs))
+                done, pending = await asyncio.wait([first, second], return_when=asyncio.FIRST_COMPLETED)
+                for task in pending:
+                    task.cancel()
+                if second in done:
+                    self._count('hedges_won')
+                return done.pop().result()
+            except Exception as error:
+                wait = self._retry_wait(error, attempt, deadline)
+                if wait is None:
+                    raise
+                await asyncio.sleep(wait)
+
+    #%%##################################################################################################################
+    # OPENAI
+    #####################################################################################################################
+
+    # An openai function that sends its request on the pooled session. openai 0.28 takes no session argument: it uses the
+    # session of the calling thread, and closes and replaces it once it is MAX_SESSION_LIFETIME_SECS old. The pooled session
+    # is put in the slot of the thread for the call only, as just created so that openai never closes it, and the session
+    # the thread had is put back afterwards; openai.requestssession, read by every thread of the process, is left alone.
+    def pooled(self, function):
+        @functools.wraps(function)
+        def pooled_function(*args, **kwargs):
+            context  = api_requestor._thread_context
+            previous = context.__dict__.copy()
+            context.session, context.session_create_time = self.session, time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                context.__dict__.clear()
+                context.__dict__.update(previous)
+        return pooled_function
+
+    def _openai_arguments(self, api_key, kwargs, timeout=None):
+        return {'api_key': api_key, 'request_timeout': timeout or self.request_timeout, **({'api_base': self.api_base} if self.api_base else {}), **kwargs}
+
+    # Chat completion with the API key of the request. A streamed response is retried until it starts (the chunks
+    # already shown cannot be taken back); a complete response may also be hedged. With a timeout (seconds), each request
+    # times out after it and no attempt starts after it (the latency budget of the model router).
+    def chat_completion(self, api_key, timeout=None, **kwargs):
+        deadline = time.perf_counter() + timeout if timeout else None
+        return self.call(self.pooled(openai.ChatCompletion.create), hedge=not kwargs.get('stream'), deadline=deadline, **self._openai_arguments(api_key, kwargs, timeout))
+
+    async def achat_completion(self, api_key, **kwargs):
+        return await self.acall(openai.ChatCompletion.acreate, hedge=not kwargs.get('stream'), **self._openai_arguments(api_key, kwargs))
+
+    def embedding(self, api_key, **kwargs):
+        return self.call(self.pooled(openai.Embedding.create), hedge=True, **self._openai_arguments(api_key, kwargs))
+
+    #%%##################################################################################################################
+    # REPLICATE
+    #####################################################################################################################
+
+    # Replicate client of an API token, reused with its connection pool by every request with that token
+    def replicate(self, api_token):
+        with self.lock:
+            if api_token not in self.replicate_clients:
+                self.replicate_clients[api_token] = replicate.Client(api_token=api_token, base_url=self.replicate_base_url)
+            return self.replicate_clients[api_token]
+
+    # Create a prediction (the request is not hedged: each prediction is billed)
+    def create_prediction(self, api_token, **kwargs):
+        return self.call(self.replicate(api_token).predictions.create, **kwargs)
+
+    async def acreate_prediction(self, api_token, **kwargs):
+        return await self.acall(self.replicate(api_token).predictions.async_create, **kwargs)
@@ -0,0 +1,197 @@
+# Vendor market share: share of each vendor inside each "market" (geographic_market x category_name)
+
+import time
+import threading
+import collections
+import numpy as np
+import pandas as pd
+
+
+SHARE_METRICS = {'volume_share': 'total_volume', 'spend_share': 'total_amount'}
+DEFAULT_TOP_N = 10
+
+# Number of market tables (one per combination of non-vendor filters and time period) kept in memory
+MARKET_CACHE_SIZE = 256
+
+
+def normalize_share_metric(share_metric):
+    metric = '_'.join(str(share_metric or 'spend_share').lower().split())
+    if metric not in SHARE_METRICS:
+        raise ValueError(f"Unknown share metric: '{share_metric}'. Use 'volume_share' or 'spend_share'")
+    return metric
+
+
+#%%######################################################################################################################
+# MARKET TABLE
+#########################################################################################################################
+
+# Volume and spend of every vendor in every market, grouped so that each market is a contiguous slice.
+# Market totals (the share denominators) are computed once per table and reused by every request on the same markets.
+# The transactions without a vendor (code -1) are part of the market totals, since they are spend of the market, but
+# they are not a vendor: they are never ranked, listed or the market leader.
+class MarketTable:
+
+    def __init__(self, market, vendor, amount, n_categories):
+
+        # One grouped pass over the transactions: (market, vendor) -> volume, spend
+        grouped = pd.DataFrame({'market': market, 'vendor': vendor, 'amount': amount}).groupby(['market', 'vendor'], sort=True)['amount'].agg(['size', 'sum'])
+        self.n_categories = n_categories
+        self.market = grouped.index.get_level_values('market').to_numpy()
+        self.vendor = grouped.index.get_level_values('vendor').to_numpy()
+        self.values = {'total_volume': grouped['size'].to_numpy(dtype=np.float64), 'total_amount': grouped['sum'].to_numpy()}
+        self.known  = self.vendor >= 0
+
+        # Market slices and denominators
+        self.starts  = np.flatnonzero(np.r_[True, self.market[1:] != self.market[:-1]]) if len(self.market) else np.array([], dtype=np.int64)
+        self.ends    = np.r_[self.starts[1:], len(self.market)].astype(np.int64)
+        self.totals  = {name: np.add.reduceat(values, self.starts) if len(values) else values for name, values in self.values.items()}
+
+    def __len__(self):
+        return len(self.market)
+
+    def shares(self, value_column):
+        denominators = np.repeat(self.totals[value_column], self.ends - self.starts)
+        return self.values[value_column] / denominators
+
+    # Top N vendors of each market by partial selection (argpartition), sorting only the N selected entries
+    def top_n(self, value_column, n):
+        values, selected, ranks = self.values[value_column], [], []
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            top = start + np.flatnonzero(self.known[start:end])
+            if len(top) > n:
+                top = top[np.argpartition(-values[top], n - 1)[:n]]
+            selected.append(top[np.argsort(-values[top], kind='stable')])
+            ranks.append(np.arange(1, len(top) + 1))
+        if not selected:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        return np.concatenate(selected), np.concatenate(ranks)
+
+    # Entries of the given vendors, with their rank inside their market and the market leader
+    def vendor_entries(self, value_column, vendor_codes):
+        values  = self.values[value_column]
+        entries = np.flatnonzero(np.isin(self.vendor, vendor_codes))
+        slices  = np.searchsorted(self.starts, entries, 'right') - 1
+        ranks, leaders = [], []
+        for entry, market in zip(entries.tolist(), slices.tolist()):
+            vendors = self.starts[market] + np.flatnonzero(self.known[self.starts[market]:self.ends[market]])
+            ranks.append(1 + int((values[vendors] > values[entry]).sum()))
+            leaders.append(vendors[int(np.argmax(values[vendors]))])
+        return entries, np.array(ranks, dtype=np.int64), np.array(leaders, dtype=np.int64)
+
+
+#%%######################################################################################################################
+# ENGINE
+#########################################################################################################################
+
+class MarketShareEngine:
+
+    def __init__(self, spend_engine, cache_size=MARKET_CACHE_SIZE):
+        self.engine = spend_engine
+        self.cache  = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.lock   = threading.Lock()  # the cache is shared by every session and by concurrent report calls
+
+    # Market table for the non-vendor filters and time period, built once and reused for any vendor selection
+    def market_table(self, filters, intervals):
+
+        key = (tuple(sorted((column, tuple(codes.tolist())) for column, codes in filters.items())), intervals)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key], None
+
+        # Transactions without a market or category belong to no market
+        columns  = self.engine.columns
+        rows     = self.engine.rows_for(filters, intervals)
+        rows_scanned = len(rows)
+        rows     = rows[(columns['geographic_market'].codes[rows] >= 0) & (columns['category_name'].codes[rows] >= 0)]
+        n_categories = len(columns['category_name'].categories)
+        market   = columns['geographic_market'].codes[rows].astype(np.int64) * n_categories + columns['category_name'].codes[rows]
+        table    = MarketTable(market, columns['vendor_name'].codes[rows], self.engine.amount[rows], n_categories)
+
+        with self.lock:
+            self.cache[key] = table
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return table, rows_scanned
+
+    def market_labels(self, table, entries):
+        columns = self.engine.columns
+        markets = table.market[entries]
+        return {
+            'geographic_market': columns['geographic_market'].decode(markets // table.n_categories),
+            'category_name'    : columns['category_name'].decode(markets % table.n_categories),
+        }
+
+    def _prepare(self, share_metric, time_period_filter_list, fiscal_calendar, today, filter_lists):
+        metric    = normalize_share_metric(share_metric)
+        filters   = self.engine.filter_codes(filter_lists)
+        vendors   = filters.pop('vendor_name', None)
+        intervals = self.engine.resolve_intervals(time_period_filter_list, fiscal_calendar, today)
+        table, rows_scanned = self.market_table(filters, intervals)
+        return metric, vendors, table, rows_scanned
+
+    def _log(self, report, started, rows_scanned, result):
+        self.engine.log_query({
+            'report'      : report,
+            'source'      : 'market cache' if rows_scanned is None else 'transactions',
+            'rows_scanned': rows_scanned or 0,
+            'rows_output' : len(result),
+            'elapsed_ms'  : (time.perf_counter() - started) * 1000,
+            })
+
+    #%%##################################################################################################################
+    # REPORTS
+    #####################################################################################################################
+
+    # Top N vendors of each market (or every selected vendor, ranked in its markets), with their share of the market; top_n
+    # applies only to the unfiltered ranking
+    def market_share_report(self, share_metric, top_n=None, time_period_filter_list=None, fiscal_calendar=None, today=None, **filter_lists):
+
+        started = time.perf_counter()
+        metric, vendors, table, rows_scanned = self._prepare(share_metric, time_period_filter_list, fiscal_calendar, today, filter_lists)
+        value_column = SHARE_METRICS[metric]
+        top_n = max(int(top_n or DEFAULT_TOP_N), 1)
+
+        shares = table.shares(value_column)
+        if vendors is None:
+            entries, ranks = table.top_n(value_column, top_n)
+        else:
+            entries, ranks, _ = table.vendor_entries(value_column, vendors)
+
+        result = pd.DataFrame({
+            **self.market_labels(table, entries),
+            'rank'        : ranks,
+            'vendor_name' : self.engine.columns['vendor_name'].decode(table.vendor[entries]),
+            'total_volume': table.values['total_volume'][entries].astype(np.int64),
+            'total_amount': table.values['total_amount'][entries],
+            metric        : 100.0 * shares[entries],
+            })
+        self._log('market_share_report', started, rows_scanned, result)
+        return result
+
+    # Markets served by the selected vendors (or by each market leader when no vendor is selected), with share, rank and leader
+    def vendor_market_share_map(self, share_metric, time_period_filter_list=None, fiscal_calendar=None, today=None, **filter_lists):
+
+        started = time.perf_counter()
+        metric, vendors, table, rows_scanned = self._prepare(share_metric, time_period_filter_list, fiscal_calendar, today, filter_lists)
+        value_column = SHARE_METRICS[metric]
+
+        shares = table.shares(value_column)
+        if vendors is None:
+            entries, ranks = table.top_n(value_column, 1)
+            leaders = entries
+        else:
+            entries, ranks, leaders = table.vendor_entries(value_column, vendors)
+
+        vendor_names = self.engine.columns['vendor_name'].decode
+        result = pd.DataFrame({
+            **self.market_labels(table, entries),
+            'vendor_name'       : vendor_names(table.vendor[entries]),
+            metric              : 100.0 * shares[entries],
+            'rank'              : ranks,
+            'market_leader'     : vendor_names(table.vendor[leaders]),
+            f'leader_{metric}'  : 100.0 * shares[leaders],
+            })
+        self._log('vendor_market_share_map', started, rows_scanned, result)
+        return result.sort_values(['vendor_name', metric], ascending=[True, False], ignore_index=True)
@@ -0,0 +1,73 @@
+# Routing of the questions of an agent to the cheapest model that meets its latency SLO. The models are tried from the
+# cheapest: an answer that fails validation (e.g. tool arguments that do not match the function schemas) escalates to
+# the next model, and a timeout or an unavailable API fails over to the fallback backend (e.g. Llama-2 on Replicate).
+# Every decision and its latency is recorded in the telemetry (kind 'route').
+
+import time
+
+from bi_agent.llm_client import retryable
+
+
+ROUTE_MODELS = ('gpt-3.5-turbo', 'gpt-4')  # cheapest first
+LATENCY_SLO_SECONDS = 30  # budget of the whole route (escalations included) before failing over
+
+
+class ModelRouter:
+
+    def __init__(self, models=ROUTE_MODELS, latency_slo_seconds=LATENCY_SLO_SECONDS, fallback_model=None, telemetry=None):
+        self.models = list(models)
+        if not self.models:
+            raise ValueError("The model router needs at least one model")
+        self.latency_slo_seconds = latency_slo_seconds
+        self.fallback_model = fallback_model  # name of the fallback backend, for the decisions and the telemetry
+        self.telemetry = telemetry
+
+    @property
+    def name(self):
+        return ' > '.join(self.models)
+
+    def _decide(self, decisions, page, model, decision, started, reason=None, status='ok'):
+        latency_ms = (time.perf_counter() - started) * 1000
+        decisions.append({'model': model, 'decision': decision, 'reason': reason, 'latency_ms': latency_ms})
+        if self.telemetry is not None:
+            self.telemetry.record('route', page, model, name=decision, status=status, latency_ms=latency_ms)
+
+    # Answer with the first model whose answer passes validate(answer) (which raises ValueError otherwise); call(model,
+    # timeout) asks one model within the remaining latency budget (seconds). When every model fails validation, the answer
+    # of the last one is returned (the page explains the problems to the user). When a model times out, its API is
+    # unavailable or the budget is spent, fallback(timeout) answers instead, if given. Returns (model, answer, decisions).
+    def route(self, page, call, validate, fallback=None):
+
+        deadline  = time.perf_counter() + self.latency_slo_seconds
+        decisions = []
+        answer, answered_by, failure = None, None, None
+        for model in self.models:
+            started = time.perf_counter()
+            if started >= deadline:
+                failure = failure or TimeoutError(f"The latency budget of {self.latency_slo_seconds} seconds was spent")
+                self._decide(decisions, page, model, 'skipped', started, 'latency budget spent', status='timeout')
+                break
+            try:
+                answer, answered_by = call(model, deadline - started), model
+            except Exception as error:
+                if not retryable(error)[0]:
+                    raise
+                failure = error
+                self._decide(decisions, page, model, 'failed over', started, repr(error), status='timeout' if 'timeout' in repr(error).lower() else 'error')
+                break
+            try:
+                validate(answer)
+            except ValueError as error:
+                self._decide(decisions, page, model, 'escalated', started, str(error), status='error')
+                continue
+            self._decide(decisions, page, model, 'accepted', started)
+            return model, answer, decisions
+
+        if failure is not None and fallback is not None:
+            started = time.perf_counter()
+            answer  = fallback(self.latency_slo_seconds)
+            self._decide(decisions, page, self.fallback_model or 'fallback', 'fallback', started, repr(failure))
+            return self.fallback_model or 'fallback', answer, decisions
+        if answered_by is None:
+            raise failure
+        return answered_by, answer, decisions
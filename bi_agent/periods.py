@@ -0,0 +1,218 @@
+# Resolve the "period names" used in the time_period_filter_list of the BI agent prompts into date intervals
+
+import re
+import datetime
+import functools
+import numpy as np
+
+
+# Fiscal years start on this month and are named after the calendar year in which they end (FY2024 = Jul-2023..Jun-2024)
+FISCAL_YEAR_START_MONTH = 7
+
+_LAST_N_PATTERN  = re.compile(r'^LAST (\d+) (YEAR|QUARTER|MONTH|WEEK|DAY)S?$')
+_LAST_PATTERN    = re.compile(r'^LAST (YEAR|QUARTER|MONTH|WEEK)$')
+_TO_DATE_PATTERN = re.compile(r'^(YEAR|QUARTER|MONTH) TO DATE$')
+_YEAR_PATTERN    = re.compile(r'^YEAR (\d{4})$')
+_QUARTER_PATTERN = re.compile(r'^QUARTER (\d{4})-Q?([1-4])$')
+_MONTH_PATTERN   = re.compile(r'^MONTH (\d{4})-(\d{1,2})$')
+_RANGE_PATTERN   = re.compile(r'^FROM (\d{4}-\d{2}-\d{2}) TO (\d{4}-\d{2}-\d{2})$')
+
+# Years covered by the default calendar dimension table
+CALENDAR_FIRST_YEAR = 1950
+CALENDAR_LAST_YEAR  = 2150
+
+# Number of compiled time_period_filter_lists kept in memory
+COMPILED_FILTER_CACHE_SIZE = 1024
+
+
+#%%######################################################################################################################
+# MONTH ARITHMETIC
+#########################################################################################################################
+
+# Months are handled as a single integer (year * 12 + month - 1) so that years and quarters are simple offsets
+def month_index(date):
+    return date.year * 12 + date.month - 1
+
+def month_start(index):
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+def year_offset(fiscal_calendar):
+    return (FISCAL_YEAR_START_MONTH - 1) if fiscal_calendar else 0
+
+def named_year_start_index(year, fiscal_calendar):
+    offset = year_offset(fiscal_calendar)
+    return year * 12 + offset - (12 if offset else 0)
+
+def shift_years(date, years):
+    try:
+        return date.replace(year=date.year + years)
+    except ValueError:  # Feb 29th
+        return date.replace(year=date.year + years, day=28)
+
+
+#%%######################################################################################################################
+# CALENDAR DIMENSION TABLE
+#########################################################################################################################
+
+# One row per day with the start of its week (day number) and of its month, quarter and year (month index),
+# for both the normal and the fiscal calendar. Lookups are a single array index instead of date arithmetic.
+class CalendarTable:
+
+    def __init__(self, first_year=CALENDAR_FIRST_YEAR, last_year=CALENDAR_LAST_YEAR):
+        self.first_day = np.datetime64(f'{first_year:04d}-01-01', 'D').astype(np.int64)
+        self.last_day  = np.datetime64(f'{last_year + 1:04d}-01-01', 'D').astype(np.int64)
+
+        days   = np.arange(self.first_day, self.last_day, dtype=np.int64)
+        months = days.astype('M8[D]').astype('M8[M]').astype(np.int64) + 1970 * 12
+        self.columns = {'transaction_day': days, 'transaction_week': days - (days + 3) % 7, 'transaction_month': months}  # 1970-01-01 was a Thursday
+        for fiscal_calendar in (False, True):
+            offset = year_offset(fiscal_calendar)
+            self.columns[('transaction_quarter', fiscal_calendar)] = months - (months - offset) % 3
+            self.columns[('transaction_year',    fiscal_calendar)] = months - (months - offset) % 12
+
+    def covers(self, days):
+        return len(days) == 0 or (days.min() >= self.first_day and days.max() < self.last_day)
+
+    # Codes of a transaction_* dimension for an array of day numbers (days since 1970-01-01)
+    def lookup(self, dimension, days, fiscal_calendar=False):
+        column = self.columns.get(dimension)
+        if column is None:
+            column = self.columns[(dimension, bool(fiscal_calendar))]
+        return column[days - self.first_day]
+
+    def period_starts(self, date, fiscal_calendar=False):
+        day = np.array([np.datetime64(date, 'D').astype(np.int64)])
+        return {
+            'WEEK'   : self.lookup('transaction_week', day)[0].astype('M8[D]').astype(datetime.date),
+            'MONTH'  : int(self.lookup('transaction_month', day)[0]),
+            'QUARTER': int(self.lookup('transaction_quarter', day, fiscal_calendar)[0]),
+            'YEAR'   : int(self.lookup('transaction_year', day, fiscal_calendar)[0]),
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def calendar_table():
+    return CalendarTable()
+
+
+#%%######################################################################################################################
+# PERIOD RESOLUTION
+#########################################################################################################################
+
+# Each period resolves to a half-open interval [start, end) of dates; None means "ALL TIME"
+def resolve_period(period_name, today=None, fiscal_calendar=False, previous=None):
+
+    # Prepare
+    today  = today or datetime.date.today()
+    name   = ' '.join(str(period_name).upper().split())
+    starts = calendar_table().period_starts(today, fiscal_calendar)
+    month, week = starts['MONTH'], starts['WEEK']
+
+    if name == 'ALL TIME':
+        return None
+
+    if name == 'STLY':
+        if previous is None:
+            raise ValueError("'STLY' must follow another period in time_period_filter_list")
+        return (shift_years(previous[0], -1), shift_years(previous[1], -1))
+
+    if match := _LAST_PATTERN.match(name):
+        name = f'LAST 1 {match.group(1)}S'
+
+    if match := _LAST_N_PATTERN.match(name):
+        count, unit = int(match.group(1)), match.group(2)
+        if unit in ('DAY', 'WEEK') and count * (7 if unit == 'WEEK' else 1) >= ((week if unit == 'WEEK' else today) - datetime.date.min).days:
+            raise ValueError(f"Time period out of range: '{period_name}'")
+        if unit == 'DAY':
+            return (today - datetime.timedelta(days=count), today)
+        if unit == 'WEEK':
+            return (week - datetime.timedelta(weeks=count), week)
+        if unit == 'MONTH':
+            return (month_start(month - count), month_start(month))
+        if unit == 'QUARTER':
+            return (month_start(starts['QUARTER'] - 3 * count), month_start(starts['QUARTER']))
+        return (month_start(starts['YEAR'] - 12 * count), month_start(starts['YEAR']))
+
+    if match := _TO_DATE_PATTERN.match(name):
+        unit = match.group(1)
+        tomorrow = today + datetime.timedelta(days=1)
+        return (month_start(starts[unit]), tomorrow)
+
+    if match := _YEAR_PATTERN.match(name):
+        start = named_year_start_index(int(match.group(1)), fiscal_calendar)
+        return (month_start(start), month_start(start + 12))
+
+    if match := _QUARTER_PATTERN.match(name):
+        start = named_year_start_index(int(match.group(1)), fiscal_calendar) + 3 * (int(match.group(2)) - 1)
+        return (month_start(start), month_start(start + 3))
+
+    if match := _MONTH_PATTERN.match(name):
+        if not 1 <= int(match.group(2)) <= 12:
+            raise ValueError(f"Unknown time period name: '{period_name}' (months are 1 to 12)")
+        start = int(match.group(1)) * 12 + int(match.group(2)) - 1
+        return (month_start(start), month_start(start + 1))
+
+    # Explicit ranges are clamped to the years of the calendar table ('TO 9999-12-31' means "until further notice")
+    if match := _RANGE_PATTERN.match(name):
+        first, last = datetime.date(CALENDAR_FIRST_YEAR, 1, 1), datetime.date(CALENDAR_LAST_YEAR, 12, 31)
+        start = min(max(datetime.date.fromisoformat(match.group(1)), first), last)
+        end   = min(max(datetime.date.fromisoformat(match.group(2)), first), last) + datetime.timedelta(days=1)
+        return (start, end)
+
+    raise ValueError(f"Unknown time period name: '{period_name}'")
+
+
+# Resolve a full time_period_filter_list; returns None when no time filter applies
+def resolve_periods(time_period_filter_list, today=None, fiscal_calendar=False):
+
+    if not time_period_filter_list:
+        return None
+
+    intervals = []
+    previous  = None
+    for period_name in time_period_filter_list:
+        interval = resolve_period(period_name, today=today, fiscal_calendar=fiscal_calendar, previous=previous)
+        if interval is None:
+            return None
+        intervals.append(interval)
+        previous = interval
+
+    return intervals
+
+
+# Sort and merge overlapping or adjacent intervals so that no date is counted twice
+def merge_intervals(intervals):
+
+    if intervals is None:
+        return None
+
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# Compile a time_period_filter_list into merged [start, end) date intervals; compiled filters are cached
+@functools.lru_cache(maxsize=COMPILED_FILTER_CACHE_SIZE)
+def _compile_time_filter(period_names, today, fiscal_calendar):
+    intervals = merge_intervals(resolve_periods(list(period_names), today=today, fiscal_calendar=fiscal_calendar))
+    return None if intervals is None else tuple(intervals)
+
+def compile_time_filter(time_period_filter_list, today=None, fiscal_calendar=False):
+    if not time_period_filter_list:
+        return None
+    return _compile_time_filter(tuple(time_period_filter_list), today or datetime.date.today(), bool(fiscal_calendar))
+
+
+# Row ranges [first, last) of each interval in an array of datetimes sorted ascending (binary search, O(log n) per bound).
+# The day bounds are clipped to the days of the array before they are cast to its unit, so dates that unit cannot hold
+# (after 2262 for nanoseconds) still find the first or last row instead of overflowing.
+def interval_row_ranges(sorted_datetimes, intervals):
+    bounds = np.array([d for interval in intervals for d in interval], dtype='M8[D]')
+    if len(sorted_datetimes):
+        bounds = np.clip(bounds, sorted_datetimes[0].astype('M8[D]'), sorted_datetimes[-1].astype('M8[D]') + 1)
+    positions = np.searchsorted(sorted_datetimes, bounds.astype(sorted_datetimes.dtype), 'left')
+    return list(zip(positions[0::2].tolist(), positions[1::2].tolist()))
@@ -0,0 +1,48 @@
+# Agent prompts built once per process: the system prompt, the prompt template and the tool list of each agent, with their
+# token counts. The pages load them through bi_agent.resources.load_agent_prompt (st.cache_resource), keyed by name and
+# version, so a rerun of a page does not rebuild them.
+
+import hashlib
+
+from bi_agent.history import count_text_tokens, count_tools_tokens
+
+
+# Placeholder of the user question in prompt templates
+SENTENCE = '[SENTENCE]'
+
+
+# Version of a prompt: the explicit version of the page plus a hash of the code (and constant strings) of the functions
+# that build it, so an edited prompt is rebuilt without restarting the app
+def prompt_version(version, *builders):
+    digest = hashlib.sha1(str(version).encode())
+    pending = [builder.__code__ for builder in builders]
+    while pending:
+        code = pending.pop()
+        digest.update(code.co_code)
+        for constant in code.co_consts:
+            if hasattr(constant, 'co_code'):
+                pending.append(constant)
+            else:
+                digest.update(repr(constant).encode())
+    return f'{version}-{digest.hexdigest()[:12]}'
+
+
+class AgentPrompt:
+
+    def __init__(self, name, model, version, system_message, prompt_template=SENTENCE, tools=None):
+        self.name    = name
+        self.model   = model
+        self.version = version
+        self.system_message  = system_message
+        self.prompt_template = prompt_template
+        self.tools = tools or []
+
+        # Counted once: prompts and tool lists are large, and every turn needs their size
+        self.system_tokens  = count_text_tokens(system_message, model) if system_message else 0
+        self.tools_tokens   = count_tools_tokens(self.tools, model)
+
+    def prompt(self, sentence):
+        return self.prompt_template.replace(SENTENCE, sentence)
+
+    def stats(self):
+        return {'name': self.name, 'version': self.version, 'system_tokens': self.system_tokens, 'tools_tokens': self.tools_tokens, 'tools': len(self.tools)}
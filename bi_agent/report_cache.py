@@ -0,0 +1,130 @@
+# Cache of the reports of the agent tools, keyed by their canonical arguments: the same report asked with filter lists in
+# another order, in another case, with None instead of [], or with 'YEAR TO DATE' instead of the equivalent explicit
+# range, is computed once. Entries are evicted least recently used within a memory budget, and each key includes the
+# watermark of the transactions data (bi_agent.data.data_watermark): reports of previous data are never served, and
+# are dropped as soon as new data is seen.
+
+import json
+import hashlib
+import threading
+import collections
+
+from bi_agent.spend_engine import FILTER_COLUMNS
+from bi_agent.market_share import DEFAULT_TOP_N, normalize_share_metric
+
+
+REPORT_CACHE_BYTES = 256 * 2**20  # memory of the cached reports
+REPORT_CACHE_SIZE  = 1024
+
+
+# Canonical form of the arguments of a report function, for the engine (spend engine of the data) and for the key:
+#   - filter lists resolved to the values of the data (see bi_agent.entity_resolution), deduplicated and sorted; None for
+#     no filter ([] included),
+#   - period names upper case, and fiscal_calendar False when it is not given,
+#   - share_metric and top_n with their defaults, metrics and dimensions stripped (their order is the report layout).
+# Returns (arguments, key fields, matches): the key fields have the time periods resolved to their merged date intervals,
+# and the matches list the filter names that were not values of the data as given: (argument, name, value, confidence),
+# with value None when the name matches nothing.
+# Raises ValueError for an unknown period name or share metric, before any report is built.
+def canonical_arguments(arguments, engine, today=None):
+
+    canonical, matches = {}, []
+    for name, value in arguments.items():
+        if name in FILTER_COLUMNS:
+            column = engine.columns[FILTER_COLUMNS[name]]
+            names  = [str(item) for item in value or []]
+            matches.extend((name, given, resolved, score) for given, (resolved, score) in zip(names, column.resolve(names)) if score < 1)
+            value  = sorted(set(column.canonical(names))) or None
+        elif name == 'time_period_filter_list':
+            value = [' '.join(str(period).upper().split()) for period in value or []] or None
+        elif name == 'fiscal_calendar' or name == 'approximate':
+            value = bool(value)
+        elif name == 'share_metric':
+            value = normalize_share_metric(value)
+        elif name == 'top_n':
+            value = max(int(value or DEFAULT_TOP_N), 1)
+        elif name in ('metrics', 'dimensions'):
+            value = [str(item).strip() for item in value or []] or None
+        canonical[name] = value
+
+    key_fields = dict(canonical)
+    if 'time_period_filter_list' in canonical:
+        intervals = engine.resolve_intervals(canonical['time_period_filter_list'], canonical.get('fiscal_calendar'), today)
+        key_fields['time_period_filter_list'] = None if intervals is None else [[str(start), str(end)] for start, end in intervals]
+    return canonical, key_fields, matches
+
+
+def report_key(function, key_fields, watermark):
+    return hashlib.sha256(json.dumps([function, key_fields, watermark], sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ReportCache:
+
+    # store(key) is a second tier read when memory misses (the finished jobs of the job queue), returning (report,
+    # stats) or None
+    def __init__(self, max_bytes=REPORT_CACHE_BYTES, max_entries=REPORT_CACHE_SIZE, store=None):
+        self.max_bytes   = max_bytes
+        self.max_entries = max_entries
+        self.store       = store
+        self.entries   = collections.OrderedDict()  # key -> (report, stats, nbytes)
+        self.nbytes    = 0
+        self.watermark = None
+        self.lock      = threading.Lock()
+        self.counts    = collections.Counter()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Entries of another watermark are dropped as soon as a new one is seen
+    def _check_watermark(self, watermark):
+        if watermark != self.watermark:
+            self.counts['invalidated'] += len(self.entries)
+            self.entries.clear()
+            self.nbytes, self.watermark = 0, watermark
+
+    # Cached (report, stats) of a key, or None
+    def get(self, key, watermark):
+        with self.lock:
+            self._check_watermark(watermark)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.counts['hits'] += 1
+                return self.entries[key][:2]
+
+        if self.store is not None and (stored := self.store(key)) is not None:
+            self.put(key, watermark, *stored)
+            with self.lock:
+                self.counts['hits'] += 1
+                self.counts['store_hits'] += 1
+            return stored
+
+        with self.lock:
+            self.counts['misses'] += 1
+        return None
+
+    def put(self, key, watermark, report, stats):
+        nbytes = int(report.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            self._check_watermark(watermark)
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[2]
+            self.entries[key] = (report, stats, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes or len(self.entries) > self.max_entries:
+                self.nbytes -= self.entries.popitem(last=False)[1][2]
+                self.counts['evicted'] += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counts['hits'] + self.counts['misses']
+            return {'hits'       : self.counts['hits'],
+                    'store_hits' : self.counts['store_hits'],
+                    'misses'     : self.counts['misses'],
+                    'hit_rate'   : self.counts['hits'] / lookups if lookups else None,
+                    'evicted'    : self.counts['evicted'],
+                    'invalidated': self.counts['invalidated'],
+                    'entries'    : len(self.entries),
+                    'megabytes'  : self.nbytes / 2**20,
+                    }
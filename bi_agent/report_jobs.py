@@ -0,0 +1,67 @@
+# Report computations behind the report tools of the agent with function calling (bi_agent.report_tools), by report
+# function. They run inline in the tool threads of the app, with the engines shared by the sessions, or in the worker
+# processes of the job queue (bi_agent.job_queue), which build their own engines from the transactions file.
+
+import functools
+
+from bi_agent.data import data_watermark, load_transactions
+from bi_agent.spend_engine import SpendEngine
+from bi_agent.market_share import MarketShareEngine
+from bi_agent.benchmarking import update_peer_group_index
+
+
+# Each computation takes the engine loaders ('spend', 'market_share', 'peer_groups') and the arguments of the engine method
+def generic_spend_report(engines, **arguments):
+    return engines['spend']().generic_spend_report(**arguments)
+
+def benchmarking_spend_report(engines, **arguments):
+    return engines['peer_groups']().benchmarking_report(**arguments)
+
+def market_share_report(engines, **arguments):
+    return engines['market_share']().market_share_report(**arguments)
+
+def vendor_market_share_map(engines, **arguments):
+    return engines['market_share']().vendor_market_share_map(**arguments)
+
+REPORTS = {
+    'generate_and_send_generic_spend_report'     : generic_spend_report,
+    'generate_and_send_benchmarking_spend_report': benchmarking_spend_report,
+    'generate_and_send_market_share_report'      : market_share_report,
+    'generate_and_send_vendor_market_share_map'  : vendor_market_share_map,
+}
+
+
+# Report of a function and the statistics of its query (source, rows scanned, time). Raises ValueError when the
+# arguments are not valid for the engine (e.g. an unknown period name).
+def build_report(function, arguments, engines):
+    report = REPORTS[function](engines, **arguments)
+    return report, engines['spend']().last_query_stats
+
+
+#%%######################################################################################################################
+# WORKER PROCESSES
+#########################################################################################################################
+
+_engines = {}
+
+# Load the transactions once per worker process (and again when their watermark changes); the market share and peer
+# group engines are built on first use, the peer group index from the previous one when rows were only appended
+def init_worker(transactions_path=None, history_months=None, approximate_metrics=False):
+    watermark = data_watermark(transactions_path)
+    spend = SpendEngine(load_transactions(transactions_path, history_months), sketches=approximate_metrics)
+    peer_groups = _engines.get('peer_groups')
+    previous_peer_groups = peer_groups() if peer_groups is not None and peer_groups.cache_info().currsize else None
+    _engines.update({
+        'path'        : transactions_path,
+        'history'     : history_months,
+        'approximate' : approximate_metrics,
+        'watermark'   : watermark,
+        'spend'       : lambda: spend,
+        'market_share': functools.cache(lambda: MarketShareEngine(spend)),
+        'peer_groups' : functools.cache(lambda: update_peer_group_index(previous_peer_groups, spend, transactions_path, history_months)),
+    })
+
+def run_report_job(function, arguments):
+    if data_watermark(_engines['path']) != _engines['watermark']:
+        init_worker(_engines['path'], _engines['history'], _engines['approximate'])
+    return build_report(function, arguments, _engines)
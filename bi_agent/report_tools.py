@@ -0,0 +1,213 @@
+# Report functions of the BI agent with function calling (page 2), registered in report_tools when this module is first
+# imported, so their tool schemas are generated once per process instead of on every rerun of the page
+
+import time
+import threading
+import streamlit as st
+
+from bi_agent.tool_registry import ToolRegistry
+from bi_agent.report_jobs import build_report
+from bi_agent.spend_engine import FILTER_COLUMNS
+from bi_agent.report_cache import canonical_arguments, report_key
+from bi_agent.resources import load_data_watermark, load_job_queue, load_report_cache, load_spend_engine, load_market_share_engine, load_peer_group_index
+
+
+# Descriptions of the parameters shared by the report functions
+PARAMETER_DESCRIPTIONS = {
+    "title"                  : "The name or title of the report to be displayed to the business user",
+    "user_request"           : "The text of the business user request or question that you are seeking to answer with this report. It will not be used in producing the report (it's passed only for documentation purposes.)",
+    "share_metric"           : "Which share metric should the report display. Pick one of these two options: 'volume_share' or 'spend_share'.",
+    "vendor_filter_list"     : "List of vendor companies that the report should include. If this filter is needed, please pass a list of names for one or more vendors. If this optional parameter is not provided, then all vendors will be used.",
+    "category_filter_list"   : "List of spend categories that the report should include. If this filter is needed, please pass a list of names for one or more spend categories. If this optional parameter is not provided, then all categories will be used.",
+    "hospital_filter_list"   : "List of hospitals that the report should include. If this filter is needed, please pass a list of names for one or more hospitals/facilities. If this optional parameter is not provided, then all hospitals will be used.",
+    "department_filter_list" : "List of departments that the report should include. If this filter is needed, please pass a list of names for one or more departments. If this optional parameter is not provided, then all departments will be used.",
+    "division_filter_list"   : "List of divisions that the report should include. If this filter is needed, please pass a list of names for one or more divisions. If this optional parameter is not provided, then all divisions will be used.",
+    "gl_account_filter_list" : "List of GL accounts that the report should include. If this filter is needed, please pass a list of names for one or more GL accounts. If this optional parameter is not provided, then all GL Accounts will be used.",
+    "time_period_filter_list": "List of time periods that the report should include. If this filter is needed, please pass a list of one or more period names such as: ['YEAR TO DATE', 'STLY', 'LAST 5 YEARS']. For the complete list of acceptable period names, please refer to the system instructions provided earlier. If this optional parameter is not provided, the report will either apply a default period or include all time.",
+    "fiscal_calendar"        : "If True, the time periods in the filters and dimensions will be calculated using fiscal years and fiscal quarters. If False, they will be calculated using normal calendar years and quarters. If this optional parameter is not provided, then normal calendar periods will be used as default.",
+}
+
+report_tools = ToolRegistry(PARAMETER_DESCRIPTIONS)
+
+# Engines of the reports built in the app process, shared by every session
+REPORT_ENGINES = {'spend': load_spend_engine, 'market_share': load_market_share_engine, 'peer_groups': load_peer_group_index}
+
+
+# Reports of the tool calls running in worker threads are collected here and rendered by the script thread afterwards;
+# the session of the calls is kept here too (for the jobs of the job queue)
+report_outbox = threading.local()
+
+def run_tool(function, arguments, session=None):
+    report_outbox.reports, report_outbox.session = [], session
+    try:
+        return function(**arguments), report_outbox.reports
+    finally:
+        report_outbox.reports = report_outbox.session = None
+
+def send_report(title, report, stats):
+    if getattr(report_outbox, 'reports', None) is not None:
+        report_outbox.reports.append((title, report, stats))
+    else:
+        show_report(title, report, stats)
+
+def show_report(title, report, stats):
+    st.subheader(title)
+    st.dataframe(report, hide_index=True)
+    st.caption(f"Answered from {stats['source']}: {stats['rows_scanned']:,} rows scanned in {stats['elapsed_ms']:.0f} ms")
+
+
+# Filter names of a report that were matched to other values of the data, or to none, for the message to the model
+def match_note(matches):
+    notes = [f"'{name}' matched no {FILTER_COLUMNS[argument].replace('_', ' ')}" if value is None else f"'{name}' was matched to '{value}' ({score:.0%} confidence)"
+             for argument, name, value, score in matches]
+    return f" ({'; '.join(notes)})" if notes else ""
+
+
+# Outcome of a report tool call: status 'generated' (the report was sent), 'queued' (job_id is building it) or 'failed',
+# and the message for the model
+DELIVERED = ('generated', 'queued')
+
+def delivery(status, message, job_id=None):
+    return {'status': status, 'message': message, 'job_id': job_id}
+
+
+# Send the report from the report cache when the same report (same canonical arguments and data watermark) was already
+# built; otherwise queue it in the job queue and tell the model its job id, or, without a job queue ([jobs] enabled =
+# false), build the report here and send it. Returns a delivery.
+def deliver_report(function, label, title, arguments, unit='rows'):
+    started   = time.perf_counter()
+    watermark = load_data_watermark()
+    try:
+        arguments, key_fields, matches = canonical_arguments(arguments, load_spend_engine())
+    except ValueError as error:
+        return delivery('failed', f"{label} could not be generated: {error}. Please explain the problem to the user.")
+    key  = report_key(function, key_fields, watermark)
+    note = match_note(matches)
+
+    report_cache = load_report_cache()
+    if (cached := report_cache.get(key, watermark)) is not None:
+        report, stats = cached
+        send_report(title, report, {**stats, 'source': f"the report cache ({stats['source']})", 'rows_scanned': 0, 'elapsed_ms': (time.perf_counter() - started) * 1000})
+        return delivery('generated', f"{label} has been generated ({len(report)} {unit}){note}. Please respond to the user: 'Report {title} sent.'")
+
+    job_queue = load_job_queue()
+    if job_queue is not None:
+        try:
+            job_id, _ = job_queue.submit(function, arguments, session=getattr(report_outbox, 'session', None), title=title, key=key)
+        except ValueError as error:
+            return delivery('failed', f"{label} could not be generated: {error}. Please explain the problem to the user.")
+        return delivery('queued', f"{label} has been queued as job {job_id}{note}; it will be shown to the user when it is ready. Please respond to the user: 'Report {title} is being generated.'", job_id)
+
+    try:
+        report, stats = build_report(function, arguments, REPORT_ENGINES)
+    except ValueError as error:
+        return delivery('failed', f"{label} could not be generated: {error}. Please explain the problem to the user.")
+    report_cache.put(key, watermark, report, stats)
+    send_report(title, report, stats)
+    return delivery('generated', f"{label} has been generated ({len(report)} {unit}){note}. Please respond to the user: 'Report {title} sent.'")
+
+
+# Function definitions with global connection and logging function
+@report_tools.register("Use this function to generate a Generic Spend Report and send it to the business user. ",
+    metrics    = "List of metric names that the report should display. Example: ['total_volume', 'p50_amount', 'num_vendors']. For the complete list of acceptable metric names, please refer to the system instructions provided earlier. This is an optional parameter: don't supply it if the business question can be answered without any metrics.",
+    dimensions = "List of dimension names that the report should display. Example: ['vendor_name', 'transaction_year']. For the complete list of acceptable dimention names, please refer to the system instructions provided earlier. This is an optional parameter: don't supply it if dimensions aren't strictly necesary to answer the business question.",
+    )
+def generate_and_send_generic_spend_report( title                   : str,
+                                            user_request            : str,
+                                            vendor_filter_list      : list[str] = None, 
+                                            category_filter_list    : list[str] = None,
+                                            hospital_filter_list    : list[str] = None,
+                                            department_filter_list  : list[str] = None,
+                                            division_filter_list    : list[str] = None,
+                                            gl_account_filter_list  : list[str] = None,
+                                            time_period_filter_list : list[str] = None,
+                                            fiscal_calendar         : bool      = None, 
+                                            metrics                 : list[str] = None, 
+                                            dimensions              : list[str] = None):
+    arguments = dict(metrics                 = metrics,
+                     dimensions              = dimensions,
+                     time_period_filter_list = time_period_filter_list,
+                     fiscal_calendar         = fiscal_calendar,
+                     vendor_filter_list      = vendor_filter_list,
+                     category_filter_list    = category_filter_list,
+                     hospital_filter_list    = hospital_filter_list,
+                     department_filter_list  = department_filter_list,
+                     division_filter_list    = division_filter_list,
+                     gl_account_filter_list  = gl_account_filter_list,
+                     approximate             = st.secrets.get("data", {}).get("approximate_metrics", False),
+                     )
+    return deliver_report('generate_and_send_generic_spend_report', 'Generic spend report', title, arguments)
+
+@report_tools.register("Use this function to generate a Benchmarking Spend Report and send it to the business user. ")
+def generate_and_send_benchmarking_spend_report(  title                   : str,
+                                                    user_request            : str, 
+                                                    vendor_filter_list      : list[str] = None, 
+                                                    category_filter_list    : list[str] = None,
+                                                    hospital_filter_list    : list[str] = None,
+                                                    department_filter_list  : list[str] = None,
+                                                    division_filter_list    : list[str] = None,
+                                                    gl_account_filter_list  : list[str] = None,
+                                                    time_period_filter_list : list[str] = None,
+                                                    fiscal_calendar         : bool      = None):
+    arguments = dict(hospital_filter_list    = hospital_filter_list,
+                     category_filter_list    = category_filter_list,
+                     time_period_filter_list = time_period_filter_list,
+                     fiscal_calendar         = fiscal_calendar,
+                     vendor_filter_list      = vendor_filter_list,
+                     department_filter_list  = department_filter_list,
+                     division_filter_list    = division_filter_list,
+                     gl_account_filter_list  = gl_account_filter_list,
+                     )
+    return deliver_report('generate_and_send_benchmarking_spend_report', 'Benchmarking report', title, arguments)
+
+@report_tools.register("Use this function to generate a Market Share Report and send it to the business user. ",
+    top_n = "Maximum number of vendors to display in each market (top N by the share metric). If this optional parameter is not provided, the top 10 vendors will be displayed. When vendor_filter_list is given, every selected vendor is displayed with its rank instead.",
+    )
+def generate_and_send_market_share_report(  title                   : str, 
+                                            share_metric            : str,
+                                            user_request            : str,
+                                            top_n                   : int       = None,
+                                            vendor_filter_list      : list[str] = None, 
+                                            category_filter_list    : list[str] = None,
+                                            hospital_filter_list    : list[str] = None,
+                                            department_filter_list  : list[str] = None,
+                                            division_filter_list    : list[str] = None,
+                                            gl_account_filter_list  : list[str] = None,
+                                            time_period_filter_list : list[str] = None,
+                                            fiscal_calendar         : bool      = None):
+    arguments = dict(share_metric            = share_metric,
+                     top_n                   = top_n,
+                     time_period_filter_list = time_period_filter_list,
+                     fiscal_calendar         = fiscal_calendar,
+                     vendor_filter_list      = vendor_filter_list,
+                     category_filter_list    = category_filter_list,
+                     hospital_filter_list    = hospital_filter_list,
+                     department_filter_list  = department_filter_list,
+                     division_filter_list    = division_filter_list,
+                     gl_account_filter_list  = gl_account_filter_list,
+                     )
+    return deliver_report('generate_and_send_market_share_report', 'Marketshare report', title, arguments)
+
+@report_tools.register("Use this function to generate a Vendor Market Share Map and send it to the business user. ")
+def generate_and_send_vendor_market_share_map(  title                   : str, 
+                                                share_metric            : str,
+                                                user_request            : str,
+                                                vendor_filter_list      : list[str] = None, 
+                                                category_filter_list    : list[str] = None,
+                                                hospital_filter_list    : list[str] = None,
+                                                department_filter_list  : list[str] = None,
+                                                division_filter_list    : list[str] = None,
+                                                gl_account_filter_list  : list[str] = None,
+                                                time_period_filter_list : list[str] = None,
+                                                fiscal_calendar         : bool      = None):
+    arguments = dict(share_metric            = share_metric,
+                     time_period_filter_list = time_period_filter_list,
+                     fiscal_calendar         = fiscal_calendar,
+                     vendor_filter_list      = vendor_filter_list,
+                     category_filter_list    = category_filter_list,
+                     hospital_filter_list    = hospital_filter_list,
+                     department_filter_list  = department_filter_list,
+                     division_filter_list    = division_filter_list,
+                     gl_account_filter_list  = gl_account_filter_list,
+                     )
+    return deliver_report('generate_and_send_vendor_market_share_map', 'Marketshare Map', title, arguments, unit='markets')
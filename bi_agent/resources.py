@@ -0,0 +1,201 @@
+# Objects shared by every page and session of the app, built once per process with st.cache_resource
+
+import os
+import tempfile
+import threading
+import streamlit as st
+
+from bi_agent.data import data_watermark, load_transactions
+from bi_agent.spend_engine import SpendEngine
+from bi_agent.market_share import MarketShareEngine
+from bi_agent.benchmarking import update_peer_group_index
+from bi_agent.llm_client import MAX_RETRIES, POOL_SIZE, LLMClient
+from bi_agent.model_router import ROUTE_MODELS, LATENCY_SLO_SECONDS, ModelRouter
+from bi_agent.llm_cache import RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, ResponseCache
+from bi_agent.prompts import AgentPrompt
+from bi_agent.telemetry import TELEMETRY_CAPACITY, FLUSH_BATCH, Telemetry, serve_prometheus
+from bi_agent.tool_executor import MAX_TOOL_WORKERS, ToolExecutor
+from bi_agent.job_queue import MAX_JOB_WORKERS, MAX_JOBS_PER_SESSION, JobQueue
+from bi_agent.report_jobs import init_worker, run_report_job
+from bi_agent.report_cache import REPORT_CACHE_BYTES, REPORT_CACHE_SIZE, ReportCache
+from bi_agent.semantic_cache import SIMILARITY_THRESHOLD, HashingEmbedder, OpenAIEmbedder, PineconeVectorIndex, SemanticCache
+
+
+# Transactions file or transaction store directory ([data] transactions_path), and history_months to load only the last
+# months of a store
+def transactions_path():
+    return st.secrets.get("data", {}).get("transactions_path")
+
+def history_months():
+    return st.secrets.get("data", {}).get("history_months")
+
+# Whether the spend engine builds the rollup sketches that answer the approximate metrics ([data] approximate_metrics)
+def approximate_metrics():
+    return bool(st.secrets.get("data", {}).get("approximate_metrics", False))
+
+# Watermark of the transactions data (see bi_agent.data.data_watermark), checked on every report request
+def load_data_watermark():
+    return data_watermark(transactions_path())
+
+
+# Load the transactions once per process and share the engines across sessions; when the data changes (a new
+# watermark), the engines are built again from the new data on the next request, except the peer group index, which
+# folds in the rows appended to a transaction store (see bi_agent.benchmarking.update_peer_group_index)
+def load_spend_engine():
+    return _load_spend_engine(load_data_watermark())
+
+def load_market_share_engine():
+    return _load_market_share_engine(load_data_watermark())
+
+def load_peer_group_index():
+    spend_engine = load_spend_engine()
+    latest = _latest_peer_group_index()
+    with latest['lock']:
+        if latest['index'] is None or latest['index'].engine is not spend_engine:
+            latest['index'] = update_peer_group_index(latest['index'], spend_engine, transactions_path(), history_months())
+        return latest['index']
+
+@st.cache_resource(max_entries=1)
+def _load_spend_engine(watermark):
+    return SpendEngine(load_transactions(transactions_path(), history_months()), sketches=approximate_metrics())
+
+@st.cache_resource(max_entries=1)
+def _load_market_share_engine(watermark):
+    return MarketShareEngine(_load_spend_engine(watermark))
+
+@st.cache_resource
+def _latest_peer_group_index():
+    return {'index': None, 'lock': threading.Lock()}
+
+
+# System prompt, prompt template and tools of an agent, built by the page once per process and version (see
+# bi_agent.prompts.prompt_version) and shared by every session; the builder returns the AgentPrompt fields as a dict
+@st.cache_resource
+def load_agent_prompt(name, model, version, _builder):
+    return AgentPrompt(name, model, version, **_builder())
+
+
+# Thread pool running the tool calls of the agents, shared by every session ([tools] max_workers in the secrets)
+@st.cache_resource
+def load_tool_executor():
+    return ToolExecutor(max_workers=st.secrets.get("tools", {}).get("max_workers", MAX_TOOL_WORKERS))
+
+
+# Queue of the report jobs of the agent tools, run by worker processes that load the transactions themselves; configured
+# in the [jobs] secrets (enabled = false to build the reports in the tool threads instead, path of the SQLite job store,
+# max_workers processes, max_jobs_per_session in flight)
+@st.cache_resource
+def load_job_queue():
+    settings = st.secrets.get("jobs", {})
+    if not settings.get("enabled", True):
+        return None
+    return JobQueue(path                 = settings.get("path", os.path.join(tempfile.gettempdir(), 'bi_agent_jobs.db')),
+                    worker               = run_report_job,
+                    initializer          = init_worker,
+                    initargs             = (transactions_path(), history_months(), approximate_metrics()),
+                    max_workers          = settings.get("max_workers", MAX_JOB_WORKERS),
+                    max_jobs_per_session = settings.get("max_jobs_per_session", MAX_JOBS_PER_SESSION),
+                    )
+
+
+def show_job_queue_stats():
+    if (job_queue := load_job_queue()) is not None:
+        stats = job_queue.stats()
+        st.sidebar.caption(f"Report jobs: {stats['queued']} queued, {stats['running']} running, {stats['done']} done, {stats['error']} failed")
+
+
+# Cache of the reports of the agent tools by canonical arguments and data watermark, backed by the finished jobs of the
+# job queue; configured in the [report_cache] secrets (max_megabytes of reports in memory, max_entries)
+@st.cache_resource
+def load_report_cache():
+    settings = st.secrets.get("report_cache", {})
+    job_queue = load_job_queue()
+    return ReportCache(max_bytes   = settings.get("max_megabytes", REPORT_CACHE_BYTES / 2**20) * 2**20,
+                       max_entries = settings.get("max_entries", REPORT_CACHE_SIZE),
+                       store       = job_queue.completed if job_queue is not None else None,
+                       )
+
+
+def show_report_cache_stats():
+    stats = load_report_cache().stats()
+    hit_rate = f"{100 * stats['hit_rate']:.0f}%" if stats['hit_rate'] is not None else "n/a"
+    st.sidebar.caption(f"Report cache: {stats['hits']} hits ({stats['store_hits']} from finished jobs), {stats['misses']} misses, hit rate {hit_rate}, {stats['entries']} reports in {stats['megabytes']:.1f} MB")
+
+
+# Telemetry of the LLM and tool calls of every page; configured in the [telemetry] secrets (path of the SQLite file or
+# .parquet directory the events are flushed to, capacity of the ring buffer, flush_batch, and prometheus_port to serve
+# the Prometheus text at /metrics)
+@st.cache_resource
+def load_telemetry():
+    settings = st.secrets.get("telemetry", {})
+    telemetry = Telemetry(path        = settings.get("path"),
+                          capacity    = settings.get("capacity", TELEMETRY_CAPACITY),
+                          flush_batch = settings.get("flush_batch", FLUSH_BATCH),
+                          )
+    if settings.get("prometheus_port"):
+        serve_prometheus(telemetry, settings["prometheus_port"])
+    return telemetry
+
+
+# Client of the OpenAI and Replicate APIs shared by every page and session (connection pool, retries, hedging); configured
+# in the [llm_client] secrets (max_retries, hedge_after_seconds, pool_size) and the api_base / base_url of [openai] and
+# [replicate]. API keys are passed with each request.
+@st.cache_resource
+def load_llm_client():
+    settings = st.secrets.get("llm_client", {})
+    return LLMClient(api_base            = st.secrets.get("openai", {}).get("api_base"),
+                     replicate_base_url  = st.secrets.get("replicate", {}).get("base_url"),
+                     max_retries         = settings.get("max_retries", MAX_RETRIES),
+                     hedge_after_seconds = settings.get("hedge_after_seconds"),
+                     pool_size           = settings.get("pool_size", POOL_SIZE),
+                     )
+
+
+# Router of the questions of the agent with function calling to the cheapest OpenAI model whose answer is valid, with
+# failover to Llama-2 on Replicate; configured in the [router] secrets (models, cheapest first, latency_slo_seconds,
+# and fallback = false to disable the failover)
+@st.cache_resource
+def load_model_router():
+    settings = st.secrets.get("router", {})
+    return ModelRouter(models              = settings.get("models", ROUTE_MODELS),
+                       latency_slo_seconds = settings.get("latency_slo_seconds", LATENCY_SLO_SECONDS),
+                       fallback_model      = 'llama-2-70b-chat' if settings.get("fallback", True) else None,
+                       telemetry           = load_telemetry(),
+                       )
+
+
+# LLM response cache; configured in the [cache] secrets (max_entries, ttl_seconds, and path of the SQLite file, if any)
+@st.cache_resource
+def load_response_cache():
+    settings = st.secrets.get("cache", {})
+    return ResponseCache(max_entries = settings.get("max_entries", RESPONSE_CACHE_SIZE),
+                         ttl_seconds = settings.get("ttl_seconds", RESPONSE_CACHE_TTL),
+                         path        = settings.get("path"),
+                         )
+
+
+def show_response_cache_stats():
+    stats = load_response_cache().stats()
+    hit_rate = f"{100 * stats['hit_rate']:.0f}%" if stats['hit_rate'] is not None else "n/a"
+    st.sidebar.caption(f"LLM response cache: {stats['hits']} hits ({stats['disk_hits']} from disk), {stats['misses']} misses, hit rate {hit_rate}, {stats['entries']} entries")
+
+
+# Semantic cache of one agent (namespace), configured in the [semantic_cache] secrets: threshold, embedding_model (OpenAI
+# embeddings instead of the local hashing embedder) and pinecone_index (a shared Pinecone index instead of process memory)
+@st.cache_resource
+def load_semantic_cache(namespace):
+    settings = st.secrets.get("semantic_cache", {})
+    embed = HashingEmbedder()
+    if settings.get("embedding_model"):
+        embed = OpenAIEmbedder(settings["embedding_model"], api_key=st.secrets["openai"]["key"], client=load_llm_client())
+    index = None
+    if settings.get("pinecone_index"):
+        from pinecone import Pinecone
+        index = PineconeVectorIndex(Pinecone(api_key=st.secrets["pinecone"]["key"]).Index(settings["pinecone_index"]), namespace)
+    return SemanticCache(embed, index, settings.get("threshold", SIMILARITY_THRESHOLD))
+
+
+def show_semantic_cache_stats(namespace):
+    stats = load_semantic_cache(namespace).stats()
+    hit_rate = f"{100 * stats['hit_rate']:.0f}%" if stats['hit_rate'] is not None else "n/a"
+    st.sidebar.caption(f"Semantic cache: {stats['hits']} of {stats['lookups']} questions reused a previous report (hit rate {hit_rate}, threshold {stats['threshold']:.2f})")
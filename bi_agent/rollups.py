@@ -0,0 +1,93 @@
+# Materialized monthly rollups of the transactions table, used to answer additive spend queries without rescanning raw rows
+
+import numpy as np
+import pandas as pd
+
+from bi_agent.sketches import HLL_PRECISION, GroupSketches
+
+
+# Dimension sets that are materialized; every rollup is also keyed by month
+ROLLUP_DIMENSION_SETS = [
+    (),
+    ('vendor_name',),
+    ('category_name',),
+    ('hospital_name',),
+    ('gl_account_name',),
+    ('category_name', 'vendor_name'),
+    ('gl_account_name', 'vendor_name'),
+    ('hospital_name', 'category_name'),
+    ('hospital_name', 'vendor_name'),
+]
+
+# Metrics that can be merged from monthly partial aggregates (everything else needs raw transactions)
+ADDITIVE_METRICS = ['total_volume', 'total_amount', 'min_amount', 'max_amount', 'avg_amount']
+PARTIAL_COLUMNS  = ['total_volume', 'total_amount', 'min_amount', 'max_amount']
+PARTIAL_MERGE    = {'total_volume': 'sum', 'total_amount': 'sum', 'min_amount': 'min', 'max_amount': 'max'}
+
+# Time dimensions that are at month grain or coarser, and can therefore be derived from a monthly rollup
+ROLLUP_TIME_DIMENSIONS = ['transaction_year', 'transaction_quarter', 'transaction_month']
+
+
+# Group amounts by the given key columns and compute the mergeable partial aggregates; with groups=True, also returns the
+# output row of each input row (from the same grouping)
+def partial_aggregates(keys, amount, sort=False, groups=False):
+    data = pd.DataFrame(keys)
+    data['spend_amount'] = amount
+    grouped = data.groupby(list(keys), sort=sort)['spend_amount']
+    result  = grouped.agg(['size', 'sum', 'min', 'max']).reset_index().rename(columns=dict(zip(['size', 'sum', 'min', 'max'], PARTIAL_COLUMNS)))
+    return (result, grouped.ngroup().to_numpy()) if groups else result
+
+
+#%%######################################################################################################################
+# ROLLUPS
+#########################################################################################################################
+
+# Partial aggregates of the transactions by month and dimensions and, when the vendor codes and the quantile sketch spec
+# are given, quantile and distinct-vendor sketches of every row, built from the same grouping pass
+class Rollup:
+
+    def __init__(self, dimensions, months, codes, amount, vendors=None, quantile_spec=None, hll_precision=HLL_PRECISION):
+        self.dimensions = tuple(dimensions)
+        self.table, groups = partial_aggregates(self.keys(months, codes), amount, sort=True, groups=True)
+        self.months   = self.table['month'].to_numpy()
+        self.sketches = None
+        if vendors is not None and quantile_spec is not None:
+            self.sketches = GroupSketches(groups, len(self.table), amount, vendors, quantile_spec, hll_precision)
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def name(self):
+        return 'rollup(' + ', '.join(('month',) + self.dimensions) + ')'
+
+    def covers(self, columns):
+        return set(columns) <= set(self.dimensions)
+
+    # Rollup rows for the months in [first_month, end_month)
+    def row_range(self, first_month, end_month):
+        return np.searchsorted(self.months, first_month, 'left'), np.searchsorted(self.months, end_month, 'left')
+
+    def keys(self, months, codes):
+        return {'month': months, **{d: codes[d] for d in self.dimensions}}
+
+
+
+class RollupCube:
+
+    def __init__(self, months, codes, amount, dimension_sets=ROLLUP_DIMENSION_SETS, vendors=None, quantile_spec=None, hll_precision=HLL_PRECISION):
+        self.rollups = sorted((Rollup(dimensions, months, codes, amount, vendors, quantile_spec, hll_precision) for dimensions in dimension_sets), key=len)
+
+    # Cheapest rollup that has every required column, with the number of rows it would scan
+    def choose(self, columns, month_ranges):
+        best, best_cost = None, None
+        for rollup in self.rollups:
+            if not rollup.covers(columns):
+                continue
+            cost = 0
+            for first_month, end_month in month_ranges:
+                start, end = rollup.row_range(first_month, end_month)
+                cost += int(end - start)
+            if best_cost is None or cost < best_cost:
+                best, best_cost = rollup, cost
+        return best, best_cost
@@ -0,0 +1,219 @@
+# Semantic cache of the BI agent: questions are embedded, and a new question close enough to a previous one reuses the
+# validated function call (name and arguments) of that question instead of asking the LLM again.
+#
+# Embeddings come from a local hashing embedder (no service needed) or any function returning vectors (e.g. OpenAI
+# embeddings). Vectors are searched in an in-memory index, or in a Pinecone index that is shared between processes.
+
+import re
+import json
+import time
+import zlib
+import threading
+import collections
+import numpy as np
+
+
+SIMILARITY_THRESHOLD = 0.95  # tuned on labelled pairs with benchmarks/bench_semantic_cache.py (local hashing embedder)
+EMBEDDING_DIMENSIONS = 1024
+
+# Words that do not change which report answers a question
+_STOPWORDS = {'a', 'an', 'the', 'by', 'per', 'for', 'of', 'in', 'on', 'to', 'and', 'me', 'us', 'show', 'please', 'give',
+              'what', 'is', 'are', 'was', 'were', 'list', 'total', 'each', 'every', 'how', 'much', 'many', 'our', 'we', 'i', 'can', 'you'}
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+")
+
+# Words naming the dimension (role) of the entity that follows them, e.g. 'Vendor 00042', 'Hospital B'
+_ROLE_WORDS = {'vendor': 'vendor', 'supplier': 'vendor', 'hospital': 'hospital', 'facility': 'hospital', 'category': 'category',
+               'department': 'department', 'division': 'division', 'gl': 'gl_account', 'account': 'gl_account', 'market': 'market'}
+
+LOOKUP_CANDIDATES = 5  # closest previous questions checked for the same entities
+
+
+#%%######################################################################################################################
+# EMBEDDINGS
+#########################################################################################################################
+
+def question_terms(question):
+    words = [w[:-1] if len(w) > 3 and w.endswith('s') and not w.endswith('ss') else w for w in _WORD_PATTERN.findall(question.lower().replace("'s", ''))]
+    return [w for w in words if w not in _STOPWORDS]
+
+
+# Entities of a question with their roles, as sorted (role, value) pairs: a number or a name (a single letter or a
+# capitalized word) after a dimension word ('Vendor 00042', 'Hospital B'), and the other numbers with role '' ('top 5',
+# 'in 2022'). Embeddings ignore word order, so 'Vendor 1 in Hospital 2' and 'Vendor 2 in Hospital 1' are the same
+# vector: a cached answer is only reused for a question with the same entities in the same roles.
+def question_entities(question):
+    tokens, entities = _TOKEN_PATTERN.findall(question.replace("'s", '')), []
+    for position, token in enumerate(tokens):
+        previous = tokens[position - 1].lower() if position else ''
+        role = _ROLE_WORDS.get(previous) or _ROLE_WORDS.get(previous[:-1] if previous.endswith('s') else None)
+        if any(character.isdigit() for character in token):
+            entities.append((role or '', str(int(token)) if token.isdigit() else token.lower()))
+        elif role and token.lower() not in _STOPWORDS and token.lower() not in _ROLE_WORDS and (len(token) == 1 or token[0].isupper()):
+            entities.append((role, token.lower()))
+    return sorted(entities)
+
+
+# Hashed bag of words and character trigrams, L2-normalized: word order and filler words do not matter, small spelling
+# variations still match. The hash is stable across processes, so vectors can be stored in a shared index.
+class HashingEmbedder:
+
+    def __init__(self, dimensions=EMBEDDING_DIMENSIONS, trigram_weight=0.25, number_weight=3.0):
+        self.dimensions = dimensions
+        self.trigram_weight = trigram_weight
+        self.number_weight  = number_weight  # numbers (top N, years, p80, names with numbers) must match closely
+
+    def __call__(self, questions):
+        vectors = np.zeros((len(questions), self.dimensions))
+        for row, question in enumerate(questions):
+            for word in question_terms(question):
+                if any(character.isdigit() for character in word):
+                    vectors[row, zlib.crc32(word.encode()) % self.dimensions] += self.number_weight
+                    continue
+                vectors[row, zlib.crc32(word.encode()) % self.dimensions] += 1.0
+                padded = f'#{word}#'
+                for start in range(len(padded) - 2):
+                    vectors[row, zlib.crc32(padded[start:start + 3].encode()) % self.dimensions] += self.trigram_weight
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+# Embeddings from the OpenAI API (openai 0.28 interface)
+class OpenAIEmbedder:
+
+    def __init__(self, model='text-embedding-ada-002', api_key=None, client=None):
+        self.model   = model
+        self.api_key = api_key
+        self.client  = client  # bi_agent.llm_client.LLMClient (pooled connections and retries), if any
+
+    def __call__(self, questions):
+        import openai
+        if self.client is not None:
+            response = self.client.embedding(self.api_key, model=self.model, input=list(questions))
+        else:
+            response = openai.Embedding.create(model=self.model, input=list(questions), api_key=self.api_key)
+        vectors = np.array([item['embedding'] for item in sorted(response['data'], key=lambda item: item['index'])])
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+#%%######################################################################################################################
+# VECTOR INDEXES
+#########################################################################################################################
+
+# Vectors held in one matrix (grown by doubling); a search is a single matrix-vector product (cosine similarity of normalized vectors)
+class LocalVectorIndex:
+
+    def __init__(self, dimensions):
+        self.buffer   = np.zeros((16, dimensions), dtype=np.float32)
+        self.metadata = []
+
+    def __len__(self):
+        return len(self.metadata)
+
+    def add(self, key, vector, metadata):
+        if len(self.metadata) == len(self.buffer):
+            self.buffer = np.vstack([self.buffer, np.zeros_like(self.buffer)])
+        self.buffer[len(self.metadata)] = vector
+        self.metadata.append(metadata)
+
+    # (similarity, metadata) of the k closest vectors, closest first
+    def search(self, vector, k=1):
+        if not len(self.metadata):
+            return []
+        scores = self.buffer[:len(self.metadata)] @ vector.astype(np.float32)
+        best   = np.argpartition(-scores, min(k, len(scores)) - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        best   = best[np.argsort(-scores[best])]
+        return [(float(scores[i]), self.metadata[i]) for i in best]
+
+
+# Same interface on a Pinecone index (pinecone-client), so the cache is shared by every process of the app
+class PineconeVectorIndex:
+
+    def __init__(self, index, namespace=''):
+        self.index = index
+        self.namespace = namespace
+
+    def add(self, key, vector, metadata):
+        self.index.upsert(vectors=[(key, vector.tolist(), metadata)], namespace=self.namespace)
+
+    def search(self, vector, k=1):
+        result = self.index.query(vector=vector.tolist(), top_k=k, include_metadata=True, namespace=self.namespace)
+        return [(float(match['score']), dict(match['metadata'])) for match in result['matches']]
+
+
+#%%######################################################################################################################
+# CACHE
+#########################################################################################################################
+
+class SemanticCache:
+
+    def __init__(self, embed=None, index=None, threshold=SIMILARITY_THRESHOLD):
+        self.embed     = embed or HashingEmbedder()
+        self.index     = index if index is not None else LocalVectorIndex(self.embed(['']).shape[1])
+        self.threshold = threshold
+        self.lock      = threading.Lock()
+        self.counts    = collections.Counter()
+        self.scores    = collections.deque(maxlen=1000)  # best similarity of recent lookups, to review the threshold
+
+    # Answer (e.g. a function call) stored for the closest previous question that is similar enough and names the same
+    # entities in the same roles (see question_entities); otherwise None
+    def lookup(self, question):
+        started  = time.perf_counter()
+        matches  = self.index.search(self.embed([question])[0], k=LOOKUP_CANDIDATES)
+        score    = matches[0][0] if matches else 0.0
+        entities = question_entities(question)
+        similar  = [(match_score, metadata) for match_score, metadata in matches if match_score >= self.threshold]
+        match    = next(((match_score, metadata) for match_score, metadata in similar if question_entities(metadata['question']) == entities), None)
+        with self.lock:
+            self.scores.append(score)
+            self.counts['lookups'] += 1
+            self.counts['lookup_ms'] += (time.perf_counter() - started) * 1000
+            if match is None:
+                self.counts['misses'] += 1
+                self.counts['entity_mismatches'] += bool(similar)
+                return None, score
+            self.counts['hits'] += 1
+        return json.loads(match[1]['answer']), match[0]
+
+    # Store the answer of a question; only answers that were validated (e.g. the report was generated) should be stored
+    def store(self, question, answer):
+        with self.lock:
+            self.counts['stored'] += 1
+            key = f"q{zlib.crc32(question.encode())}-{self.counts['stored']}"
+        self.index.add(key, self.embed([question])[0], {'question': question, 'answer': json.dumps(answer)})
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counts['lookups']
+            return {
+                'lookups'       : lookups,
+                'hits'          : self.counts['hits'],
+                'misses'        : self.counts['misses'],
+                'entity_misses' : self.counts['entity_mismatches'],
+                'stored'        : self.counts['stored'],
+                'hit_rate'      : self.counts['hits'] / lookups if lookups else None,
+                'avg_lookup_ms' : self.counts['lookup_ms'] / lookups if lookups else None,
+                'threshold'     : self.threshold,
+            }
+
+
+# Threshold tuning from labelled question pairs (question, question, same report?): the lowest threshold (most hits)
+# whose precision on the pairs reaches min_precision; pairs with other entities are never hits, as in lookup. Returns
+# the threshold and its precision and recall.
+def tune_threshold(embed, labelled_pairs, min_precision=0.98):
+
+    first  = embed([a for a, _, _ in labelled_pairs])
+    second = embed([b for _, b, _ in labelled_pairs])
+    scores = (first * second).sum(axis=1)
+    same   = np.array([label for _, _, label in labelled_pairs], dtype=bool)
+    same_entities = np.array([question_entities(a) == question_entities(b) for a, b, _ in labelled_pairs], dtype=bool)
+
+    best = (1.0, 1.0, 0.0)
+    for threshold in np.unique(scores)[::-1]:
+        accepted  = (scores >= threshold) & same_entities
+        if not accepted.any():
+            continue
+        precision = (accepted & same).sum() / accepted.sum()
+        if precision < min_precision:
+            break
+        best = (float(threshold), float(precision), float((accepted & same).sum() / max(same.sum(), 1)))
+    return best
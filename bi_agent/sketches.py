@@ -0,0 +1,145 @@
+# Mergeable sketches for the non-additive metrics: quantiles (pXX_amount) and distinct counts (num_vendors)
+#
+# Quantiles use a log-bucketed histogram with a relative-error guarantee (DDSketch): bucket counts add up when
+# sketches are merged, so they combine across months and dimensions like any other aggregate.
+# Distinct counts use HyperLogLog registers, merged by taking the maximum rank of each register.
+#
+# Sketches of many groups are stored sparsely, as (group, key, value) entries sorted by group.
+
+import numpy as np
+import pandas as pd
+
+
+QUANTILE_RELATIVE_ERROR = 0.01   # every estimated pXX_amount is within 1% of a true value at that rank
+HLL_PRECISION           = 12     # 2^12 registers per group: ~1.6% standard error on num_vendors
+
+# Quantile bucket keys: positive amounts use their log-bucket index, zero and negative amounts are placed below them
+_ZERO_KEY     = -10_000
+_NEGATIVE_KEY = -20_000
+
+
+#%%######################################################################################################################
+# QUANTILE SKETCH
+#########################################################################################################################
+
+class QuantileSketchSpec:
+
+    def __init__(self, relative_error=QUANTILE_RELATIVE_ERROR):
+        self.relative_error = relative_error
+        self.gamma = (1 + relative_error) / (1 - relative_error)
+        self.log_gamma = np.log(self.gamma)
+
+    # Bucket key of every value; keys sort in the same order as the values they represent
+    def keys(self, values):
+        magnitude = np.ceil(np.log(np.maximum(np.abs(values), 1e-300)) / self.log_gamma).astype(np.int64)
+        return np.where(values > 0, magnitude, np.where(values < 0, _NEGATIVE_KEY - magnitude, _ZERO_KEY))
+
+    # Value represented by each bucket key (within relative_error of every value in the bucket)
+    def values(self, keys):
+        positive = keys > _ZERO_KEY
+        magnitude = np.where(positive, keys, _NEGATIVE_KEY - keys)
+        value = 2 * self.gamma ** magnitude.astype(np.float64) / (self.gamma + 1)
+        return np.where(positive, value, np.where(keys == _ZERO_KEY, 0.0, -value))
+
+
+# Quantiles per group from merged (group, key, count) entries; groups without entries get NaN
+def estimate_quantiles(groups, keys, counts, quantiles, n_groups, spec):
+
+    entries = pd.DataFrame({'group': groups, 'key': keys, 'count': counts}).groupby(['group', 'key'], sort=True)['count'].sum().reset_index()
+    groups, keys, counts = entries['group'].to_numpy(), entries['key'].to_numpy(), entries['count'].to_numpy()
+
+    # Within each group, the first bucket whose cumulative count exceeds the target rank holds the quantile
+    cumulative = counts.cumsum()
+    starts = np.searchsorted(groups, np.arange(n_groups), 'left')
+    ends   = np.searchsorted(groups, np.arange(n_groups), 'right')
+    before = np.where(starts > 0, cumulative[np.maximum(starts - 1, 0)], 0)
+    totals = np.where(ends > starts, cumulative[np.maximum(ends - 1, 0)] - before, 0)
+
+    results = {}
+    for quantile in quantiles:
+        targets  = before + np.floor(quantile * np.maximum(totals - 1, 0))
+        position = np.minimum(np.searchsorted(cumulative, targets, 'right'), max(len(cumulative) - 1, 0))
+        estimate = spec.values(keys[position]) if len(keys) else np.zeros(n_groups)
+        results[quantile] = np.where(totals > 0, estimate, np.nan)
+    return results
+
+
+#%%######################################################################################################################
+# HYPERLOGLOG
+#########################################################################################################################
+
+# 64-bit mix (splitmix64 finalizer) of integer values; uint64 arithmetic wraps around as intended
+def hash64(values):
+    with np.errstate(over='ignore'):
+        x = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+# Register index and rank (position of the first 1 bit in the remaining bits) of every hashed value
+def hll_registers(hashes, precision=HLL_PRECISION):
+    register  = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    remaining = hashes & np.uint64((1 << (64 - precision)) - 1)
+    highest   = np.floor(np.log2(np.maximum(remaining, 1).astype(np.float64))).astype(np.int64)
+    rank      = np.where(remaining > 0, (64 - precision) - highest, 64 - precision + 1)
+    return register, rank.astype(np.int8)
+
+
+# Distinct count per group from merged (group, register, rank) entries
+def estimate_distinct(groups, registers, ranks, n_groups, precision=HLL_PRECISION):
+
+    entries = pd.DataFrame({'group': groups, 'register': registers, 'rank': ranks}).groupby(['group', 'register'], sort=False)['rank'].max()
+    groups  = entries.index.get_level_values('group').to_numpy()
+    ranks   = entries.to_numpy().astype(np.float64)
+
+    m = float(1 << precision)
+    alpha   = 0.7213 / (1 + 1.079 / m)
+    present = np.bincount(groups, minlength=n_groups)
+    total   = np.bincount(groups, weights=2.0 ** -ranks, minlength=n_groups) + (m - present)
+    raw     = alpha * m * m / total
+
+    # Small-range correction (linear counting) while some registers are still empty
+    zeros = m - present
+    with np.errstate(divide='ignore'):
+        linear = m * np.log(m / np.maximum(zeros, 1e-12))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+#%%######################################################################################################################
+# SPARSE STORAGE
+#########################################################################################################################
+
+# Sketch entries of many groups (e.g. the rows of a rollup), stored sorted by group with per-group offsets
+class SparseSketches:
+
+    def __init__(self, groups, keys, values, n_groups, merge):
+        entries = pd.DataFrame({'group': groups, 'key': keys, 'value': values}).groupby(['group', 'key'], sort=True)['value'].agg(merge)
+        self.keys    = entries.index.get_level_values('key').to_numpy()
+        self.values  = entries.to_numpy()
+        self.offsets = np.searchsorted(entries.index.get_level_values('group').to_numpy(), np.arange(n_groups + 1), 'left')
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.values.nbytes + self.offsets.nbytes
+
+    # Entries of the selected groups, relabelled with the output group each one merges into
+    def gather(self, selected, output_groups):
+        lengths = self.offsets[selected + 1] - self.offsets[selected]
+        starts  = np.repeat(self.offsets[selected] - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+        entries = starts + np.arange(lengths.sum())
+        return np.repeat(output_groups, lengths), self.keys[entries], self.values[entries]
+
+
+# Quantile and distinct-vendor sketches of every group of a rollup
+class GroupSketches:
+
+    def __init__(self, groups, n_groups, amounts, vendors, quantile_spec, hll_precision=HLL_PRECISION):
+        known = vendors >= 0
+        register, rank = hll_registers(hash64(vendors[known]), hll_precision)
+        self.quantiles = SparseSketches(groups, quantile_spec.keys(amounts), np.ones(len(groups), dtype=np.int64), n_groups, 'sum')
+        self.distinct  = SparseSketches(groups[known], register, rank, n_groups, 'max')
+
+    @property
+    def nbytes(self):
+        return self.quantiles.nbytes + self.distinct.nbytes
@@ -0,0 +1,429 @@
+# Columnar engine that computes the spend reports requested by the BI agent over the hospital transactions table
+
+import re
+import time
+import threading
+import collections
+import numpy as np
+import pandas as pd
+
+from bi_agent.periods import FISCAL_YEAR_START_MONTH, CalendarTable, calendar_table, compile_time_filter, interval_row_ranges, month_index, month_start
+from bi_agent.encoding import DictionaryColumn, plan_scan, select_rows
+from bi_agent.rollups import ADDITIVE_METRICS, PARTIAL_COLUMNS, PARTIAL_MERGE, ROLLUP_DIMENSION_SETS, ROLLUP_TIME_DIMENSIONS, RollupCube, partial_aggregates
+from bi_agent.sketches import HLL_PRECISION, QUANTILE_RELATIVE_ERROR, QuantileSketchSpec, estimate_distinct, estimate_quantiles, hash64, hll_registers
+
+
+TEXT_COLUMNS = ['vendor_name', 'category_name', 'hospital_name', 'division_name', 'department_name', 'gl_account_name', 'geographic_market']
+TIME_DIMENSIONS = ['transaction_year', 'transaction_quarter', 'transaction_month', 'transaction_week', 'transaction_day']
+DIMENSIONS = TEXT_COLUMNS + TIME_DIMENSIONS
+
+# Map the *_filter_list arguments of the report functions to the table columns
+FILTER_COLUMNS = {
+    'vendor_filter_list'    : 'vendor_name',
+    'category_filter_list'  : 'category_name',
+    'hospital_filter_list'  : 'hospital_name',
+    'department_filter_list': 'department_name',
+    'division_filter_list'  : 'division_name',
+    'gl_account_filter_list': 'gl_account_name',
+}
+
+BASIC_METRICS = ['total_volume', 'total_amount', 'min_amount', 'max_amount', 'avg_amount']
+VENDOR_METRICS = ['num_vendors', 'num_p80_vendors']
+DEFAULT_METRICS = ['total_volume', 'total_amount']
+
+# Number of recent queries kept with their instrumentation (source, rows scanned, latency)
+QUERY_LOG_SIZE = 1000
+
+_PERCENTILE_PATTERN = re.compile(r'^p(\d{1,2}|100)_amount$')
+
+
+#%%######################################################################################################################
+# DATA PREPARATION
+#########################################################################################################################
+
+# Normalize a raw transactions frame: typed columns, dictionary-encoded text, rows sorted by transaction date
+def prepare_transactions(transactions):
+
+    frame = pd.DataFrame({
+        'transaction_datetime': pd.to_datetime(transactions['transaction_datetime']).to_numpy(dtype='M8[ns]'),
+        'spend_amount'        : pd.to_numeric(transactions['spend_amount']).to_numpy(dtype=np.float64),
+    })
+    for column in TEXT_COLUMNS:
+        values = transactions[column] if column in transactions else np.full(len(frame), None)
+        frame[column] = pd.Categorical(values)
+
+    datetimes = frame['transaction_datetime'].to_numpy()
+    if len(datetimes) and not (datetimes[1:] >= datetimes[:-1]).all():
+        frame = frame.take(np.argsort(datetimes, kind='stable')).reset_index(drop=True)
+    return frame
+
+
+def percentile_of(metric):
+    match = _PERCENTILE_PATTERN.match(metric)
+    return int(match.group(1)) if match else None
+
+
+def validate_metrics(metrics):
+    unknown = [m for m in metrics if m not in BASIC_METRICS + VENDOR_METRICS and percentile_of(m) is None]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {unknown}")
+
+
+# Metrics that approximate queries answer from the rollup sketches (num_p80_vendors always needs exact vendor spend)
+def is_sketch_metric(metric):
+    return metric == 'num_vendors' or percentile_of(metric) is not None
+
+
+def validate_dimensions(dimensions):
+    unknown = [d for d in dimensions if d not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown dimensions: {unknown}")
+
+
+#%%######################################################################################################################
+# TIME DIMENSIONS
+#########################################################################################################################
+
+# Integer codes for the transaction_* dimensions, looked up in the calendar dimension table by day number
+def time_dimension_codes(datetimes, dimension, fiscal_calendar=False, calendar=None):
+    days = datetimes.astype('M8[D]').astype(np.int64)
+    return (calendar or calendar_table()).lookup(dimension, days, fiscal_calendar)
+
+
+# Month index (year * 12 + month - 1) of each timestamp, as used by bi_agent.periods
+def datetime_months(datetimes):
+    return datetimes.astype('M8[M]').astype(np.int64) + 1970 * 12
+
+
+# Month, quarter and year codes are the month index of the start of the period
+def month_dimension_codes(months, dimension, fiscal_calendar=False):
+
+    offset = (FISCAL_YEAR_START_MONTH - 1) if fiscal_calendar else 0
+    if dimension == 'transaction_month':
+        return months
+    if dimension == 'transaction_quarter':
+        return months - (months - offset) % 3
+    return months - (months - offset) % 12
+
+
+def time_dimension_labels(codes, dimension, fiscal_calendar=False):
+
+    offset = (FISCAL_YEAR_START_MONTH - 1) if fiscal_calendar else 0
+    prefix = 'FY' if fiscal_calendar else ''
+
+    def year_label(start):
+        return f'{prefix}{start // 12 + (1 if offset else 0)}'
+
+    labels = {}
+    for code in np.unique(codes).tolist():
+        if dimension in ('transaction_day', 'transaction_week'):
+            labels[code] = str(np.datetime64(code, 'D'))
+        elif dimension == 'transaction_month':
+            labels[code] = f'{code // 12}-{code % 12 + 1:02d}'
+        elif dimension == 'transaction_quarter':
+            year_start = code - (code - offset) % 12
+            labels[code] = f'{year_label(year_start)}-Q{(code - year_start) // 3 + 1}'
+        else:
+            labels[code] = year_label(code)
+    return pd.Series(codes).map(labels).to_numpy()
+
+
+#%%######################################################################################################################
+# ENGINE
+#########################################################################################################################
+
+class SpendEngine:
+
+    def __init__(self, transactions, rollup_dimension_sets=ROLLUP_DIMENSION_SETS, quantile_relative_error=QUANTILE_RELATIVE_ERROR, hll_precision=HLL_PRECISION, sketches=False):
+        self.frame    = prepare_transactions(transactions)
+        self.loads    = transactions.attrs.get('loads')  # loads of the transaction store read, if any (see bi_agent.data)
+        self.datetime = self.frame['transaction_datetime'].to_numpy()
+        self.amount   = self.frame['spend_amount'].to_numpy()
+        self.months   = datetime_months(self.datetime)
+        self.query_log = collections.deque(maxlen=QUERY_LOG_SIZE)
+        self.local     = threading.local()  # last query of each thread (reports may run concurrently)
+        self.columns  = {c: DictionaryColumn(self.frame[c]).build_index() for c in TEXT_COLUMNS}
+
+        # Calendar dimension table covering every transaction date
+        self.calendar = calendar_table()
+        days = self.datetime[[0, -1]].astype('M8[D]').astype(np.int64) if len(self.frame) else np.array([], dtype=np.int64)
+        if not self.calendar.covers(days):
+            self.calendar = CalendarTable(int(self.months[0] // 12), int(self.months[-1] // 12))
+
+        # Monthly rollups and, with sketches=True, the sketches read by approximate queries, built in the same grouping pass
+        # (without them, approximate queries are answered exactly)
+        self.quantile_spec = QuantileSketchSpec(quantile_relative_error)
+        self.hll_precision = hll_precision
+        self.sketches = sketches
+        codes = {d: self.columns[d].codes for d in {d for dims in rollup_dimension_sets for d in dims}}
+        vendors = self.columns['vendor_name'].codes if sketches else None
+        self.rollups = RollupCube(self.months, codes, self.amount, rollup_dimension_sets, vendors, self.quantile_spec, hll_precision)
+
+    def __len__(self):
+        return len(self.frame)
+
+    # Bytes held per transaction row: typed columns, dictionary codes and posting lists (dictionaries included)
+    def memory_per_row(self):
+        nbytes = self.datetime.nbytes + self.amount.nbytes + sum(c.nbytes for c in self.columns.values())
+        return nbytes / max(len(self), 1)
+
+    # Instrumentation of the last query run by the calling thread
+    @property
+    def last_query_stats(self):
+        return getattr(self.local, 'last_query', None)
+
+    def log_query(self, stats):
+        self.query_log.append(stats)
+        self.local.last_query = stats
+
+    #%%##################################################################################################################
+    # FILTERS
+    #####################################################################################################################
+
+    # Translate the *_filter_list arguments into dictionary codes per column (empty lists mean "no filter")
+    def filter_codes(self, filter_lists):
+        filters = {}
+        for argument, values in filter_lists.items():
+            if argument not in FILTER_COLUMNS:
+                raise ValueError(f"Unknown filter: '{argument}'")
+            if values:
+                filters[FILTER_COLUMNS[argument]] = self.columns[FILTER_COLUMNS[argument]].encode(values)
+        return filters
+
+    def resolve_intervals(self, time_period_filter_list, fiscal_calendar=None, today=None):
+        return compile_time_filter(time_period_filter_list, today=today, fiscal_calendar=fiscal_calendar)
+
+    # Row ranges of the transactions (sorted by date) that fall in the intervals; the whole table when there is no time filter
+    def row_ranges(self, intervals):
+        if intervals is None:
+            return [(0, len(self.frame))]
+        return interval_row_ranges(self.datetime, intervals)
+
+    # Positions of the rows in [start, end) that pass the column filters, using the posting lists of the most selective filter
+    def select_rows(self, filters, start=0, end=None):
+        return select_rows(self.columns, filters, start, len(self.frame) if end is None else end)
+
+    # Positions of the rows that fall in one of the intervals and pass the column filters; only the rows in the intervals are scanned
+    def rows_for(self, filters, intervals):
+        rows = [self.select_rows(filters, start, end) for start, end in self.row_ranges(intervals)]
+        return np.concatenate(rows) if rows else np.array([], dtype=np.int64)
+
+    # Positions of the rows that pass every filter of a report request
+    def filter_rows(self, time_period_filter_list=None, fiscal_calendar=None, today=None, **filter_lists):
+        return self.rows_for(self.filter_codes(filter_lists), self.resolve_intervals(time_period_filter_list, fiscal_calendar, today))
+
+    #%%##################################################################################################################
+    # DIMENSIONS
+    #####################################################################################################################
+
+    def dimension_codes(self, dimension, rows, fiscal_calendar=False):
+        if dimension in TIME_DIMENSIONS:
+            return time_dimension_codes(self.datetime[rows], dimension, fiscal_calendar, self.calendar)
+        return self.columns[dimension].codes[rows]
+
+    def dimension_labels(self, dimension, codes, fiscal_calendar=False):
+        if dimension in TIME_DIMENSIONS:
+            return time_dimension_labels(codes, dimension, fiscal_calendar)
+        return self.columns[dimension].decode(codes)
+
+    def attach_labels(self, result, dimensions, metrics, fiscal_calendar=False):
+        result = result.reset_index()
+        for dimension in dimensions:
+            result[dimension] = self.dimension_labels(dimension, result[dimension].to_numpy(), fiscal_calendar)
+        return result[list(dimensions) + list(metrics)]
+
+    #%%##################################################################################################################
+    # RAW AGGREGATION
+    #####################################################################################################################
+
+    # Compute the metrics for the given rows, grouped by the given dimensions
+    def aggregate(self, rows, dimensions, metrics, fiscal_calendar=False):
+
+        # Group keys are integer codes; labels are only attached to the (few) output rows at the end
+        keys = {d: self.dimension_codes(d, rows, fiscal_calendar) for d in dimensions} or {'_all': np.zeros(len(rows), dtype=np.int8)}
+        data = pd.DataFrame(keys)
+        data['spend_amount'] = self.amount[rows]
+        key_names = list(keys)
+        grouped = data.groupby(key_names, sort=True)['spend_amount']
+
+        result = grouped.agg(['size', 'sum', 'min', 'max'])
+        result.columns = ['total_volume', 'total_amount', 'min_amount', 'max_amount']
+        result['avg_amount'] = result['total_amount'] / result['total_volume']
+
+        for metric in metrics:
+            if (percentile := percentile_of(metric)) is not None:
+                result[metric] = grouped.quantile(percentile / 100.0)
+
+        # Rows without a vendor (code -1) are not a vendor
+        if any(m in VENDOR_METRICS for m in metrics):
+            data['vendor'] = self.columns['vendor_name'].codes[rows]
+            vendor_spend = data[data['vendor'] >= 0].groupby(key_names + ['vendor'], sort=False)['spend_amount'].sum().reset_index()
+            result['num_vendors'] = vendor_spend.groupby(key_names).size().reindex(result.index, fill_value=0)
+            result['num_p80_vendors'] = self._count_p80_vendors(vendor_spend, key_names).reindex(result.index, fill_value=0)
+
+        return self.attach_labels(result, dimensions, metrics, fiscal_calendar)
+
+    # Vendors needed to reach 80% of the spend in each group, largest vendors first
+    @staticmethod
+    def _count_p80_vendors(vendor_spend, key_names):
+        ranked = vendor_spend.sort_values(key_names + ['spend_amount'], ascending=[True] * len(key_names) + [False])
+        cumulative = ranked.groupby(key_names, sort=False)['spend_amount'].cumsum()
+        total = ranked.groupby(key_names, sort=False)['spend_amount'].transform('sum')
+        in_top = (cumulative - ranked['spend_amount']) < 0.8 * total
+        return in_top.groupby([ranked[k] for k in key_names]).sum()
+
+    #%%##################################################################################################################
+    # ROLLUP AGGREGATION
+    #####################################################################################################################
+
+    # Split each interval into whole months (answered by a rollup) and partial months at the edges (answered by raw rows)
+    def split_intervals(self, intervals):
+
+        if intervals is None:
+            return [(int(self.months[0]), int(self.months[-1]) + 1)] if len(self) else [], []
+
+        month_ranges, edges = [], []
+        for start, end in intervals:
+            first_month = month_index(start) + (start.day > 1)
+            end_month   = month_index(end)
+            if first_month >= end_month:
+                edges.append((start, end))
+                continue
+            month_ranges.append((first_month, end_month))
+            edges += [(start, month_start(first_month)), (month_start(end_month), end)]
+        return month_ranges, [(s, e) for s, e in edges if s < e]
+
+    def date_range_rows(self, start, end):
+        return self.row_ranges([(start, end)])[0]
+
+    # Rows examined when reading the transactions in the intervals with the column filters
+    def rows_examined(self, filters, intervals):
+        return sum(plan_scan(self.columns, filters, start, end)[1] for start, end in self.row_ranges(intervals))
+
+    # Pick the rollup for an additive (or approximate) query, or None when it must be answered from raw transactions
+    def plan_rollup(self, dimensions, metrics, filters, intervals, approximate=False):
+
+        approximate = approximate and self.sketches
+        if any(m not in ADDITIVE_METRICS and not (approximate and is_sketch_metric(m)) for m in metrics):
+            return None
+        if any(d in TIME_DIMENSIONS and d not in ROLLUP_TIME_DIMENSIONS for d in dimensions):
+            return None
+
+        columns = [d for d in dimensions if d not in TIME_DIMENSIONS] + list(filters)
+        month_ranges, edges = self.split_intervals(intervals)
+        rollup, cost = self.rollups.choose(columns, month_ranges)
+        if rollup is None:
+            return None
+
+        edge_rows = self.rows_examined(filters, edges) if edges else 0
+        if cost + edge_rows >= self.rows_examined(filters, intervals):
+            return None
+        return {'rollup': rollup, 'month_ranges': month_ranges, 'edges': edges, 'rows_scanned': cost + edge_rows}
+
+    def aggregate_rollup(self, plan, dimensions, metrics, filters, fiscal_calendar=False):
+
+        rollup  = plan['rollup']
+        partials, rollup_parts, edge_parts = [], [], []
+
+        # Whole months from the rollup
+        for first_month, end_month in plan['month_ranges']:
+            start, end = rollup.row_range(first_month, end_month)
+            positions = np.arange(start, end)
+            for column, codes in filters.items():
+                positions = positions[self.columns[column].allowed(codes)[rollup.table[column].to_numpy()[positions]]]
+            table = rollup.table.iloc[positions]
+            keys = {d: (month_dimension_codes(table['month'].to_numpy(), d, fiscal_calendar) if d in TIME_DIMENSIONS else table[d].to_numpy()) for d in dimensions}
+            partials.append(pd.DataFrame({**keys, **{c: table[c].to_numpy() for c in PARTIAL_COLUMNS}}))
+            rollup_parts.append((positions, keys))
+
+        # Partial months from the raw transactions
+        for start_date, end_date in plan['edges']:
+            rows = self.select_rows(filters, *self.date_range_rows(start_date, end_date))
+            if len(rows):
+                keys = {d: self.dimension_codes(d, rows, fiscal_calendar) for d in dimensions}
+                partials.append(partial_aggregates(keys or {'_all': np.zeros(len(rows), dtype=np.int8)}, self.amount[rows]))
+                edge_parts.append((rows, keys))
+
+        # Merge the partial aggregates
+        key_names = list(dimensions) or ['_all']
+        combined  = pd.concat(partials, ignore_index=True) if partials else pd.DataFrame(columns=key_names + PARTIAL_COLUMNS)
+        if not dimensions:
+            combined['_all'] = 0
+        result = combined.groupby(key_names, sort=True).agg(PARTIAL_MERGE)
+        result['avg_amount'] = result['total_amount'] / result['total_volume']
+
+        sketch_metrics = [m for m in metrics if is_sketch_metric(m)]
+        if sketch_metrics:
+            self.estimate_sketch_metrics(result, rollup, rollup_parts, edge_parts, dimensions, sketch_metrics)
+        return self.attach_labels(result, dimensions, metrics, fiscal_calendar)
+
+    # Approximate pXX_amount and num_vendors: merge the sketches of the selected rollup rows with sketches of the edge rows
+    def estimate_sketch_metrics(self, result, rollup, rollup_parts, edge_parts, dimensions, metrics):
+
+        # Output row (position in the result) of each group key
+        def output_groups(keys, size):
+            if not dimensions:
+                return np.zeros(size, dtype=np.int64)
+            if len(dimensions) == 1:
+                return result.index.get_indexer(keys[dimensions[0]])
+            return result.index.get_indexer(pd.MultiIndex.from_arrays([keys[d] for d in dimensions]))
+
+        sketches = rollup.sketches
+        quantile_entries, distinct_entries = [], []
+        for positions, keys in rollup_parts:
+            groups = output_groups(keys, len(positions))
+            quantile_entries.append(sketches.quantiles.gather(positions, groups))
+            distinct_entries.append(sketches.distinct.gather(positions, groups))
+        for rows, keys in edge_parts:
+            groups  = output_groups(keys, len(rows))
+            vendors = self.columns['vendor_name'].codes[rows]
+            quantile_entries.append((groups, self.quantile_spec.keys(self.amount[rows]), np.ones(len(rows), dtype=np.int64)))
+            distinct_entries.append((groups[vendors >= 0], *hll_registers(hash64(vendors[vendors >= 0]), self.hll_precision)))
+
+        def concatenate(entries):
+            return [np.concatenate(parts) for parts in zip(*entries)] if entries else [np.array([], dtype=np.int64)] * 3
+
+        percentiles = {m: percentile_of(m) for m in metrics if m != 'num_vendors'}
+        if percentiles:
+            estimates = estimate_quantiles(*concatenate(quantile_entries), [p / 100.0 for p in percentiles.values()], len(result), self.quantile_spec)
+            for metric, percentile in percentiles.items():
+                result[metric] = estimates[percentile / 100.0]
+        if 'num_vendors' in metrics:
+            result['num_vendors'] = np.rint(estimate_distinct(*concatenate(distinct_entries), len(result), self.hll_precision)).astype(np.int64)
+
+    #%%##################################################################################################################
+    # REPORTS
+    #####################################################################################################################
+
+    # With approximate=True, percentiles and num_vendors may be answered from rollup sketches (see bi_agent.sketches)
+    def generic_spend_report(self, metrics=None, dimensions=None, time_period_filter_list=None, fiscal_calendar=None, today=None, approximate=False, **filter_lists):
+
+        started    = time.perf_counter()
+        metrics    = list(metrics or DEFAULT_METRICS)
+        dimensions = list(dimensions or [])
+        validate_metrics(metrics)
+        validate_dimensions(dimensions)
+
+        filters   = self.filter_codes(filter_lists)
+        intervals = self.resolve_intervals(time_period_filter_list, fiscal_calendar, today)
+
+        # Answer from the smallest rollup that covers the request, or from the raw transactions
+        plan = self.plan_rollup(dimensions, metrics, filters, intervals, approximate)
+        if plan is not None:
+            report = self.aggregate_rollup(plan, dimensions, metrics, filters, bool(fiscal_calendar))
+            source, rows_scanned = plan['rollup'].name, plan['rows_scanned']
+            if any(is_sketch_metric(m) for m in metrics):
+                source += ' sketches'
+        else:
+            rows   = self.rows_for(filters, intervals)
+            report = self.aggregate(rows, dimensions, metrics, bool(fiscal_calendar))
+            source, rows_scanned = 'transactions', self.rows_examined(filters, intervals)
+
+        self.log_query({
+            'report'      : 'generic_spend_report',
+            'source'      : source,
+            'rows_scanned': rows_scanned,
+            'rows_output' : len(report),
+            'elapsed_ms'  : (time.perf_counter() - started) * 1000,
+            })
+        return report
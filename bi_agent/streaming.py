@@ -0,0 +1,147 @@
+# Streamed chat completions: yield the text deltas as they arrive and reassemble the complete message (content and tool calls)
+
+import time
+
+
+REDRAW_SECONDS = 0.1  # shortest time between two redraws of an answer while it streams in
+
+
+# At most one redraw of a streamed answer per interval: each redraw sends the whole text received so far, so redrawing
+# on every token would make the rendering quadratic in the length of the answer
+class RedrawThrottle:
+
+    def __init__(self, interval=REDRAW_SECONDS):
+        self.interval    = interval
+        self.next_redraw = 0.0
+
+    def due(self):
+        now = time.perf_counter()
+        if now < self.next_redraw:
+            return False
+        self.next_redraw = now + self.interval
+        return True
+
+
+class ChatCompletionStream:
+
+    def __init__(self, chunks, started=None):
+        self.chunks  = chunks
+        self.started = time.perf_counter() if started is None else started
+        self.first_token_ms = None
+        self.finished_ms    = None
+        self.id, self.model, self.finish_reason = None, None, None
+        self.role = 'assistant'
+        self.parts      = []
+        self.tool_calls = {}  # index -> tool call, completed fragment by fragment
+        self.n_chunks   = 0
+
+    # Text deltas in order; tool call fragments (id, name, pieces of the JSON arguments) are accumulated on the way
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.n_chunks += 1
+            self.id    = chunk.get('id') or self.id
+            self.model = chunk.get('model') or self.model
+            for choice in chunk.get('choices') or []:
+                delta = choice.get('delta') or {}
+                self.role = delta.get('role') or self.role
+                self.finish_reason = choice.get('finish_reason') or self.finish_reason
+                if delta.get('content') or delta.get('tool_calls'):
+                    self.first_token_ms = self.first_token_ms or (time.perf_counter() - self.started) * 1000
+                for fragment in delta.get('tool_calls') or []:
+                    self.add_tool_call_fragment(fragment)
+                if delta.get('content'):
+                    self.parts.append(delta['content'])
+                    yield delta['content']
+        self.finished_ms = (time.perf_counter() - self.started) * 1000
+
+    def add_tool_call_fragment(self, fragment):
+        call = self.tool_calls.setdefault(fragment.get('index', len(self.tool_calls)), {'id': None, 'type': 'function', 'function': {'name': '', 'arguments': ''}})
+        call['id']   = fragment.get('id') or call['id']
+        call['type'] = fragment.get('type') or call['type']
+        function = fragment.get('function') or {}
+        call['function']['name']      += function.get('name') or ''
+        call['function']['arguments'] += function.get('arguments') or ''
+
+    def consume(self):
+        for _ in self:
+            pass
+        return self
+
+    @property
+    def content(self):
+        return ''.join(self.parts)
+
+    # Names of the functions called so far, to show progress while the arguments are still arriving
+    @property
+    def tool_names(self):
+        return [call['function']['name'] for _, call in sorted(self.tool_calls.items())]
+
+    # Complete message, in the same shape as the "message" of a non-streamed completion
+    def message(self):
+        message = {'role': self.role, 'content': self.content or None}
+        if self.tool_calls:
+            message['tool_calls'] = [call for _, call in sorted(self.tool_calls.items())]
+        elif message['content'] is None:
+            message['content'] = ''
+        return message
+
+    def attributes(self):
+        return {
+            'id'                    : self.id,
+            'response_ms'           : self.finished_ms,
+            'time_to_first_token_ms': self.first_token_ms,
+            'model'                 : self.model,
+            'chunks'                : self.n_chunks,
+            'finish_reason'         : self.finish_reason,
+        }
+
+
+#%%######################################################################################################################
+# JSON ANSWERS
+#########################################################################################################################
+
+# Incremental scanner that finds where the first top-level JSON object ends in a stream of text chunks.
+# Braces inside double-quoted strings are ignored; text before the object (e.g. "Sure, here is the report:") is skipped.
+class JsonObjectScanner:
+
+    def __init__(self):
+        self.depth    = 0
+        self.quoted   = False
+        self.escaped  = False
+        self.complete = False
+
+    # Length of the chunk up to the end of the object, or None while the object is not complete
+    def feed(self, chunk):
+        for position, character in enumerate(chunk):
+            if self.quoted:
+                if self.escaped:
+                    self.escaped = False
+                elif character == '\\':
+                    self.escaped = True
+                elif character == '"':
+                    self.quoted = False
+            elif character == '"' and self.depth:
+                self.quoted = True
+            elif character == '{':
+                self.depth += 1
+            elif character == '}' and self.depth:
+                self.depth -= 1
+                if not self.depth:
+                    self.complete = True
+                    return position + 1
+        return None
+
+
+# Pass the tokens through until the first JSON object is complete, then close the upstream generator (stops the generation)
+def until_json_object(tokens):
+    scanner = JsonObjectScanner()
+    try:
+        for token in tokens:
+            end = scanner.feed(token)
+            if end is not None:
+                yield token[:end]
+                return
+            yield token
+    finally:
+        if hasattr(tokens, 'close'):
+            tokens.close()
@@ -0,0 +1,94 @@
+# Synthetic hospital expenditure transactions, used for demos and benchmarks when no real data is available
+
+import numpy as np
+import pandas as pd
+
+
+CATEGORY_NAMES = [
+    'Flooring Repairs', 'New Flooring Installation', 'HVAC Maintenance', 'Elevator Maintenance', 'Janitorial Services',
+    'Medical Waste Disposal', 'Security Services', 'Landscaping', 'Laundry and Linen', 'Food Services',
+    'Pest Control', 'Plumbing Repairs', 'Electrical Repairs', 'Roofing', 'Painting',
+    'Biomedical Equipment Repair', 'Imaging Equipment Service', 'Laboratory Supplies', 'Surgical Supplies', 'IT Services',
+]
+
+DEPARTMENT_NAMES = [
+    'Facilities', 'Environmental Services', 'Surgery', 'Emergency', 'Radiology', 'Laboratory',
+    'Pharmacy', 'Nutrition', 'Information Technology', 'Administration', 'Intensive Care', 'Pediatrics',
+]
+
+MARKET_NAMES = [
+    'New York-Newark', 'Los Angeles-Long Beach', 'Chicago-Naperville', 'Dallas-Fort Worth', 'Houston-The Woodlands',
+    'Washington-Arlington', 'Miami-Fort Lauderdale', 'Philadelphia-Camden', 'Atlanta-Sandy Springs', 'Phoenix-Mesa',
+    'Boston-Cambridge', 'San Francisco-Oakland', 'Seattle-Tacoma', 'Denver-Aurora', 'Nashville-Davidson',
+]
+
+DIVISION_NAMES = ['East Division', 'Central Division', 'West Division', 'South Division']
+
+
+#%%######################################################################################################################
+# GENERATOR
+#########################################################################################################################
+
+def generate_transactions(n_rows, n_vendors=2000, n_hospitals=150, start_date='2019-01-01', end_date=None, seed=0):
+    rng = np.random.default_rng(seed)
+    dimensions = _dimensions(rng, n_vendors, n_hospitals)
+    start, end = _date_range(start_date, end_date)
+    return _transactions(rng, dimensions, n_rows, start, end)
+
+
+# The same table in chunks of about chunk_rows rows, each covering the next slice of the date range, so tables larger
+# than memory (e.g. 100M rows) can be written to a transaction store chunk by chunk. The dimensions (vendors, hospitals,
+# their markets and categories) are the same in every chunk.
+def generate_transaction_chunks(n_rows, n_vendors=2000, n_hospitals=150, start_date='2019-01-01', end_date=None, seed=0, chunk_rows=5_000_000):
+    dimensions = _dimensions(np.random.default_rng(seed), n_vendors, n_hospitals)
+    start, end = _date_range(start_date, end_date)
+    n_chunks = max(-(-n_rows // chunk_rows), 1)
+    bounds   = start + np.linspace(0, int((end - start).astype(np.int64)), n_chunks + 1).astype(np.int64).astype('m8[s]')
+    for chunk in range(n_chunks):
+        rows = n_rows * (chunk + 1) // n_chunks - n_rows * chunk // n_chunks
+        yield _transactions(np.random.default_rng([seed, chunk]), dimensions, rows, bounds[chunk], bounds[chunk + 1])
+
+
+def _date_range(start_date, end_date):
+    return np.datetime64(start_date, 's'), np.datetime64(end_date or pd.Timestamp.today().date().isoformat(), 's')
+
+# Dimension dictionaries: each hospital belongs to one market and one division; each vendor mostly serves one category
+def _dimensions(rng, n_vendors, n_hospitals):
+    return {
+        'vendor_names'     : [f'Vendor {i:05d}' for i in range(n_vendors)],
+        'hospital_names'   : [f'Hospital {i:04d}' for i in range(n_hospitals)],
+        'gl_account_names' : [f'GL {6000 + 10 * i} {name}' for i, name in enumerate(CATEGORY_NAMES)],
+        'hospital_market'  : rng.integers(0, len(MARKET_NAMES), n_hospitals),
+        'hospital_division': rng.integers(0, len(DIVISION_NAMES), n_hospitals),
+        'vendor_category'  : rng.integers(0, len(CATEGORY_NAMES), n_vendors),
+    }
+
+def _transactions(rng, dimensions, n_rows, start, end):
+
+    n_vendors, n_hospitals = len(dimensions['vendor_names']), len(dimensions['hospital_names'])
+
+    # Transactions: a few large vendors and hospitals concentrate most of the volume
+    vendor_weights   = 1.0 / np.arange(1, n_vendors + 1) ** 0.8
+    hospital_weights = 1.0 / np.arange(1, n_hospitals + 1) ** 0.5
+    vendor   = rng.choice(n_vendors, n_rows, p=vendor_weights / vendor_weights.sum()).astype(np.int32)
+    hospital = rng.choice(n_hospitals, n_rows, p=hospital_weights / hospital_weights.sum()).astype(np.int32)
+    category = np.where(rng.random(n_rows) < 0.9, dimensions['vendor_category'][vendor], rng.integers(0, len(CATEGORY_NAMES), n_rows))
+
+    # Dates and amounts
+    seconds = rng.integers(0, int((end - start).astype(np.int64)), n_rows)
+    amount  = np.round(rng.lognormal(mean=6.0, sigma=1.2, size=n_rows), 2)
+
+    def categorical(codes, names):
+        return pd.Categorical.from_codes(codes, categories=names)
+
+    return pd.DataFrame({
+        'transaction_datetime': (start + seconds.astype('m8[s]')).astype('M8[ns]'),
+        'spend_amount'        : amount,
+        'vendor_name'         : categorical(vendor, dimensions['vendor_names']),
+        'category_name'       : categorical(category, CATEGORY_NAMES),
+        'hospital_name'       : categorical(hospital, dimensions['hospital_names']),
+        'division_name'       : categorical(dimensions['hospital_division'][hospital], DIVISION_NAMES),
+        'department_name'     : categorical(rng.integers(0, len(DEPARTMENT_NAMES), n_rows), DEPARTMENT_NAMES),
+        'gl_account_name'     : categorical(category, dimensions['gl_account_names']),
+        'geographic_market'   : categorical(dimensions['hospital_market'][hospital], MARKET_NAMES),
+    })
@@ -0,0 +1,190 @@
+# Telemetry of the LLM calls and tool calls of every page: latency, time to first token, token counts and cache result.
+# Events are kept in an in-process ring buffer (the recent window behind the admin page and the Prometheus metrics) and
+# flushed in batches to a SQLite file, or to Parquet files in a directory, so recording an event never waits on disk.
+
+import os
+import time
+import atexit
+import sqlite3
+import threading
+import collections
+import http.server
+import numpy as np
+import pandas as pd
+
+
+TELEMETRY_CAPACITY = 10_000  # events in the ring buffer
+FLUSH_BATCH   = 100          # events written at once
+FLUSH_SECONDS = 30           # longest wait before pending events are written
+QUANTILES     = (0.5, 0.95, 0.99)
+
+FIELDS = ['time', 'kind', 'page', 'model', 'name', 'status', 'cache', 'latency_ms', 'time_to_first_token_ms', 'prompt_tokens', 'completion_tokens']
+_COLUMN_TYPES = {'time': 'REAL', 'latency_ms': 'REAL', 'time_to_first_token_ms': 'REAL', 'prompt_tokens': 'INTEGER', 'completion_tokens': 'INTEGER'}
+
+
+class Telemetry:
+
+    def __init__(self, path=None, capacity=TELEMETRY_CAPACITY, flush_batch=FLUSH_BATCH, flush_seconds=FLUSH_SECONDS):
+        self.path = path  # SQLite file, or a directory of Parquet files when it ends with .parquet
+        self.flush_batch   = flush_batch
+        self.flush_seconds = flush_seconds
+        self.events  = collections.deque(maxlen=capacity)
+        self.pending = []
+        self.flushed = time.time()
+        self.lock    = threading.Lock()
+        self.totals  = collections.Counter()  # cumulative counters since the process started (Prometheus counters)
+        self.connection = None
+        if path and not path.endswith('.parquet'):
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            columns = ', '.join(f'{field} {_COLUMN_TYPES.get(field, "TEXT")}' for field in FIELDS)
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS events ({columns})')
+            self.connection.commit()
+        if path:
+            atexit.register(self.flush)
+
+    # Record one event: kind is 'llm' or 'tool'; cache is 'miss', 'hit' or 'semantic'; status is 'ok', 'error' or 'timeout'
+    def record(self, kind, page, model=None, name=None, status='ok', cache=None, latency_ms=None, time_to_first_token_ms=None,
+               prompt_tokens=None, completion_tokens=None):
+        event = (time.time(), kind, page, model, name, status, cache, latency_ms, time_to_first_token_ms, prompt_tokens, completion_tokens)
+        with self.lock:
+            self.events.append(event)
+            labels = (kind, page, model or name or '')
+            self.totals[('events',) + labels + (status, cache or '')] += 1
+            if latency_ms is not None:
+                self.totals[('latency_ms',) + labels] += latency_ms
+                self.totals[('latency_count',) + labels] += 1
+            self.totals[('prompt_tokens',) + labels] += prompt_tokens or 0
+            self.totals[('completion_tokens',) + labels] += completion_tokens or 0
+            if not self.path:
+                return
+            self.pending.append(event)
+            if len(self.pending) < self.flush_batch and event[0] - self.flushed < self.flush_seconds:
+                return
+            batch, self.pending, self.flushed = self.pending, [], event[0]
+        self._write(batch)
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending, self.flushed = self.pending, [], time.time()
+        self._write(batch)
+
+    def _write(self, batch):
+        if not batch:
+            return
+        if self.connection is not None:
+            with self.lock:
+                self.connection.executemany(f'INSERT INTO events VALUES ({", ".join("?" * len(FIELDS))})', batch)
+                self.connection.commit()
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            pd.DataFrame(batch, columns=FIELDS).to_parquet(os.path.join(self.path, f'events-{time.time_ns()}.parquet'), index=False)
+
+    # Events of the ring buffer, or all the events written to the telemetry file (plus those not written yet)
+    def frame(self, flushed=False):
+        with self.lock:
+            recent = list(self.pending if flushed else self.events)
+        frames = [read_events(self.path)] if flushed and self.path else []
+        return pd.concat(frames + [pd.DataFrame(recent, columns=FIELDS)], ignore_index=True)
+
+    def prometheus_text(self):
+        return prometheus_text(self.frame(), self.totals.copy())
+
+
+def read_events(path):
+    if path.endswith('.parquet'):
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path))] if os.path.isdir(path) else []
+        return pd.concat([pd.read_parquet(file) for file in files], ignore_index=True) if files else pd.DataFrame(columns=FIELDS)
+    with sqlite3.connect(path) as connection:
+        return pd.read_sql_query('SELECT * FROM events', connection)
+
+
+#%%######################################################################################################################
+# SUMMARIES
+#########################################################################################################################
+
+# Count, cache hit rate and latency quantiles per kind, page and model (tool name for tool calls)
+def latency_summary(events):
+    events = events.assign(model=events['model'].fillna(events['name']))
+    rows = []
+    for (kind, page, model), group in events.groupby(['kind', 'page', 'model'], sort=True):
+        latency = group['latency_ms'].dropna().to_numpy(dtype=float)
+        first   = group['time_to_first_token_ms'].dropna().to_numpy(dtype=float)
+        rows.append({
+            'kind'    : kind,
+            'page'    : page,
+            'model'   : model,
+            'calls'   : len(group),
+            'errors'  : int((group['status'] != 'ok').sum()),
+            'cache_hit_rate': float(group['cache'].isin(['hit', 'semantic']).mean()) if kind == 'llm' else None,
+            **{f'p{int(q * 100)}_ms': float(np.quantile(latency, q)) if len(latency) else None for q in QUANTILES},
+            'p50_first_token_ms': float(np.quantile(first, 0.5)) if len(first) else None,
+            'prompt_tokens'     : int(group['prompt_tokens'].fillna(0).sum()),
+            'completion_tokens' : int(group['completion_tokens'].fillna(0).sum()),
+        })
+    return pd.DataFrame(rows)
+
+
+# Counts of latencies in log-spaced buckets, per series (e.g. page and model), for a histogram chart
+def latency_histogram(events, by=('page', 'model'), buckets=20):
+    latency = events['latency_ms'].dropna()
+    if latency.empty:
+        return pd.DataFrame()
+    lowest = max(latency.min(), 1.0)
+    edges  = np.geomspace(lowest, max(latency.max(), 2 * lowest), buckets + 1)
+    labels = np.round(edges[1:], 1)
+    series = events.loc[latency.index, list(by)].astype(str).agg(' · '.join, axis=1)
+    counts = {name: np.histogram(latency[series == name].clip(edges[0], edges[-1]), bins=edges)[0] for name in series.unique()}
+    return pd.DataFrame(counts, index=pd.Index(labels, name='latency_ms (upper bound)'))
+
+
+def _labels(**labels):
+    return ','.join(f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for name, value in labels.items())
+
+
+# Prometheus text exposition: counters since the process started, and latency quantiles (summary) of the ring buffer
+def prometheus_text(events, totals):
+    lines = ['# HELP bi_agent_calls_total LLM and tool calls by page, model, status and cache result',
+             '# TYPE bi_agent_calls_total counter']
+    for key, value in sorted(totals.items()):
+        if key[0] == 'events':
+            kind, page, model, status, cache = key[1:]
+            lines.append(f'bi_agent_calls_total{{{_labels(kind=kind, page=page, model=model, status=status, cache=cache)}}} {value}')
+    for metric, description in (('prompt_tokens', 'Prompt tokens sent'), ('completion_tokens', 'Completion tokens received')):
+        lines += [f'# HELP bi_agent_{metric}_total {description}', f'# TYPE bi_agent_{metric}_total counter']
+        lines += [f'bi_agent_{metric}_total{{{_labels(kind=k[1], page=k[2], model=k[3])}}} {v}' for k, v in sorted(totals.items()) if k[0] == metric]
+
+    # Quantiles over the recent calls of the ring buffer; sum and count since the process started
+    lines += ['# HELP bi_agent_latency_ms Latency of the calls', '# TYPE bi_agent_latency_ms summary']
+    events = events.assign(model=events['model'].fillna(events['name']))
+    for (kind, page, model), group in events.groupby(['kind', 'page', 'model'], sort=True):
+        latency = group['latency_ms'].dropna().to_numpy(dtype=float)
+        labels  = _labels(kind=kind, page=page, model=model)
+        lines  += [f'bi_agent_latency_ms{{{labels},quantile="{q}"}} {np.quantile(latency, q):.3f}' for q in QUANTILES if len(latency)]
+    for key, value in sorted(totals.items()):
+        if key[0] in ('latency_ms', 'latency_count'):
+            suffix = '_sum' if key[0] == 'latency_ms' else '_count'
+            lines.append(f'bi_agent_latency_ms{suffix}{{{_labels(kind=key[1], page=key[2], model=key[3])}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# Serve the Prometheus text at http://host:port/metrics from a daemon thread
+def serve_prometheus(telemetry, port, host='0.0.0.0'):
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = telemetry.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='prometheus', daemon=True).start()
+    return server
@@ -0,0 +1,55 @@
+# Concurrent execution of the tool calls of one assistant response: independent report functions run in a thread pool
+# (they spend their time in numpy/pandas, which release the GIL), and results come back in the order of the calls.
+
+import time
+import concurrent.futures
+
+
+MAX_TOOL_WORKERS = 4
+TOOL_TIMEOUT = 60  # seconds, for each call, from the moment it starts running
+
+
+def _timed(function, arguments, wrapper, starts, index):
+    started = starts[index] = time.perf_counter()
+    result  = wrapper(function, arguments) if wrapper else function(**arguments)
+    return result, (time.perf_counter() - started) * 1000
+
+
+class ToolExecutor:
+
+    def __init__(self, max_workers=MAX_TOOL_WORKERS):
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tool')
+
+    # Run the calls (call id, function, keyword arguments) concurrently; the optional wrapper(function, arguments) runs each
+    # call in its worker thread. Returns one dict per call, in the order of the calls, with status 'ok' (and the result),
+    # 'error' or 'timeout' (and an error message).
+    # Each call has its own timeout, counted from the moment a worker starts it, so calls queued behind others (more calls
+    # than workers) are not charged for the wait; a call still queued timeout seconds after the submission times out too.
+    # A call that times out is canceled if it has not started yet; a call already running cannot be interrupted, so it
+    # finishes in the background and its result is discarded.
+    def run(self, calls, timeout=TOOL_TIMEOUT, wrapper=None):
+
+        submitted = time.perf_counter()
+        starts    = [None] * len(calls)
+        futures   = [self.pool.submit(_timed, function, arguments, wrapper, starts, index) for index, (_, function, arguments) in enumerate(calls)]
+
+        results = []
+        for index, ((call_id, function, _), future) in enumerate(zip(calls, futures)):
+            name = getattr(function, '__name__', 'tool')
+            while not future.done():
+                remaining = (submitted if starts[index] is None else starts[index]) + timeout - time.perf_counter()
+                if remaining <= 0 and (starts[index] is not None or future.cancel()):
+                    break
+                concurrent.futures.wait([future], timeout=max(remaining, 0))
+            if future.cancelled() or not future.done():
+                results.append({'id': call_id, 'status': 'timeout', 'error': f'{name} did not finish within {timeout} seconds'})
+                continue
+            try:
+                result, elapsed_ms = future.result()
+                results.append({'id': call_id, 'status': 'ok', 'result': result, 'elapsed_ms': elapsed_ms})
+            except Exception as error:
+                results.append({'id': call_id, 'status': 'error', 'error': f'{name} failed: {error}'})
+        return results
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,92 @@
+# Registry of the functions an agent can call. Functions are registered with a decorator when their module is imported,
+# and their JSON schemas (OpenAI "tools" format) are generated once from their signatures and annotations: parameters
+# without a default are required, the annotation gives the JSON type, and descriptions come from the registry defaults
+# or the decorator. Dispatch by name is a dictionary lookup, and arguments are checked by validators compiled from the
+# schemas (see bi_agent.json_repair).
+
+import json
+import typing
+import inspect
+import hashlib
+
+from bi_agent.json_repair import compile_validator, loads_tolerant
+
+
+_JSON_TYPES = {
+    str  : 'string',
+    int  : 'integer',
+    float: 'number',
+    bool : 'boolean',
+}
+
+
+# JSON schema of an annotation: str, int, float, bool, list[...], Literal[...] and Optional[...] (None is the default)
+def annotation_schema(annotation):
+    origin, args = typing.get_origin(annotation), typing.get_args(annotation)
+    if annotation in _JSON_TYPES:
+        return {"type": _JSON_TYPES[annotation]}
+    if origin is list:
+        return {"type": "array", "items": annotation_schema(args[0]) if args else {}}
+    if origin is typing.Literal:
+        return {**annotation_schema(type(args[0])), "enum": list(args)}
+    if origin is typing.Union and type(None) in args:
+        return annotation_schema(next(arg for arg in args if arg is not type(None)))
+    raise ValueError(f"Annotation {annotation!r} has no JSON schema")
+
+
+def function_schema(function, description, parameter_descriptions):
+    properties, required = {}, []
+    for name, parameter in inspect.signature(function).parameters.items():
+        if parameter.annotation is inspect.Parameter.empty:
+            raise ValueError(f"Parameter {name} of {function.__name__} has no annotation")
+        if name not in parameter_descriptions:
+            raise ValueError(f"Parameter {name} of {function.__name__} has no description")
+        properties[name] = {**annotation_schema(parameter.annotation), "description": parameter_descriptions[name]}
+        if parameter.default is inspect.Parameter.empty:
+            required.append(name)
+    return {
+        "name"       : function.__name__,
+        "description": description,
+        "parameters" : {"type": "object", "properties": properties, "required": required},
+    }
+
+
+class ToolRegistry:
+
+    def __init__(self, parameter_descriptions=None):
+        self.parameter_descriptions = parameter_descriptions or {}  # shared by every function of the registry
+        self.functions = {}
+        self.schemas   = {}
+        self.validators = {}
+        self.version   = None
+
+    # Decorator registering a function, with its description and descriptions of its own parameters
+    # The version (a hash of the schemas) changes with any schema, to rebuild the prompts that list the tools
+    def register(self, description, **parameter_descriptions):
+        def decorator(function):
+            if function.__name__ in self.functions:
+                raise ValueError(f"Function {function.__name__} is already registered")
+            self.schemas[function.__name__]   = function_schema(function, description, {**self.parameter_descriptions, **parameter_descriptions})
+            self.functions[function.__name__] = function
+            self.validators[function.__name__] = compile_validator(self.schemas[function.__name__]['parameters'])
+            self.version = hashlib.sha1(json.dumps(list(self.schemas.values()), sort_keys=True).encode()).hexdigest()[:12]
+            return function
+        return decorator
+
+    def __contains__(self, name):
+        return name in self.functions
+
+    def __getitem__(self, name):
+        return self.functions[name]
+
+    # Arguments of a call from their JSON text, repaired and coerced to the schema of the function, and whether they had to
+    # be repaired. Raises ValueError for an unknown function or arguments that cannot be fixed.
+    def parse_arguments(self, name, text):
+        if name not in self.validators:
+            raise ValueError(f"Unknown function {name}")
+        arguments, repaired = loads_tolerant(text)
+        return self.validators[name](arguments), repaired
+
+    # Tool list for the chat completions API, in the order of registration
+    def tools(self):
+        return [{"type": "function", "function": schema} for schema in self.schemas.values()]
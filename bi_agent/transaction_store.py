@@ -0,0 +1,252 @@
+# Local columnar store of the hospital transactions: a directory of Arrow IPC files partitioned by month of
+# transaction_datetime (and optionally by hospital_name), with a JSON manifest of the files.
+#   - Loads only append: each load writes new files, then replaces the manifest atomically, so readers see the store
+#     before or after a load, never half of it. One process should write at a time.
+#   - Files are uncompressed Arrow, read through memory maps without copying; a read opens only the partitions of the
+#     months (and hospitals) it asks for, e.g. the resolved time period of a report.
+#
+#   python -m bi_agent.transaction_store load     data/transactions transactions.parquet
+#   python -m bi_agent.transaction_store generate data/transactions --rows 100000000
+#   python -m bi_agent.transaction_store info     data/transactions
+
+import os
+import json
+import time
+import uuid
+import argparse
+import functools
+import datetime
+import urllib.parse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from bi_agent.spend_engine import TEXT_COLUMNS, prepare_transactions
+from bi_agent.synthetic import generate_transaction_chunks
+
+
+MANIFEST = '_manifest.json'
+PARTITION_COLUMNS = ('month', 'hospital')
+LOAD_CHUNK_ROWS = 5_000_000  # rows read from an input file at a time
+
+SCHEMA = pa.schema([('transaction_datetime', pa.timestamp('ns')), ('spend_amount', pa.float64())] +
+                   [(column, pa.dictionary(pa.int32(), pa.string())) for column in TEXT_COLUMNS])
+
+
+def month_bounds(month):
+    start = datetime.date.fromisoformat(f'{month}-01')
+    return start, (start + datetime.timedelta(days=32)).replace(day=1)
+
+
+class TransactionStore:
+
+    # partition_by is set when the store is created: ('month',) or ('month', 'hospital')
+    def __init__(self, root, partition_by=('month',)):
+        self.root = root
+        if os.path.exists(os.path.join(root, MANIFEST)):
+            with open(os.path.join(root, MANIFEST)) as file:
+                self.manifest = json.load(file)
+        else:
+            if not set(partition_by) <= set(PARTITION_COLUMNS) or 'month' not in partition_by:
+                raise ValueError(f"Unknown partitioning: {partition_by}. Use ('month',) or ('month', 'hospital')")
+            self.manifest = {'version': 0, 'partition_by': list(partition_by), 'files': [], 'loads': []}
+
+    @staticmethod
+    def exists(path):
+        return bool(path) and os.path.isfile(os.path.join(path, MANIFEST))
+
+    def __len__(self):
+        return sum(file['rows'] for file in self.manifest['files'])
+
+    # Changes with every load (see bi_agent.data.data_watermark)
+    @property
+    def watermark(self):
+        loads = self.manifest['loads']
+        return f"{self.manifest['version']}-{loads[-1]['id'] if loads else 'empty'}"
+
+    #%%##################################################################################################################
+    # APPEND
+    #####################################################################################################################
+
+    # Append transaction frames (one frame or an iterable of frames) as one load; returns the number of rows appended
+    def append(self, frames, source=None):
+
+        frames  = [frames] if isinstance(frames, pd.DataFrame) else frames
+        load_id = uuid.uuid4().hex[:12]
+        files, rows = [], 0
+        for frame in frames:
+            frame = prepare_transactions(frame)  # typed, dictionary-encoded and sorted by date
+            rows += len(frame)
+            for partition, part in self._partitions(frame):
+                directory = os.path.join(self.root, *(f'{name}={urllib.parse.quote(str(value), safe="")}' for name, value in partition.items()))
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f'part-{load_id}-{len(files):05d}.arrow')
+                with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, SCHEMA) as writer:
+                    writer.write_table(pa.Table.from_pandas(part, schema=SCHEMA, preserve_index=False))
+                datetimes = part['transaction_datetime']
+                files.append({'path'    : os.path.relpath(path, self.root),
+                              'month'   : partition['month'],
+                              'hospital': partition.get('hospital'),
+                              'rows'    : len(part),
+                              'min'     : datetimes.iloc[0].isoformat(),
+                              'max'     : datetimes.iloc[-1].isoformat(),
+                              'load'    : load_id,
+                              })
+
+        manifest = dict(self.manifest, version = self.manifest['version'] + 1,
+                                       files   = self.manifest['files'] + files,
+                                       loads   = self.manifest['loads'] + [{'id': load_id, 'rows': rows, 'files': len(files), 'source': source, 'loaded_at': time.time()}])
+        os.makedirs(self.root, exist_ok=True)
+        temporary = os.path.join(self.root, f'{MANIFEST}.{load_id}')
+        with open(temporary, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(temporary, os.path.join(self.root, MANIFEST))
+        self.manifest = manifest
+        return rows
+
+    # Rows of a prepared frame by partition: months are contiguous (the rows are sorted by date), then hospitals
+    def _partitions(self, frame):
+        months = frame['transaction_datetime'].to_numpy().astype('M8[M]')
+        bounds = np.flatnonzero(np.diff(months.astype(np.int64))) + 1
+        for start, end in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(frame)]])):
+            month = str(months[start])
+            rows  = frame.iloc[start:end]
+            if 'hospital' not in self.manifest['partition_by']:
+                yield {'month': month}, self._compact(rows)
+                continue
+            for hospital, part in rows.groupby('hospital_name', observed=True, sort=True, dropna=False):
+                yield {'month': month, 'hospital': None if pd.isna(hospital) else hospital}, self._compact(part)
+
+    # Each file keeps only the dictionary values it uses
+    @staticmethod
+    def _compact(rows):
+        rows = rows.reset_index(drop=True)
+        for column in TEXT_COLUMNS:
+            rows[column] = rows[column].cat.remove_unused_categories()
+        return rows
+
+    #%%##################################################################################################################
+    # READ
+    #####################################################################################################################
+
+    # Ids of the loads of the store, oldest first
+    def load_ids(self):
+        return [load['id'] for load in self.manifest['loads']]
+
+    # Files of the partitions that overlap the date intervals ([start, end) dates; None for all time) and hospitals, and
+    # of the given loads (all by default)
+    def files(self, intervals=None, hospitals=None, loads=None):
+        selected = []
+        for file in self.manifest['files']:
+            if loads is not None and file['load'] not in loads:
+                continue
+            if intervals is not None:
+                start, end = month_bounds(file['month'])
+                if not any(low < end and start < high for low, high in intervals):
+                    continue
+            if hospitals is not None and 'hospital' in self.manifest['partition_by'] and file['hospital'] not in hospitals:
+                continue
+            selected.append(file)
+        return selected
+
+    # Arrow table of the transactions in the intervals and of the hospitals (all by default), in date order of the
+    # partitions. Only the files of the matching partitions are opened; their buffers are memory-mapped, not copied
+    # (rows are copied only when the edge partitions are trimmed to the intervals or hospitals).
+    def read(self, intervals=None, hospitals=None, columns=None, loads=None):
+
+        files  = sorted(self.files(intervals, hospitals, loads), key=lambda file: (file['month'], file['hospital'] or '', file['path']))
+        tables = [pa.ipc.open_file(pa.memory_map(os.path.join(self.root, file['path']), 'r')).read_all() for file in files]
+        table  = pa.concat_tables(tables) if tables else SCHEMA.empty_table()
+
+        mask = None
+        if intervals is not None:
+            dates = pc.cast(table['transaction_datetime'], pa.date32())
+            mask  = functools.reduce(pc.or_, [pc.and_(pc.greater_equal(dates, pa.scalar(low, pa.date32())), pc.less(dates, pa.scalar(high, pa.date32())))
+                                              for low, high in intervals], pa.scalar(False))
+        if hospitals is not None and 'hospital' not in self.manifest['partition_by']:
+            in_hospitals = pc.is_in(pc.cast(table['hospital_name'], pa.string()), value_set=pa.array(list(hospitals), pa.string()))
+            mask = in_hospitals if mask is None else pc.and_(mask, in_hospitals)
+        if mask is not None:
+            table = table.filter(mask)
+        return table.select(columns) if columns else table
+
+    # Transactions as a pandas frame (text columns as categoricals), for the report engines
+    def to_frame(self, intervals=None, hospitals=None, loads=None):
+        return self.read(intervals, hospitals, loads=loads).to_pandas()
+
+    def info(self):
+        files = self.manifest['files']
+        return {'rows'        : len(self),
+                'files'       : len(files),
+                'months'      : len({file['month'] for file in files}),
+                'first'       : min((file['min'] for file in files), default=None),
+                'last'        : max((file['max'] for file in files), default=None),
+                'loads'       : len(self.manifest['loads']),
+                'partition_by': self.manifest['partition_by'],
+                'megabytes'   : sum(os.path.getsize(os.path.join(self.root, file['path'])) for file in files) / 2**20,
+                'watermark'   : self.watermark,
+                }
+
+
+#%%######################################################################################################################
+# LOADER
+#########################################################################################################################
+
+# Frames of a Parquet or CSV file of transactions, chunk_rows rows at a time
+def read_chunks(path, chunk_rows=LOAD_CHUNK_ROWS):
+    if path.endswith('.csv'):
+        yield from pd.read_csv(path, parse_dates=['transaction_datetime'], chunksize=chunk_rows)
+        return
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+        yield batch.to_pandas()
+
+
+def generate_chunks(args):
+    chunks = generate_transaction_chunks(args.rows, args.vendors, args.hospitals, args.start_date, seed=args.seed, chunk_rows=args.chunk_rows)
+    for chunk, frame in enumerate(chunks):
+        print(f'chunk {chunk + 1}: {len(frame):,} rows from {frame.transaction_datetime.min():%Y-%m-%d}')
+        yield frame
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Load hospital transactions into a partitioned transaction store')
+    commands = parser.add_subparsers(dest='command', required=True)
+    load = commands.add_parser('load', help='append Parquet/CSV files of transactions')
+    load.add_argument('store')
+    load.add_argument('files', nargs='+')
+    generate = commands.add_parser('generate', help='append synthetic transactions')
+    generate.add_argument('store')
+    generate.add_argument('--rows',       type=int, default=100_000_000)
+    generate.add_argument('--vendors',    type=int, default=2000)
+    generate.add_argument('--hospitals',  type=int, default=150)
+    generate.add_argument('--start-date', default='2019-01-01')
+    generate.add_argument('--seed',       type=int, default=0)
+    for command in (load, generate):
+        command.add_argument('--chunk-rows',  type=int, default=LOAD_CHUNK_ROWS)
+        command.add_argument('--by-hospital', action='store_true', help='partition a new store by month and hospital')
+    info = commands.add_parser('info', help='describe the store')
+    info.add_argument('store')
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        print(json.dumps(TransactionStore(args.store).info(), indent=2))
+        return
+
+    store   = TransactionStore(args.store, partition_by=('month', 'hospital') if args.by_hospital else ('month',))
+    started = time.perf_counter()
+    if args.command == 'load':
+        for path in args.files:
+            rows = store.append(read_chunks(path, args.chunk_rows), source=os.path.abspath(path))
+            print(f'{path}: {rows:,} rows appended')
+    else:
+        rows = store.append(generate_chunks(args), source='synthetic')
+        print(f'{rows:,} synthetic rows appended')
+    info = store.info()
+    print(f"{time.perf_counter() - started:.1f} s; the store has {info['rows']:,} rows in {info['files']:,} files ({info['megabytes']:,.0f} MB)")
+
+
+if __name__ == '__main__':
+    main()
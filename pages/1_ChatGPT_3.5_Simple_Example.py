@@ -1,11 +1,21 @@
 # Implement demo code by Streamlit: https://github.com/streamlit/llm-examples/tree/main
 
+import time
 import streamlit as st
 import pandas as pd
-import openai
+
+from bi_agent.streaming import ChatCompletionStream, RedrawThrottle
+from bi_agent.llm_cache import response_key
+from bi_agent.history import fit_history, count_text_tokens
+from bi_agent.resources import load_llm_client, load_response_cache, load_telemetry, show_response_cache_stats
 
 # Load settings
+PAGE_NAME = 'GPT-3.5 simple example'
 openai_api_key = st.secrets["openai"]["key"]
+stream_responses = st.secrets["openai"].get("stream", True)
+response_cache = load_response_cache()
+telemetry = load_telemetry()
+llm_client = load_llm_client()
 
 # Display app basic information
 st.title("💬 ChatGPT 3.5-turbo Simple Example")
@@ -24,11 +34,56 @@ if prompt := st.chat_input():
         st.info("Please add your OpenAI API key to continue.")
         st.stop()
 
-    openai.api_key = openai_api_key
     st.session_state.messages.append({"role": "user", "content": prompt})
     st.chat_message("user").write(prompt)
-    response = openai.ChatCompletion.create(model="gpt-3.5-turbo", messages=st.session_state.messages)
-    msg = response.choices[0].message
+
+    # Answer from the response cache, or stream the answer into the assistant bubble as it is generated.
+    # Only the most recent turns that fit in the prompt budget of the model are sent.
+    assistant = st.chat_message("assistant")
+    started   = time.perf_counter()
+    history   = fit_history(st.session_state.messages, "gpt-3.5-turbo")
+    cache_key = response_key("gpt-3.5-turbo", history['messages'])
+    msg = response_cache.get(cache_key)
+    if msg is not None:
+        assistant.write(msg["content"])
+        response_attributes = {
+            'model':                  'gpt-3.5-turbo (cached)',
+            'time_to_first_token_ms': (time.perf_counter() - started) * 1000,
+            'completion_tokens':      0,
+            }
+    elif stream_responses:
+        placeholder = assistant.empty()
+        stream = ChatCompletionStream(llm_client.chat_completion(openai_api_key, model="gpt-3.5-turbo", messages=history['messages'], stream=True))
+        redraw = RedrawThrottle()
+        for _ in stream:
+            if redraw.due():
+                placeholder.markdown(stream.content + "▌")
+        placeholder.markdown(stream.content)
+        msg = stream.message()
+        response_attributes = stream.attributes()
+        response_attributes['completion_tokens'] = count_text_tokens(stream.content, "gpt-3.5-turbo")
+        response_cache.put(cache_key, msg)
+    else:
+        response = llm_client.chat_completion(openai_api_key, model="gpt-3.5-turbo", messages=history['messages'])
+        msg = response.choices[0].message.to_dict_recursive()
+        assistant.write(msg["content"])
+        response_attributes = {
+            'id':                     response['id'],
+            'response_ms':            response.response_ms,
+            'time_to_first_token_ms': (time.perf_counter() - started) * 1000,
+            'model':                  response['model'],
+            'completion_tokens':      response['usage']['completion_tokens'],
+            }
+        response_cache.put(cache_key, msg)
     st.session_state.messages.append(msg)
-    st.chat_message("assistant").write(msg.content)
+    response_attributes['prompt_tokens'] = history['prompt_tokens']
+    telemetry.record('llm', PAGE_NAME, 'gpt-3.5-turbo',
+                     cache                  = 'hit' if response_attributes['model'].endswith('(cached)') else 'miss',
+                     latency_ms             = (time.perf_counter() - started) * 1000,
+                     time_to_first_token_ms = response_attributes['time_to_first_token_ms'],
+                     prompt_tokens          = history['prompt_tokens'],
+                     completion_tokens      = response_attributes['completion_tokens'],
+                     )
+    assistant.caption(f"{response_attributes['model']} · {history['prompt_tokens']:,} prompt tokens ({history['dropped_turns']} earlier turns summarized) · first token after {response_attributes['time_to_first_token_ms'] or 0:.0f} ms")
 
+show_response_cache_stats()
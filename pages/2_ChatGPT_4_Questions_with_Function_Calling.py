@@ -1,481 +1,144 @@
 # Implement demo code by Streamlit: https://github.com/streamlit/llm-examples/tree/main
 
+import time
+import functools
 import streamlit as st
 import pandas as pd
-import openai
-import types
-import inspect
-import textwrap
 import json
 
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from bi_agent import json_report_agent
+from bi_agent.streaming import ChatCompletionStream, RedrawThrottle, until_json_object
+from bi_agent.llm_cache import response_key
+from bi_agent.history import fit_history, count_message_tokens, count_text_tokens
+from bi_agent.function_calling_agent import AGENT_NAME, MODEL, agent_version, build_agent_prompt
+from bi_agent.report_tools import DELIVERED, report_tools, run_tool, show_report
+from bi_agent.job_queue import IN_FLIGHT
+from bi_agent.resources import load_agent_prompt, load_job_queue, load_llm_client, load_model_router, load_response_cache, load_telemetry, load_tool_executor, load_semantic_cache, show_job_queue_stats, show_report_cache_stats, show_response_cache_stats, show_semantic_cache_stats
+
 
 #%%###################################################################################################################### 
 # GPT AGENT CONFIGURATION
 #########################################################################################################################
 
-def chat_gpt_basic_BI_agent (sentence):
-
-    # Configure
-    system_message = """        
-        You are a Business Intelligence (BI) analyst that produces reports to answer business questions and meet information requests from "business users". 
-        
-        Your job is to: 
-            1. interpret a business question or information request from a "business user".
-            2. choose the correct type of report and identify the dimensions, filters, and metrics to be used in that report. Then call a function that will generate and send that report to the business user. Then respond 'Report sent' to the user.
-            3. if not possible to meet the requirements, then respond to the user: "I cannot deliver that information with the data and reports that I have available" and add a brief explanation of the reason.
-
-        No other response to the user is acceptable: you must either act and respond as indicated in item 2 or respond as described in item 3. 
-
-        The type of reports that you have available are:
-            a) Generic Spend Report: Flexible report that you can use to answer many user questions about historical transaction volumes and spend. You can specify various filters, dimensions, and metrics for this report.
-            b) Benchmarking Spend Report: Answers questions such as: how are my vendors performing relative to peers? Use this report to compare the rates of vendors against competitors that perform similar work. Dimensions and metrics are fixed, but you may specify filters.
-            c) Market Share Report: Answers questions such as: what are the top N vendors in a given category? Use this report to show the largest vendors available in the market and their share. You may specify one metric ('volume_share' or 'spend_share'), a vendor count limit (top N), and filters.
-            d) Vendor Market Share Map: It displays a map to answer questions such as: what markets does a given vendor serve and what share does it have? who is the market leader for a given category? and where does that market leader offer services? You may specify one metric ('volume share' or 'spend share') and filters.
-
-        The data that these reports can access is a table of hospital expenditures in a PostgreSQL database. The table has records for every purchase or service transaction and contains the following fields:
-            - transaction_datetime : the date and time of the purchase or service (type: timestamp)
-            - spend_amount         : the cost of the purchase or service in US$ (type: numeric)
-            - vendor_name          : the name of the vendor company (a.k.a. service provider, manufacturer, distributor, contractor) that provided the product or service (type: char)
-            - category_name        : the category of the expense according to a standard classification system (type: char)
-            - hospital_name        : the name of the hospital (also refered to as "facility") that incurred the expense (type: char)
-            - division_name        : the name of the division of the hopital or hospital group that incurred the expense (type: char)
-            - department_name      : the name of the department of the hopital that incurred the expense (type: char)
-            - gl_account_name      : the General Ledger account of the expenditure in the accouting system of the hospital or hospital group (type: char)
-            - geographic_market    : the name of the geographical region where the hospital facility is located under a standard classification system (imagine MSAs, CBSAs, CSAs, DMAs, or similar systems.) (type: char)
-
-        All reports will have the following "filters" that you can specify in order to include only the necesary expenditures in each report:  
-            - vendor_filter_list: List of vendor company names to be included
-            - category_filter_list: List of spend category names to be included 
-            - hospital_filter_list: List of hospital names (a.k.a. facility names) to be included 
-            - department_filter_list: List of department names to be included
-            - division_filter_list: List of division names to be included  
-            - gl_account_filter_list: List of GL account names to be included
-            - time_period_filter_list: List of "period names" to be included. Each period will be calculated by the report based on transaction_date and the current date of the report. The valid period names that you may specify are: 
-                'LAST YEAR', 'LAST QUARTER', 'LAST MONTH', 'LAST WEEK';
-                'LAST N YEARS', 'LAST N QUARTERS', 'LAST N MONTHS', 'LAST N WEEKS', 'LAST N DAYS' (where N = integer you must specify);
-                'YEAR TO DATE', 'QUARTER TO DATE', 'MONTH TO DATE'; 
-                'YEAR yyyy', 'QUARTER yyyy-q', 'MONTH yyyy-mm' (where you can specify an exact year "yyyy", quarter number "q", and month number "mm"); 
-                'FROM yyyy-mm-dd TO yyy-mm-dd' (where you can specify the start and end-date of an ad-hoc period in YYYY-MM-DD format);
-                'STLY' (means "same time last year" and its calculated taking the previous period in the list and shifting it 1 year back in time);
-                and 'ALL TIME' (if the report must include all transaction dates, e.g. not have any "time filter")
-
-        Some reports allow you to specify dimensions. Please specify any metric names that you need. Valid dimension names include: 
-            'vendor_name', 'category_name', 'hospital_name', 'division_name', 'department_name', 'gl_account_name'; 
-            'transaction_year', 'transaction_quarter', 'transaction_month', 'transaction_day', and 'transaction_week' (which come from grouping transaction_datetime). 
-
-        Some reports allow you to specify metrics. Please specify any metric names that you need. Valid metrics name and their definitions are:
-            'total_volume' = count of unique transactions,
-            'total_amount' = sum(spend_amount),
-            'min_amount'   = min(spend_amount),
-            'max_amount'   = max(spend_amount),
-            'avg_amount'   = total_amount / total_volume,
-            'pXX_amount'   = percentile of spend_amount (where XX = integer you specify, for example 'p50_amount' is the median),
-            'volume_share' = total_volume of a vendor as a percent of the grand total volume in the "market" (defined as the geographic_market and the category filters in the report), and              
-            'spend_share'  = total_amount of a vendor as a percent of the grand total amount in the "market" (defined as the geographic_market and the category filters in the report).                
-
-        Additional instructions:
-        - Do NOT explain your thought process or your analytics methodology in your final response to the business user. The business user just wants the report (which you can deliver by calling the right function) or a simple explanation of why you cannot provide it.
-        - Do NOT include technical details, python code, javascript code, or SQL queries in your final response to the business user. Business users don't understand those languages and cannot access any of the reporting functions themselves. 
-        - Keep each report as simple as possible: Do not add any filters, dimensions, or metrics that are not essential to answer the business question.  
-        """
-
-    prompt = f"""
-        Please answer the following question or information request from a business user:
-        [SENTENCE]
-        """
-
-    # Cleanup
-    prompt = textwrap.dedent(prompt).strip()
-    prompt = prompt.replace('[SENTENCE]', sentence)
-    if system_message:
-        system_message = textwrap.dedent(system_message).strip()
-
-    # Return
-    return prompt, system_message
-
-
-# DEFINE THE CALLBACK FUNCTION SPECS FOR CHAT GPT
-functions_definitions = [
-    # generate_and_send_generic_spend_report
-    {
-        "name": "generate_and_send_generic_spend_report",
-        "description": "Use this function to generate a Generic Spend Report and send it to the business user. ",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "title": {
-                    "type": "string", 
-                    "description": "The name or title of the report to be displayed to the business user",
-                },
-                "vendor_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of vendor companies that the report should include. If this filter is needed, please pass a list of names for one or more vendors. If this optional parameter is not provided, then all vendors will be used.",
-                },
-                "category_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of spend categories that the report should include. If this filter is needed, please pass a list of names for one or more spend categories. If this optional parameter is not provided, then all categories will be used.",
-                },
-                "hospital_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of hospitals that the report should include. If this filter is needed, please pass a list of names for one or more hospitals/facilities. If this optional parameter is not provided, then all hospitals will be used.",
-                },
-                "department_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of departments that the report should include. If this filter is needed, please pass a list of names for one or more departments. If this optional parameter is not provided, then all departments will be used.",
-                },
-                "division_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of divisions that the report should include. If this filter is needed, please pass a list of names for one or more divisions. If this optional parameter is not provided, then all divisions will be used.",
-                },
-                "gl_account_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of GL accounts that the report should include. If this filter is needed, please pass a list of names for one or more GL accounts. If this optional parameter is not provided, then all GL Accounts will be used.",
-                },
-                "time_period_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of time periods that the report should include. If this filter is needed, please pass a list of one or more period names such as: ['YEAR TO DATE', 'STLY', 'LAST 5 YEARS']. For the complete list of acceptable period names, please refer to the system instructions provided earlier. If this optional parameter is not provided, the report will either apply a default period or include all time.",
-                },
-                "fiscal_calendar": {
-                    "type": "boolean",
-                    "description": "If True, the time periods in the filters and dimensions will be calculated using fiscal years and fiscal quarters. If False, they will be calculated using normal calendar years and quarters. If this optional parameter is not provided, then normal calendar periods will be used as default.",
-                },
-                "metrics": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of metric names that the report should display. Example: ['total_volume', 'p50_amount', 'spend_share']. For the complete list of acceptable metric names, please refer to the system instructions provided earlier. This is an optional parameter: don't supply it if the business question can be answered without any metrics.",
-                },
-                "dimensions": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of dimension names that the report should display. Example: ['vendor_name', 'transaction_year']. For the complete list of acceptable dimention names, please refer to the system instructions provided earlier. This is an optional parameter: don't supply it if dimensions aren't strictly necesary to answer the business question.",
-                },
-                "user_request": {
-                    "type": "string",
-                    "description": "The text of the business user request or question that you are seeking to answer with this report. It will not be used in producing the report (it's passed only for documentation purposes.)",
-                },
-            },
-            "required": ["title", "user_request"],
-        },
-    },
-    # generate_and_send_benchmarking_spend_report
-    {
-        "name": "generate_and_send_benchmarking_spend_report",
-        "description": "Use this function to generate a Benchmarking Spend Report and send it to the business user. ",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "title": {
-                    "type": "string",
-                    "description": "The name or title of the report to be displayed to the business user",
-                },
-                "vendor_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of vendor companies that the report should include. If this filter is needed, please pass a list of names for one or more vendors. If this optional parameter is not provided, then all vendors will be used.",
-                },
-                "category_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of spend categories that the report should include. If this filter is needed, please pass a list of names for one or more spend categories. If this optional parameter is not provided, then all categories will be used.",
-                },
-                "hospital_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of hospitals that the report should include. If this filter is needed, please pass a list of names for one or more hospitals/facilities. If this optional parameter is not provided, then all hospitals will be used.",
-                },
-                "department_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of departments that the report should include. If this filter is needed, please pass a list of names for one or more departments. If this optional parameter is not provided, then all departments will be used.",
-                },
-                "division_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of divisions that the report should include. If this filter is needed, please pass a list of names for one or more divisions. If this optional parameter is not provided, then all divisions will be used.",
-                },
-                "gl_account_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of GL accounts that the report should include. If this filter is needed, please pass a list of names for one or more GL accounts. If this optional parameter is not provided, then all GL Accounts will be used.",
-                },
-                "time_period_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of time periods that the report should include. If this filter is needed, please pass a list of one or more period names such as: ['YEAR TO DATE', 'STLY', 'LAST 5 YEARS']. For the complete list of acceptable period names, please refer to the system instructions provided earlier. If this optional parameter is not provided, the report will either apply a default period or include all time.",
-                },
-                "fiscal_calendar": {
-                    "type": "boolean",
-                    "description": "If True, the time periods in the filters and dimensions will be calculated using fiscal years and fiscal quarters. If False, they will be calculated using normal calendar years and quarters. If this optional parameter is not provided, then normal calendar periods will be used as default.",
-                },
-                "user_request": {
-                    "type": "string",
-                    "description": "The text of the business user request or question that you are seeking to answer with this report. It will not be used in producing the report (it's passed only for documentation purposes.)",
-                },
-            },
-            "required": ["title", "user_request"],
-        },
-    },
-    # generate_and_send_market_share_report
-    {
-        "name": "generate_and_send_market_share_report",
-        "description": "Use this function to generate a Market Share Report and send it to the business user. ",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "title": {
-                    "type": "string",
-                    "description": "The name or title of the report to be displayed to the business user",
-                },
-                "share_metric": {
-                    "type": "string",
-                    "description": "Which share metric should the report display. Pick one of these two options: 'volume_share' or 'spend_share'.",
-                },
-                "vendor_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of vendor companies that the report should include. If this filter is needed, please pass a list of names for one or more vendors. If this optional parameter is not provided, then all vendors will be used.",
-                },
-                "category_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of spend categories that the report should include. If this filter is needed, please pass a list of names for one or more spend categories. If this optional parameter is not provided, then all categories will be used.",
-                },
-                "hospital_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of hospitals that the report should include. If this filter is needed, please pass a list of names for one or more hospitals/facilities. If this optional parameter is not provided, then all hospitals will be used.",
-                },
-                "department_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of departments that the report should include. If this filter is needed, please pass a list of names for one or more departments. If this optional parameter is not provided, then all departments will be used.",
-                },
-                "division_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of divisions that the report should include. If this filter is needed, please pass a list of names for one or more divisions. If this optional parameter is not provided, then all divisions will be used.",
-                },
-                "gl_account_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of GL accounts that the report should include. If this filter is needed, please pass a list of names for one or more GL accounts. If this optional parameter is not provided, then all GL Accounts will be used.",
-                },
-                "time_period_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of time periods that the report should include. If this filter is needed, please pass a list of one or more period names such as: ['YEAR TO DATE', 'STLY', 'LAST 5 YEARS']. For the complete list of acceptable period names, please refer to the system instructions provided earlier. If this optional parameter is not provided, the report will either apply a default period or include all time.",
-                },
-                "fiscal_calendar": {
-                    "type": "boolean",
-                    "description": "If True, the time periods in the filters and dimensions will be calculated using fiscal years and fiscal quarters. If False, they will be calculated using normal calendar years and quarters. If this optional parameter is not provided, then normal calendar periods will be used as default.",
-                },
-                "user_request": {
-                    "type": "string",
-                    "description": "The text of the business user request or question that you are seeking to answer with this report. It will not be used in producing the report (it's passed only for documentation purposes.)",
-                },
-            },
-            "required": ["title", "share_metric", "user_request"],
-        },
-    },
-    # generate_and_send_vendor_market_share_map
-    {
-        "name": "generate_and_send_vendor_market_share_map",
-        "description": "Use this function to generate a Vendor Market Share Map and send it to the business user. ",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "title": {
-                    "type": "string",
-                    "description": "The name or title of the report to be displayed to the business user",
-                },
-                "share_metric": {
-                    "type": "string",
-                    "description": "Which share metric should the report display. Pick one of these two options: 'volume_share' or 'spend_share'.",
-                },
-                "vendor_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of vendor companies that the report should include. If this filter is needed, please pass a list of names for one or more vendors. If this optional parameter is not provided, then all vendors will be used.",
-                },
-                "category_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of spend categories that the report should include. If this filter is needed, please pass a list of names for one or more spend categories. If this optional parameter is not provided, then all categories will be used.",
-                },
-                "hospital_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of hospitals that the report should include. If this filter is needed, please pass a list of names for one or more hospitals/facilities. If this optional parameter is not provided, then all hospitals will be used.",
-                },
-                "department_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of departments that the report should include. If this filter is needed, please pass a list of names for one or more departments. If this optional parameter is not provided, then all departments will be used.",
-                },
-                "division_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of divisions that the report should include. If this filter is needed, please pass a list of names for one or more divisions. If this optional parameter is not provided, then all divisions will be used.",
-                },
-                "gl_account_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of GL accounts that the report should include. If this filter is needed, please pass a list of names for one or more GL accounts. If this optional parameter is not provided, then all GL Accounts will be used.",
-                },
-                "time_period_filter_list": {
-                    "type": "array", 
-                    "items": {"type": "string"},
-                    "description": "List of time periods that the report should include. If this filter is needed, please pass a list of one or more period names such as: ['YEAR TO DATE', 'STLY', 'LAST 5 YEARS']. For the complete list of acceptable period names, please refer to the system instructions provided earlier. If this optional parameter is not provided, the report will either apply a default period or include all time.",
-                },
-                "fiscal_calendar": {
-                    "type": "boolean",
-                    "description": "If True, the time periods in the filters and dimensions will be calculated using fiscal years and fiscal quarters. If False, they will be calculated using normal calendar years and quarters. If this optional parameter is not provided, then normal calendar periods will be used as default.",
-                },
-                "user_request": {
-                    "type": "string",
-                    "description": "The text of the business user request or question that you are seeking to answer with this report. It will not be used in producing the report (it's passed only for documentation purposes.)",
-                },
-            },
-            "required": ["title", "share_metric", "user_request"],
-        },
-    },
-]
-
-
-
-# Function definitions with global connection and logging function
-def generate_and_send_generic_spend_report( title                   ,
-                                            user_request            ,
-                                            vendor_filter_list      = None, 
-                                            category_filter_list    = None,
-                                            hospital_filter_list    = None,
-                                            department_filter_list  = None,
-                                            division_filter_list    = None,
-                                            gl_account_filter_list  = None,
-                                            time_period_filter_list = None,
-                                            fiscal_calendar         = None, 
-                                            metrics                 = None, 
-                                            dimensions              = None):
-    command = f"""generate_and_send_generic_spend_report(
-        title                  : {title                  } 
-        vendor_filter_list     : {vendor_filter_list     } 
-        category_filter_list   : {category_filter_list   } 
-        hospital_filter_list   : {hospital_filter_list   } 
-        department_filter_list : {department_filter_list } 
-        division_filter_list   : {division_filter_list   } 
-        gl_account_filter_list : {gl_account_filter_list } 
-        time_period_filter_list: {time_period_filter_list} 
-        fiscal_calendar        : {fiscal_calendar        } 
-        metrics                : {metrics                } 
-        dimensions             : {dimensions             } 
-        user_request           : {user_request           } 
-        )
-    """
-    response = f"Generic spend report has been generated. Please respond to the user: 'Report {title} sent.'"
-    return response
-
-def genete_and_send_benchmarking_spend_report(    title                   ,
-                                                    user_request            , 
-                                                    vendor_filter_list      = None, 
-                                                    category_filter_list    = None,
-                                                    hospital_filter_list    = None,
-                                                    department_filter_list  = None,
-                                                    division_filter_list    = None,
-                                                    gl_account_filter_list  = None,
-                                                    time_period_filter_list = None,
-                                                    fiscal_calendar         = None):
-    command = f"""generate_and_send_benchmarking_spend_report(
-        title                  : {title                  }
-        vendor_filter_list     : {vendor_filter_list     }
-        category_filter_list   : {category_filter_list   }
-        hospital_filter_list   : {hospital_filter_list   }
-        department_filter_list : {department_filter_list }
-        division_filter_list   : {division_filter_list   }
-        gl_account_filter_list : {gl_account_filter_list }
-        time_period_filter_list: {time_period_filter_list}
-        fiscal_calendar        : {fiscal_calendar        }
-        user_request           : {user_request           }
-        )
-    """
-    response = f"Benchmarking report has been generated. Please respond to the user: 'Report {title} sent.'"
-    return response
-
-def generate_and_send_market_share_report(  title                   , 
-                                            share_metric            ,
-                                            user_request            ,
-                                            vendor_filter_list      = None, 
-                                            category_filter_list    = None,
-                                            hospital_filter_list    = None,
-                                            department_filter_list  = None,
-                                            division_filter_list    = None,
-                                            gl_account_filter_list  = None,
-                                            time_period_filter_list = None,
-                                            fiscal_calendar         = None):
-    command = f"""generate_and_send_market_share_report(
-        title                  : {title                  } 
-        share_metric           : {share_metric           } 
-        vendor_filter_list     : {vendor_filter_list     } 
-        category_filter_list   : {category_filter_list   } 
-        hospital_filter_list   : {hospital_filter_list   } 
-        department_filter_list : {department_filter_list } 
-        division_filter_list   : {division_filter_list   } 
-        gl_account_filter_list : {gl_account_filter_list } 
-        time_period_filter_list: {time_period_filter_list} 
-        fiscal_calendar        : {fiscal_calendar        } 
-        user_request           : {user_request           } 
-        )
-    """
-    response = f"Marketshare report has been generated. Please respond to the user: 'Report {title} sent.'"
-    return response
-
-def generate_and_send_vendor_market_share_map(  title                   , 
-                                                share_metric            ,
-                                                user_request            ,
-                                                vendor_filter_list      = None, 
-                                                category_filter_list    = None,
-                                                hospital_filter_list    = None,
-                                                department_filter_list  = None,
-                                                division_filter_list    = None,
-                                                gl_account_filter_list  = None,
-                                                time_period_filter_list = None,
-                                                fiscal_calendar         = None):
-    command = f"""generate_and_send_vendor_market_share_map(
-        title                  : {title                  } 
-        share_metric           : {share_metric           } 
-        vendor_filter_list     : {vendor_filter_list     } 
-        category_filter_list   : {category_filter_list   } 
-        hospital_filter_list   : {hospital_filter_list   } 
-        department_filter_list : {department_filter_list } 
-        division_filter_list   : {division_filter_list   } 
-        gl_account_filter_list : {gl_account_filter_list } 
-        time_period_filter_list: {time_period_filter_list} 
-        fiscal_calendar        : {fiscal_calendar        } 
-        user_request           : {user_request           } 
-        )
-    """
-    response = f"Marketshare Map has been generated. Please respond to the user: 'Report {title} sent.'"
-    return response
-
-
-# Map function names to actual callable functions available in all namespaces in the stack
-callable_functions = {name: func
-                        for frame_info in inspect.stack()
-                        for name, func in frame_info.frame.f_globals.items()
-                        if isinstance(func, types.FunctionType) and name in [f['name'] for f in functions_definitions] }
-
-# Generate the list  of "tools" (only functions for now)
-tool_definitions = []
-for f in functions_definitions:
-    if f['name'] in callable_functions.keys():
-        tool_definitions.append({"type": "function", "function": f})
+agent_prompt = load_agent_prompt(AGENT_NAME, MODEL, agent_version(), build_agent_prompt)
+tool_definitions = agent_prompt.tools
+
+
+# Ask one OpenAI model (picked by the model router) for the next assistant message within the timeout (seconds); when
+# streaming, text deltas are rendered into the placeholder as they arrive. Only the most recent turns that fit in the
+# prompt budget of the model (next to the tool definitions) are sent: history is the fit_history of the model. Returns
+# the message and its attributes.
+def ask_openai_model(model, history, timeout, placeholder, started):
 
+    response = llm_client.chat_completion(openai_api_key,
+                                          timeout     = timeout,
+                                          model       = model, 
+                                          messages    = history['messages'], 
+                                          tools       = tool_definitions,
+                                          tool_choice = 'auto',
+                                          temperature = 0.5, 
+                                          stream      = stream_responses,
+                                          )
+
+    # Uppack the API response
+    if stream_responses:
+        stream, redraw = ChatCompletionStream(response, started), RedrawThrottle()
+        for _ in stream:
+            if redraw.due():
+                placeholder.markdown(stream.content + "▌")
+        response_message    = stream.message()
+        response_attributes = stream.attributes()
+        response_attributes['prompt_tokens'] = history['prompt_tokens']
+        response_attributes['completion_tokens'] = count_message_tokens(response_message, model)
+    else:
+        response_message    = response.choices[0].message.to_dict_recursive()
+        response_attributes = { 
+            'id':                     response['id'],
+            'response_ms':            response.response_ms,
+            'time_to_first_token_ms': (time.perf_counter() - started) * 1000,
+            'model':                  response['model'],
+            'prompt_tokens':          response['usage']['prompt_tokens'],
+            'completion_tokens':      response['usage']['completion_tokens'],
+            'total_tokens':           response['usage']['total_tokens'],
+            }
+    telemetry.record('llm', PAGE_NAME, model,
+                     cache                  = 'miss',
+                     latency_ms             = (time.perf_counter() - started) * 1000,
+                     time_to_first_token_ms = response_attributes['time_to_first_token_ms'],
+                     prompt_tokens          = response_attributes['prompt_tokens'],
+                     completion_tokens      = response_attributes.get('completion_tokens', 0),
+                     )
+    return response_message, response_attributes
+
+
+# Failover of the model router when OpenAI times out or is unavailable: Llama-2 on Replicate answers the question with
+# the JSON report structure of page 3, which is turned into the equivalent tool call
+def ask_llama2(question, timeout, placeholder):
+
+    started = time.perf_counter()
+    json_prompt = load_agent_prompt(json_report_agent.AGENT_NAME, json_report_agent.MODEL, json_report_agent.agent_version(), json_report_agent.build_agent_prompt)
+    prompt_final = json_prompt.prompt(question)
+    output, first_token_ms, tokens, redraw = [], None, 0, RedrawThrottle()
+    for token in until_json_object(json_report_agent.stream_llama2_on_replicate(prompt_final, json_prompt.system_message, llm_client, replicate_api_token)):
+        first_token_ms = first_token_ms or (time.perf_counter() - started) * 1000
+        tokens += 1
+        output.append(token)
+        if redraw.due():
+            placeholder.markdown(''.join(output) + "▌")
+        if time.perf_counter() - started > timeout:
+            break  # the prediction is canceled
+    output = ''.join(output)
+    telemetry.record('llm', PAGE_NAME, json_report_agent.MODEL, cache='miss', latency_ms=(time.perf_counter() - started) * 1000,
+                     time_to_first_token_ms=first_token_ms, completion_tokens=tokens)
+
+    report = json_report_agent.parse_report(output)
+    if report is not None:
+        response_message = {"role": "assistant", "content": None, "tool_calls": [json_report_agent.report_tool_call(report, f"call_llama2_{started:.0f}", question)]}
+    else:
+        response_message = {"role": "assistant", "content": output}
+    response_attributes = {
+        'model':                  f'{json_report_agent.MODEL} (failover)',
+        'response_ms':            (time.perf_counter() - started) * 1000,
+        'time_to_first_token_ms': first_token_ms,
+        'prompt_tokens':          json_prompt.system_tokens + count_text_tokens(prompt_final, json_report_agent.MODEL),
+        'completion_tokens':      tokens,
+        }
+    return response_message, response_attributes
+
+
+# An answer whose tool arguments do not match the function schemas (or that calls an unknown function) escalates the
+# question to the next model of the route
+def validate_tool_calls(answer):
+    for tool in answer[0].get('tool_calls') or []:
+        report_tools.parse_arguments(tool['function']['name'], tool['function']['arguments'])
+
+
+
+# Reports of the background jobs of this session, most recent last; a finished report is read from the job store once
+def show_report_jobs(jobs):
+    results = st.session_state.setdefault("job_results", {})
+    for job in jobs:
+        if job['status'] == 'done':
+            if job['id'] not in results:
+                results[job['id']] = job_queue.result(job['id'])
+            show_report(job['title'], *results[job['id']])
+        elif job['status'] == 'error':
+            st.error(f"Report {job['title']} could not be generated: {job['error']}")
+        elif job['status'] == 'running':
+            st.info(f"⚙️ Report {job['title']} is being generated ({time.time() - job['started_at']:.0f} s)…")
+        else:
+            st.info(f"⏳ Report {job['title']} is queued (position {job['position']})…")
+
+# While jobs are in flight, only this panel reruns (every second) to show their progress; the whole page reruns once
+# they are all finished
+@st.fragment(run_every=1)
+def poll_report_jobs():
+    jobs = job_queue.jobs(session_id)
+    show_report_jobs(jobs)
+    if not any(job['status'] in IN_FLIGHT for job in jobs):
+        st.rerun()
 
 
 #%%###################################################################################################################### 
@@ -483,8 +146,19 @@ for f in functions_definitions:
 #########################################################################################################################
 
 # Load settings
+PAGE_NAME = 'GPT-4 function calling'
 openai_api_key = st.secrets["openai"]["key"]
-_, system_message = chat_gpt_basic_BI_agent('no prompt yet')
+replicate_api_token = st.secrets.get("replicate", {}).get("key")
+stream_responses = st.secrets["openai"].get("stream", True)
+response_cache = load_response_cache()
+tool_executor  = load_tool_executor()
+telemetry      = load_telemetry()
+llm_client     = load_llm_client()
+model_router   = load_model_router()
+job_queue      = load_job_queue()
+session_id     = get_script_run_ctx().session_id if get_script_run_ctx() else None
+semantic_cache = load_semantic_cache('gpt-4 function calling')
+system_message = agent_prompt.system_message
 
 # Display app basic information
 st.title("ChatGPT 4.0 Questions with Function Calling")
@@ -507,65 +181,118 @@ if prompt := st.chat_input():
     #     st.info("Please add your OpenAI API key to continue.")
     #     st.stop()
 
-    openai.api_key = openai_api_key
-
     # Prepare the message
     # prompt, _ = chat_gpt_basic_BI_agent(prompt)
     st.session_state.messages.append({"role": "user", "content": prompt})
     st.chat_message("user").write(prompt)
 
-    # Call the API
-    response = openai.ChatCompletion.create(model       = 'gpt-4', 
-                                            messages    = st.session_state.messages, 
-                                            tools       = tool_definitions,
-                                            tool_choice = 'auto',
-                                            temperature = 0.5, 
-                                            )
-    
-    # Uppack the API response
-    response_message = response.choices[0].message
-    response_content = response_message.content
+    # Call the API, unless the same conversation was answered before or a similar question was answered by a report.
+    # The model router asks the cheapest model first, and escalates when its tool arguments are not valid. Each model is
+    # sent the history trimmed to its own prompt budget, and its answers are cached under the key of that history.
+    assistant   = st.chat_message("assistant")
+    placeholder = assistant.empty()
+    started     = time.perf_counter()
+    histories   = {model: fit_history(st.session_state.messages, model, reserved_tokens=agent_prompt.tools_tokens) for model in model_router.models}
+    cache_keys  = {model: response_key(model, history['messages'], tools=tool_definitions, tool_choice='auto', temperature=0.5) for model, history in histories.items()}
+    response_message, source, cache_result = None, 'cached', 'hit'
+    for model in model_router.models:  # cheapest first, as routed
+        if (response_message := response_cache.get(cache_keys[model])) is not None:
+            break
+    history = histories[model]
+    previous_calls, decisions = None, []
+    if response_message is None:
+        previous_calls, similarity = semantic_cache.lookup(prompt)
+        if previous_calls is not None:
+            response_message = {"role": "assistant", "content": None, "tool_calls": [
+                {"id": f"call_semantic_{started:.0f}_{i}", "type": "function", "function": {"name": call["name"], "arguments": json.dumps(call["arguments"])}}
+                for i, call in enumerate(previous_calls)]}
+            source, cache_result = f'semantic cache, similarity {similarity:.2f}', 'semantic'
+    if response_message is not None:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        response_attributes = {'model': f'{model} ({source})', 'response_ms': elapsed_ms, 'time_to_first_token_ms': elapsed_ms, 'prompt_tokens': history['prompt_tokens']}
+        telemetry.record('llm', PAGE_NAME, model, cache=cache_result, latency_ms=elapsed_ms, time_to_first_token_ms=elapsed_ms, prompt_tokens=history['prompt_tokens'], completion_tokens=0)
+    else:
+        fallback = (lambda timeout: ask_llama2(prompt, timeout, placeholder)) if model_router.fallback_model and replicate_api_token else None
+        model, (response_message, response_attributes), decisions = model_router.route(PAGE_NAME, lambda model, timeout: ask_openai_model(model, histories[model], timeout, placeholder, started),
+                                                                                       validate_tool_calls, fallback)
+        history = histories.get(model, history)
+        if decisions[-1]['decision'] == 'accepted':  # failover answers are not reused
+            response_cache.put(cache_keys[model], response_message)
+
+    if 'tool_calls' in response_message:
+        placeholder.markdown(f"Calling {', '.join(tool['function']['name'] for tool in response_message['tool_calls'])}…")
+    response_content = response_message['content']
     st.session_state.messages.append(dict(response_message))
-    response_attributes = { 
-        'id':                response['id'],
-        'response_ms':       response.response_ms,
-        'model':             response['model'],
-        'prompt_tokens':     response['usage']['prompt_tokens'],
-        'completion_tokens': response['usage']['completion_tokens'],
-        'total_tokens':      response['usage']['total_tokens'],
-        }
 
     # Check if the response contains a function call
     if 'tool_calls' in response_message:
 
         response_content = []  # Turn blank string into a list
-
-        # Execute all the tools called by ChatGPT
-        for tool in response_message['tool_calls']:
-
-            if tool['type']  == 'function':
-                # Call the function
-                # TODO: the JSON response may not always be valid; be sure to handle errors
-                # TODO: Check when no longer in beta: client.beta.threads.runs.submit_tool_outputs
-                function_name    = tool["function"]["name"]
-                function_args    = tool["function"]["arguments"]
-                function_args    = json.loads(function_args)
-                function_to_call = callable_functions[function_name]
-                function_response = function_to_call(**function_args)
-
-                # Prepare the info on the function call and function response to GPT
-                st.session_state.messages.append({  "role"         : "tool", 
-                                                    "tool_call_id" : tool['id'], 
-                                                    "name"         : function_name, 
-                                                    "content"      : function_response,
-                                                    })
-                    
-                # When the response is a call-back function, return the function results to the user
-                response_content.append({   "function called" : function_name, 
-                                            "arguments"       : function_args,
-                                            "response"        : function_response,
-                                            })
+        validated_calls  = []  # Calls that produced a report, reused by the semantic cache for similar questions
+
+        # Parse the calls first: malformed arguments are repaired and coerced to the function schema when possible; a call
+        # that cannot be fixed (or an unknown function) is answered with the problems, the others run
+        tools = [tool for tool in response_message['tool_calls'] if tool['type'] == 'function']
+        calls, arguments, failures = [], {}, {}
+        for tool in tools:
+            try:
+                arguments[tool['id']], _ = report_tools.parse_arguments(tool["function"]["name"], tool["function"]["arguments"])
+                calls.append((tool['id'], report_tools[tool["function"]["name"]], arguments[tool['id']]))
+            except ValueError as error:
+                arguments[tool['id']] = tool["function"]["arguments"]
+                failures[tool['id']]  = f"The function arguments are not valid: {error}. Please explain the problem to the user."
+
+        # Execute all the tools called by ChatGPT concurrently; their reports are rendered here, in the order of the calls
+        # TODO: Check when no longer in beta: client.beta.threads.runs.submit_tool_outputs
+        results = {result['id']: result for result in tool_executor.run(calls, wrapper=functools.partial(run_tool, session=session_id))}
+        for tool in tools:
+
+            function_name = tool["function"]["name"]
+            function_args = arguments[tool['id']]
+            result        = results.get(tool['id'])
+            telemetry.record('tool', PAGE_NAME, name=function_name, status=result['status'] if result else 'error', latency_ms=result.get('elapsed_ms') if result else None)
+            status = 'failed'
+            if result is None:
+                function_response = failures[tool['id']]
+            elif result['status'] != 'ok':
+                function_response = f"The function could not be completed: {result['error']}. Please explain the problem to the user."
+            else:
+                report_delivery, reports = result['result']
+                function_response, status = report_delivery['message'], report_delivery['status']
+                for title, report, stats in reports:
+                    show_report(title, report, stats)
+
+            # Prepare the info on the function call and function response to GPT
+            st.session_state.messages.append({  "role"         : "tool", 
+                                                "tool_call_id" : tool['id'], 
+                                                "name"         : function_name, 
+                                                "content"      : function_response,
+                                                })
+                
+            # When the response is a call-back function, return the function results to the user
+            response_content.append({   "function called" : function_name, 
+                                        "arguments"       : function_args,
+                                        "response"        : function_response,
+                                        })
+            if status in DELIVERED:
+                validated_calls.append({"name": function_name, "arguments": function_args})
+
+        if previous_calls is None and validated_calls and len(validated_calls) == len(response_message['tool_calls']):
+            semantic_cache.store(prompt, validated_calls)
 
     # Display the response to the app user
-    st.chat_message("assistant").write(response_content)
-
+    placeholder.write(response_content)
+    route = ''.join(f" · {decision['model']} {decision['decision']}" for decision in decisions)
+    assistant.caption(f"{response_attributes['model']}{route} · {response_attributes['prompt_tokens']:,} prompt tokens ({history['dropped_turns']} earlier turns summarized) · first token after {response_attributes['time_to_first_token_ms'] or 0:.0f} ms · {response_attributes['response_ms'] or 0:.0f} ms total")
+
+# Reports of the background jobs
+if job_queue is not None:
+    if any(job['status'] in IN_FLIGHT for job in job_queue.jobs(session_id)):
+        poll_report_jobs()
+    else:
+        show_report_jobs(job_queue.jobs(session_id))
+
+show_response_cache_stats()
+show_semantic_cache_stats('gpt-4 function calling')
+show_job_queue_stats()
+show_report_cache_stats()
@@ -1,19 +1,35 @@
 # Implement demo code by Streamlit: https://blog.streamlit.io/langchain-tutorial-1-build-an-llm-powered-app-in-18-lines-of-code/
 
+import time
 import streamlit as st
 from langchain.llms import OpenAI
 
+from bi_agent.llm_cache import response_key
+from bi_agent.resources import load_llm_client, load_response_cache, load_telemetry, show_response_cache_stats
+
 # Load settings
+PAGE_NAME = 'LangChain example'
 openai_api_key = st.secrets["openai"]["key"]
+response_cache = load_response_cache()
+telemetry = load_telemetry()
+llm_client = load_llm_client()
 
 # Page Contents
 st.title('🦜🔗 Basic LangChain Example')
 st.caption("🚀 Interact with OpenAI's LLMs via LangChain")
 
-# Helper
+# Helper: the completion goes through the shared client (pooled connections, retries and hedging instead of the
+# retries of LangChain)
 def generate_response(input_text):
-  llm = OpenAI(temperature=0.7, openai_api_key=openai_api_key)
-  st.info(llm(input_text))
+  llm = OpenAI(temperature=0.7, openai_api_key=openai_api_key, max_retries=0)
+  cache_key = response_key(llm.model_name, input_text, temperature=0.7)
+  started = time.perf_counter()
+  response, cache = response_cache.get(cache_key), 'hit'
+  if response is None:
+    response, cache = llm_client.call(llm, input_text, hedge=True), 'miss'
+    response_cache.put(cache_key, response)
+  telemetry.record('llm', PAGE_NAME, llm.model_name, cache=cache, latency_ms=(time.perf_counter() - started) * 1000)
+  st.info(response)
 
 # Execute
 with st.form('my_form'):
@@ -24,5 +40,4 @@ with st.form('my_form'):
   if submitted and openai_api_key.startswith('sk-'):
     generate_response(text)
 
-
-
+show_response_cache_stats()
@@ -0,0 +1,43 @@
+# Admin view of the telemetry of every page: latency quantiles and histograms per page and model, tool calls, cache hits
+
+import streamlit as st
+
+from bi_agent.telemetry import latency_summary, latency_histogram
+from bi_agent.resources import load_telemetry
+
+# Load settings
+telemetry = load_telemetry()
+prometheus_port = st.secrets.get("telemetry", {}).get("prometheus_port")
+
+# Page Contents
+st.title('📈 Telemetry Admin')
+st.caption("Latency, time to first token, tokens and cache hits of the LLM and tool calls of every page")
+
+source = st.radio("Events", ["Recent calls (this process)", "All calls (telemetry file)"], horizontal=True, disabled=not telemetry.path)
+events = telemetry.frame(flushed=source.startswith("All"))
+if events.empty:
+    st.info("No calls recorded yet.")
+    st.stop()
+
+st.subheader("Latency per page and model")
+st.dataframe(latency_summary(events), hide_index=True)
+
+st.subheader("Latency histograms")
+for kind, title in (('llm', 'LLM calls'), ('tool', 'Tool calls')):
+    histogram = latency_histogram(events[events['kind'] == kind], by=('page', 'model') if kind == 'llm' else ('page', 'name'))
+    if not histogram.empty:
+        st.caption(f"{title}: number of calls per latency bucket (ms)")
+        st.bar_chart(histogram)
+
+routes = events[events['kind'] == 'route']
+if not routes.empty:
+    st.subheader("Model routing")
+    st.caption("Decisions of the model router per page and model: accepted, escalated (invalid answer), failed over (timeout or API unavailable), fallback")
+    st.dataframe(routes.groupby(['page', 'model', 'name']).agg(decisions=('time', 'size'), p50_ms=('latency_ms', 'median')).reset_index().rename(columns={'name': 'decision'}), hide_index=True)
+
+st.subheader("Prometheus metrics")
+if prometheus_port:
+    st.caption(f"Scraped at http://<host>:{prometheus_port}/metrics")
+else:
+    st.caption("Set prometheus_port in the [telemetry] secrets to serve these metrics at /metrics")
+st.code(telemetry.prometheus_text(), language='text')
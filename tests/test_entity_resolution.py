@@ -0,0 +1,51 @@
+import pytest
+
+from bi_agent.entity_resolution import NUMBERLESS_PENALTY, SUBSET_MATCH_SCORE, TOKEN_MATCH_SCORE, EntityIndex
+
+
+GL_ACCOUNTS = EntityIndex(['GL 6010 Flooring Repairs', 'GL 6020 HVAC Maintenance', 'GL 6030 New Flooring Installation'])
+HOSPITALS   = EntityIndex([f'Hospital {number:04d}' for number in range(1, 41)])
+VENDORS     = EntityIndex(['Mallory Safety & Supply LLC', 'Acme Flooring Inc', 'Acme HVAC Inc'])
+
+
+def test_exact_and_reordered_names():
+    assert VENDORS.resolve('mallory safety and supply llc') == ('Mallory Safety & Supply LLC', 1.0)
+    assert VENDORS.resolve('Supply Mallory Safety &') == ('Mallory Safety & Supply LLC', TOKEN_MATCH_SCORE)
+
+
+# Names without numbers against values with numbers: found, with a lower confidence
+@pytest.mark.parametrize('name, value', [
+    ('Flooring Repairs', 'GL 6010 Flooring Repairs'),
+    ('hvac',             'GL 6020 HVAC Maintenance'),
+    ('new flooring',     'GL 6030 New Flooring Installation'),
+])
+def test_numberless_name_matches_value_with_numbers(name, value):
+    resolved, confidence = GL_ACCOUNTS.resolve(name)
+    assert resolved == value
+    assert confidence == round(SUBSET_MATCH_SCORE * NUMBERLESS_PENALTY, 3)
+
+
+# Found by trigrams ('repair' is not a word of any value), with the same penalty
+def test_numberless_misspelled_name_matches_value_with_numbers():
+    resolved, confidence = GL_ACCOUNTS.resolve('Flooring Repair')
+    assert resolved == 'GL 6010 Flooring Repairs' and confidence < SUBSET_MATCH_SCORE * NUMBERLESS_PENALTY
+
+
+# Values that differ only by their numbers cannot be told apart by a name without numbers
+def test_numberless_name_of_numbered_values_is_ambiguous():
+    assert HOSPITALS.resolve('hospital')[0] is None
+    assert GL_ACCOUNTS.resolve('flooring')[0] is None
+
+
+@pytest.mark.parametrize('name, value', [('hospital 3', 'Hospital 0003'), ('Hospital 30', 'Hospital 0030'), ('hospitl 0012', 'Hospital 0012')])
+def test_numbers_must_match(name, value):
+    assert HOSPITALS.resolve(name)[0] == value
+
+
+def test_unknown_numbers_match_nothing():
+    assert HOSPITALS.resolve('Hospital 0099') == (None, 0.0)
+    assert GL_ACCOUNTS.resolve('GL 7010 Flooring Repairs') == (None, 0.0)
+
+
+def test_unrelated_name_matches_nothing():
+    assert VENDORS.resolve('Globex Medical')[0] is None
@@ -0,0 +1,61 @@
+import pytest
+
+from bi_agent.json_repair import compile_validator, loads_tolerant, repair_json
+
+
+def test_strict_json_is_not_repaired():
+    assert loads_tolerant('{"a": [1, 2]}') == ({'a': [1, 2]}, False)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("{'function': 'market_share_report', 'top_n': 5}",          {'function': 'market_share_report', 'top_n': 5}),
+    ("{'title': 'Vendor\\'s spend', 'note': 'a \"quoted\" word'}", {'title': "Vendor's spend", 'note': 'a "quoted" word'}),
+    ("{'fiscal_calendar': True, 'top_n': None}",                 {'fiscal_calendar': True, 'top_n': None}),
+    ("{function: 'x', metrics: ['total_amount',],}",             {'function': 'x', 'metrics': ['total_amount']}),
+])
+def test_single_quoted_and_python_literals(text, expected):
+    assert loads_tolerant(text) == (expected, True)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"function": "generic_spend_report", "metrics": ["total_amount", "total_vol',  {'function': 'generic_spend_report', 'metrics': ['total_amount', 'total_vol']}),
+    ('{"function": "generic_spend_report", "metrics": ["total_amount",',             {'function': 'generic_spend_report', 'metrics': ['total_amount']}),
+    ('{"function": "generic_spend_report", "title":',                                {'function': 'generic_spend_report', 'title': None}),
+    ('{"a": {"b": [1, 2',                                                            {'a': {'b': [1, 2]}}),
+])
+def test_truncated(text, expected):
+    assert loads_tolerant(text) == (expected, True)
+
+
+def test_object_inside_prose():
+    text = 'Here is the report:\n```json\n{"function": "market_share_report"}\n```\nAnything else? {"ignored": 1}'
+    assert loads_tolerant(text) == ({'function': 'market_share_report'}, True)
+
+
+def test_no_object():
+    with pytest.raises(ValueError):
+        repair_json('I cannot answer that.')
+
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'title'          : {'type': 'string'},
+        'top_n'          : {'type': 'integer'},
+        'fiscal_calendar': {'type': 'boolean'},
+        'share_metric'   : {'type': 'string', 'enum': ['volume_share', 'spend_share']},
+        'vendor_filter'  : {'type': 'array', 'items': {'type': 'string'}},
+    },
+    'required': ['title'],
+}
+
+
+def test_validator_coerces_repaired_values():
+    value, _ = loads_tolerant("{'title': 'Top vendors', 'top_n': '10', 'fiscal_calendar': 'True', 'share_metric': 'Spend_Share', 'vendor_filter': 'Vendor 00042', 'extra': 1")
+    assert compile_validator(SCHEMA)(value) == {'title': 'Top vendors', 'top_n': 10, 'fiscal_calendar': True, 'share_metric': 'spend_share', 'vendor_filter': ['Vendor 00042']}
+
+
+def test_validator_lists_every_problem():
+    with pytest.raises(ValueError) as error:
+        compile_validator(SCHEMA)({'top_n': 'ten', 'share_metric': 'share'})
+    assert 'top_n' in str(error.value) and 'share_metric' in str(error.value) and 'title is required' in str(error.value)
@@ -0,0 +1,34 @@
+import json
+import pytest
+
+from bi_agent.json_report_agent import parse_report, report_tool_call
+from bi_agent.report_tools import report_tools
+
+
+QUESTION = 'Who are the top HVAC Maintenance vendors this year?'
+
+# Answers of Llama-2 as the failover of the model router (page 2) gets them: no user_request, titles sometimes empty
+FAILOVER_ANSWERS = [
+    '{"function": "generic_spend_report", "title": "", "category_filter": ["HVAC Maintenance"], "time_period_filter": ["YEAR TO DATE"], "metrics": ["total_amount"], "dimensions": ["vendor_name"]}',
+    '{"function": "hospital_benchmarking_spend_report", "title": "Hospital 0010 benchmarking", "hospital_filter": ["Hospital 0010"], "fiscal_calendar": false}',
+    '{"function": "market_share_report", "title": "HVAC market share", "category_filter": ["HVAC Maintenance"]}',
+    '{"function": "vendor_market_share_map", "title": "", "vendor_filter": ["Vendor 00042"]}',
+]
+
+
+@pytest.mark.parametrize('output', FAILOVER_ANSWERS)
+def test_failover_report_passes_the_page_2_validator(output):
+    report = parse_report(output)
+    assert report is not None
+
+    tool_call = report_tool_call(report, 'call_llama2_0', QUESTION)
+    arguments, _ = report_tools.parse_arguments(tool_call['function']['name'], tool_call['function']['arguments'])
+    assert arguments['user_request'] == QUESTION
+    assert arguments['title'] == (json.loads(output)['title'] or QUESTION)
+
+
+def test_failover_keeps_the_user_request_of_the_report():
+    report = parse_report('{"function": "market_share_report", "title": "HVAC market share", "user_request": "HVAC shares"}')
+    arguments = json.loads(report_tool_call(report, 'call_llama2_0', QUESTION)['function']['arguments'])
+    assert arguments['user_request'] == 'HVAC shares'
+    assert arguments['share_metric'] == 'spend_share'
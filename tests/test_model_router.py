@@ -0,0 +1,35 @@
+import pytest
+
+from bi_agent.model_router import ModelRouter
+
+
+def accept(answer):
+    pass
+
+def reject(answer):
+    raise ValueError('invalid tool arguments')
+
+
+def test_router_needs_models():
+    with pytest.raises(ValueError):
+        ModelRouter(models=[])
+
+
+def test_router_escalates_and_returns_the_last_answer():
+    router = ModelRouter(models=['small', 'large'])
+    model, answer, decisions = router.route('page', lambda model, timeout: f'answer of {model}', reject)
+    assert (model, answer) == ('large', 'answer of large')
+    assert [decision['decision'] for decision in decisions] == ['escalated', 'escalated']
+
+
+def test_router_fails_over_on_timeout():
+    def call(model, timeout):
+        raise TimeoutError('timed out')
+
+    router = ModelRouter(models=['small'], fallback_model='llama-2')
+    model, answer, decisions = router.route('page', call, accept, fallback=lambda timeout: 'answer of llama-2')
+    assert (model, answer) == ('llama-2', 'answer of llama-2')
+    assert [decision['decision'] for decision in decisions] == ['failed over', 'fallback']
+
+    with pytest.raises(TimeoutError):
+        router.route('page', call, accept)
@@ -0,0 +1,65 @@
+import datetime
+import numpy as np
+import pytest
+
+from bi_agent.periods import CALENDAR_LAST_YEAR, interval_row_ranges, resolve_period, resolve_periods
+from bi_agent.spend_engine import SpendEngine
+from bi_agent.synthetic import generate_transactions
+
+
+TODAY = datetime.date(2024, 5, 15)
+
+
+@pytest.mark.parametrize('name', ['MONTH 2024-13', 'MONTH 2024-0', 'MONTH 2024-00'])
+def test_month_out_of_range(name):
+    with pytest.raises(ValueError):
+        resolve_period(name, today=TODAY)
+
+
+def test_month():
+    assert resolve_period('MONTH 2024-2', today=TODAY) == (datetime.date(2024, 2, 1), datetime.date(2024, 3, 1))
+    assert resolve_period('MONTH 2024-12', today=TODAY) == (datetime.date(2024, 12, 1), datetime.date(2025, 1, 1))
+
+
+@pytest.mark.parametrize('name', ['FROM 2024-01-01 TO 9999-12-31', 'FROM 2024-01-01 TO 2300-06-30'])
+def test_far_future_end_is_clamped(name):
+    assert resolve_period(name, today=TODAY) == (datetime.date(2024, 1, 1), datetime.date(CALENDAR_LAST_YEAR + 1, 1, 1))
+
+
+def test_far_future_start_is_clamped():
+    start, end = resolve_period('FROM 9999-01-01 TO 9999-12-31', today=TODAY)
+    assert start == datetime.date(CALENDAR_LAST_YEAR, 12, 31) and end == datetime.date(CALENDAR_LAST_YEAR + 1, 1, 1)
+
+
+def test_last_days_out_of_range():
+    with pytest.raises(ValueError):
+        resolve_period('LAST 1000000 DAYS', today=TODAY)
+
+
+def test_stly_after_range():
+    intervals = resolve_periods(['FROM 2024-03-01 TO 2024-03-31', 'STLY'], today=TODAY)
+    assert intervals == [(datetime.date(2024, 3, 1), datetime.date(2024, 4, 1)), (datetime.date(2023, 3, 1), datetime.date(2023, 4, 1))]
+
+
+def test_stly_after_leap_day_range():
+    intervals = resolve_periods(['FROM 2024-02-29 TO 2024-02-29', 'STLY'], today=TODAY)
+    assert intervals[1] == (datetime.date(2023, 2, 28), datetime.date(2023, 3, 1))
+
+
+def test_stly_needs_a_previous_period():
+    with pytest.raises(ValueError):
+        resolve_periods(['STLY'], today=TODAY)
+
+
+# Bounds that nanosecond datetimes cannot hold (after 2262) find the last row instead of overflowing
+def test_row_ranges_past_nanosecond_range():
+    datetimes = np.array(['2024-01-01T10:00', '2024-06-01T10:00', '2024-12-31T23:00'], dtype='M8[ns]')
+    intervals = [(datetime.date(2024, 6, 1), datetime.date(CALENDAR_LAST_YEAR + 1, 1, 1)), (datetime.date(2300, 1, 1), datetime.date(2301, 1, 1))]
+    assert interval_row_ranges(datetimes, intervals) == [(1, 3), (3, 3)]
+
+
+def test_report_with_far_future_end():
+    engine = SpendEngine(generate_transactions(2000, seed=0))
+    first  = engine.datetime[0].astype('M8[D]').astype(datetime.date).isoformat()
+    report = engine.generic_spend_report(metrics=['total_volume'], time_period_filter_list=[f'FROM {first} TO 9999-12-31'])
+    assert report['total_volume'].sum() == len(engine)